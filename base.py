@@ -1,3 +1,5 @@
+import os
+import sys
 import time
 import logging
 from selenium import webdriver
@@ -8,6 +10,10 @@ from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException, NoSuchElementException, ElementClickInterceptedException
 from selenium.webdriver.common.keys import Keys
 
+# ロケーターは src/locators.py で一元管理している
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+from locators import registry
+
 # ログ設定
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s: %(message)s')
 
@@ -17,15 +23,23 @@ def wait_and_log(seconds, message):
     time.sleep(seconds)
     logging.info(f"{seconds}秒の待機が完了しました。")
 
+def located(condition, name):
+    """
+    ロケーターの探索戦略のチェーンのいずれかで条件が成立するまで待つ条件を返す
+
+    :param condition: (By, 値) を受け取る expected_conditions の関数
+    :param name: src/locators.py に登録されたロケーター名
+    :return: WebDriverWait.until に渡す条件
+    """
+    return EC.any_of(*(condition(strategy) for strategy in registry.get(name).strategies))
+
 def click_login_link(driver):
-    # ログインリンクのXPathを詳細に指定
-    login_link_xpath = "//div[contains(@class, 'x6s0dn4') and contains(@class, 'x78zum5')]//a[@role='link']//div[contains(text(), 'ログイン')]"
     
     try:
         # ログインリンクが表示されるまで待機
         logging.info("ログインリンクを探しています...")
         login_link = WebDriverWait(driver, 20).until(
-            EC.presence_of_element_located((By.XPATH, login_link_xpath))
+            located(EC.presence_of_element_located, 'login_link')
         )
         
         # リンクが画面内に表示されるまでスクロール
@@ -34,7 +48,7 @@ def click_login_link(driver):
         
         # リンクが確実にクリック可能になるまで待機
         WebDriverWait(driver, 10).until(
-            EC.element_to_be_clickable((By.XPATH, login_link_xpath))
+            located(EC.element_to_be_clickable, 'login_link')
         )
         
         # JavaScriptを使用してクリックを実行
@@ -43,7 +57,7 @@ def click_login_link(driver):
         
         # クリックが成功したかを確認（例：ログインフォームの要素が表示されるまで待機）
         WebDriverWait(driver, 10).until(
-            EC.presence_of_element_located((By.XPATH, "//input[@name='username' or @name='email' or contains(@placeholder, 'ユーザーネーム') or contains(@placeholder, 'メールアドレス')]"))
+            located(EC.presence_of_element_located, 'username_input')
         )
         logging.info("ログインリンクのクリックに成功しました。")
         wait_and_log(10, "ログインフォームが表示されるまで")
@@ -61,9 +75,8 @@ def click_login_link(driver):
 def login(driver, username, password):
     try:
         # ユーザー名/メールアドレス入力
-        username_xpath = "//input[@name='username' or @name='email' or contains(@placeholder, 'ユーザーネーム') or contains(@placeholder, 'メールアドレス')]"
         username_input = WebDriverWait(driver, 10).until(
-            EC.presence_of_element_located((By.XPATH, username_xpath))
+            located(EC.presence_of_element_located, 'username_input')
         )
         username_input.clear()  # 既存の入力をクリア
         username_input.send_keys(username)
@@ -72,9 +85,8 @@ def login(driver, username, password):
         wait_and_log(10, "ユーザー名/メールアドレス入力後")
 
         # パスワード入力
-        password_xpath = "//input[@name='password' or contains(@placeholder, 'パスワード')]"
         password_input = WebDriverWait(driver, 10).until(
-            EC.presence_of_element_located((By.XPATH, password_xpath))
+            located(EC.presence_of_element_located, 'password_input')
         )
         password_input.clear()  # 既存の入力をクリア
         password_input.send_keys(password)
@@ -82,9 +94,8 @@ def login(driver, username, password):
         wait_and_log(10, "パスワード入力後")
 
         # ログインボタンクリック
-        login_button_xpath = "//div[@role='button']//div[contains(@class, 'x6s0dn4') and contains(@class, 'x78zum5')]//div[contains(text(), 'ログイン')]"
         login_button = WebDriverWait(driver, 10).until(
-            EC.presence_of_element_located((By.XPATH, login_button_xpath))
+            located(EC.presence_of_element_located, 'login_button')
         )
         
         # ボタンが表示されるまでスクロール
@@ -97,7 +108,7 @@ def login(driver, username, password):
         
         # ログイン成功の確認（例：ホームページの特定の要素が表示されるまで待機）
         WebDriverWait(driver, 20).until(
-            EC.presence_of_element_located((By.XPATH, "//div[contains(text(), 'Post') or contains(text(), '投稿')]"))
+            located(EC.presence_of_element_located, 'logged_in')
         )
         logging.info("ログインに成功しました。")
         wait_and_log(10, "ログイン成功後")
@@ -116,9 +127,8 @@ def post_thread(driver, caption, image_paths):
     try:
         # 投稿ボタンをクリック（最初の投稿ボタン）
         logging.info("最初の投稿ボタンを探しています...")
-        post_button_xpath = "//div[contains(@class, 'x1i10hfl') and contains(@class, 'x1ypdohk') and contains(@class, 'xdl72j9')]//div[contains(text(), 'Post') or contains(text(), '投稿')]"
         post_button = WebDriverWait(driver, 20).until(
-            EC.element_to_be_clickable((By.XPATH, post_button_xpath))
+            located(EC.element_to_be_clickable, 'post_button')
         )
         driver.execute_script("arguments[0].click();", post_button)
         logging.info("最初の投稿ボタンをクリックしました。")
@@ -127,7 +137,7 @@ def post_thread(driver, caption, image_paths):
         # 画像のアップロード
         logging.info("画像アップロードフィールドを探しています...")
         file_input = WebDriverWait(driver, 20).until(
-            EC.presence_of_element_located((By.XPATH, "//input[@type='file']"))
+            located(EC.presence_of_element_located, 'file_input')
         )
         file_input.send_keys('\n'.join(image_paths))
         logging.info("画像をアップロードしました。")
@@ -136,7 +146,7 @@ def post_thread(driver, caption, image_paths):
         # キャプションの入力
         logging.info("キャプション入力フィールドを探しています...")
         caption_input = WebDriverWait(driver, 20).until(
-            EC.presence_of_element_located((By.XPATH, "//div[@role='textbox']"))
+            located(EC.presence_of_element_located, 'caption_input')
         )
         caption_input.send_keys(caption)
         logging.info("キャプションを入力しました。")
@@ -144,11 +154,10 @@ def post_thread(driver, caption, image_paths):
 
         # # 最終Postボタンの特定と操作
         logging.info("最終Postボタンを探しています...")
-        final_post_button_xpath = "//div[@role='button']//div[contains(text(), 'Post') or contains(text(), '投稿')]"
         
         # すべてのPostボタンを取得
         all_post_buttons = WebDriverWait(driver, 20).until(
-            EC.presence_of_all_elements_located((By.XPATH, final_post_button_xpath))
+            located(EC.presence_of_all_elements_located, 'final_post_button')
         )
         
         # 2つ以上のボタンがあることを確認
@@ -170,9 +179,8 @@ def post_thread(driver, caption, image_paths):
 
         # 投稿成功の確認
         logging.info("投稿成功メッセージを待機しています...")
-        success_message_xpath = "//div[contains(text(), 'Your thread was posted') or contains(text(), 'スレッドが投稿されました')]"
         WebDriverWait(driver, 30).until(
-            EC.presence_of_element_located((By.XPATH, success_message_xpath))
+            located(EC.presence_of_element_located, 'post_success')
         )
         logging.info("投稿に成功しました。")
         wait_and_log(5, "投稿成功確認後")
@@ -0,0 +1,260 @@
+# bench_api.py
+#
+# Threads APIのスタブサーバーに対して ThreadsApiPublisher で投稿し、1投稿あたりのリクエスト数・
+# 新規接続数・所要時間を出力するベンチマーク。スタブサーバーのみを起動して実際の自動投稿から使うこともできる。
+#
+# 使い方: python benchmarks/bench_api.py [--accounts 5] [--posts 4] [--latency-ms 50] [--throttle-every 0]
+#         python benchmarks/bench_api.py --serve 8765   # [Publisher] api_base_url = http://127.0.0.1:8765/v1.0
+
+import argparse
+import configparser
+import itertools
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'src'))
+
+from PIL import Image
+from metrics import metrics
+from publishers import ThreadsApiPublisher
+from utils import RetryableError
+
+
+class StubState:
+    """スタブサーバーの状態（作成したコンテナと公開した投稿）"""
+
+    def __init__(self, latency=0.0, throttle_every=0, processing_polls=0):
+        self.latency = latency
+        self.throttle_every = throttle_every
+        self.processing_polls = processing_polls
+        self.containers = {}
+        self.published = []
+        self.requests = 0
+        self.throttled = 0
+        self.connections = 0
+        self._ids = itertools.count(17841400000000000)
+        self.lock = threading.Lock()
+
+    def new_id(self):
+        return str(next(self._ids))
+
+
+class ThreadsApiStubHandler(BaseHTTPRequestHandler):
+    """Threads APIの投稿関連のエンドポイントを模したHTTPハンドラ（keep-alive対応）"""
+
+    protocol_version = 'HTTP/1.1'
+    state = None
+
+    def setup(self):
+        super().setup()
+        with self.state.lock:
+            self.state.connections += 1
+
+    def _send(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status, code, message):
+        self._send(status, {'error': {'message': message, 'type': 'OAuthException', 'code': code}})
+
+    def _params(self):
+        parts = urlsplit(self.path)
+        params = {k: v[0] for k, v in parse_qs(parts.query).items()}
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            params.update({k: v[0] for k, v in parse_qs(self.rfile.read(length).decode('ascii')).items()})
+        return parts.path, params
+
+    def _handle(self):
+        path, params = self._params()
+        state = self.state
+        time.sleep(state.latency)
+        with state.lock:
+            state.requests += 1
+            throttled = state.throttle_every and state.requests % state.throttle_every == 0
+            state.throttled += 1 if throttled else 0
+        if throttled:
+            self._send(429, {'error': {'message': 'Application request limit reached', 'code': 4}}, {'Retry-After': '1'})
+            return
+        if not params.get('access_token'):
+            self._error(400, 190, 'Invalid OAuth access token.')
+            return
+
+        segments = [s for s in path.split('/') if s]
+        if segments == ['refresh_access_token']:
+            self._send(200, {'access_token': f"refreshed-{state.new_id()}", 'token_type': 'bearer', 'expires_in': 5184000})
+        elif self.command == 'POST' and len(segments) == 3 and segments[2] == 'threads':
+            media_type = params.get('media_type')
+            if media_type == 'IMAGE' and not params.get('image_url'):
+                self._error(400, 100, 'image_url is required')
+                return
+            if media_type == 'CAROUSEL':
+                children = params.get('children', '').split(',')
+                with state.lock:
+                    missing = [c for c in children if c not in state.containers]
+                if missing or len(children) < 2:
+                    self._error(400, 100, f"invalid children: {missing}")
+                    return
+            container_id = state.new_id()
+            with state.lock:
+                state.containers[container_id] = {'params': params, 'polls': 0, 'status': 'IN_PROGRESS'}
+            self._send(200, {'id': container_id})
+        elif self.command == 'POST' and len(segments) == 3 and segments[2] == 'threads_publish':
+            with state.lock:
+                container = state.containers.get(params.get('creation_id'))
+                if container is None or container['status'] != 'FINISHED':
+                    container = None
+                else:
+                    container['status'] = 'PUBLISHED'
+                    media_id = state.new_id()
+                    state.published.append(media_id)
+            if container is None:
+                self._error(400, 24, 'The media is not ready for publishing')
+                return
+            self._send(200, {'id': media_id})
+        elif self.command == 'GET' and len(segments) == 2:
+            with state.lock:
+                container = state.containers.get(segments[1])
+                if container is not None:
+                    container['polls'] += 1
+                    if container['status'] == 'IN_PROGRESS' and container['polls'] > state.processing_polls:
+                        container['status'] = 'FINISHED'
+                    status = container['status']
+            if container is None:
+                self._error(404, 100, 'Unsupported get request.')
+                return
+            self._send(200, {'id': segments[1], 'status': status})
+        else:
+            self._error(404, 100, f"Unknown path: {path}")
+
+    do_GET = _handle
+    do_POST = _handle
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server(state, port=0):
+    """
+    スタブサーバーを別スレッドで起動する
+
+    :return: (サーバー, APIのベースURL)のタプル
+    """
+    handler = type('Handler', (ThreadsApiStubHandler,), {'state': state})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1.0"
+
+
+def build_config(api_base_url, workdir):
+    """ベンチマーク用の [Publisher] 設定を作成する"""
+    config = configparser.ConfigParser()
+    config.read_dict({
+        'Publisher': {
+            'backend': 'api',
+            'api_base_url': api_base_url,
+            'media_base_url': 'https://media.example.com/threads',
+            'media_root': os.path.join(workdir, 'media'),
+            'token_file': os.path.join(workdir, 'tokens.json'),
+            'min_request_interval': '0',
+            'throttle_delay': '1',
+            'status_poll_interval': '0.2',
+        },
+    })
+    return config
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Threads APIのスタブサーバーに対する投稿のベンチマーク")
+    parser.add_argument('--accounts', type=int, default=5, help="アカウント数（同時に投稿する数）")
+    parser.add_argument('--posts', type=int, default=4, help="アカウントあたりの投稿数")
+    parser.add_argument('--latency-ms', type=float, default=50, help="スタブサーバーの応答遅延（ミリ秒）")
+    parser.add_argument('--throttle-every', type=int, default=0, help="N回に1回レート制限（429）を返す（0で無効）")
+    parser.add_argument('--processing-polls', type=int, default=0, help="コンテナが処理中と応答する状況確認の回数")
+    parser.add_argument('--serve', type=int, metavar='PORT', help="スタブサーバーのみを起動する")
+    parser.add_argument('--json', help="結果をJSONで保存するパス")
+    args = parser.parse_args()
+
+    state = StubState(args.latency_ms / 1000, args.throttle_every, args.processing_polls)
+    if args.serve is not None:
+        server, url = start_stub_server(state, args.serve)
+        print(f"スタブサーバーを起動しました: {url}（Ctrl+Cで終了）")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            server.shutdown()
+        return 0
+
+    server, api_base_url = start_stub_server(state)
+    workdir = tempfile.mkdtemp(prefix='threads_api_bench_')
+    media_dir = os.path.join(workdir, 'media', 'ab')
+    os.makedirs(media_dir)
+    image_paths = []
+    for name in ('a.jpg', 'b.jpg'):
+        path = os.path.join(media_dir, name)
+        Image.new('RGB', (64, 64), 'white').save(path)
+        image_paths.append(path)
+
+    publisher = ThreadsApiPublisher.from_config(build_config(api_base_url, workdir))
+    accounts = [{'username': f"bench_{i}", 'password': '-', 'threads_access_token': f"token-{i}"}
+                for i in range(args.accounts)]
+
+    def post_all(account):
+        durations = []
+        for i in range(args.posts):
+            start = time.perf_counter()
+            for attempt in range(5):
+                try:
+                    container_id = publisher.create_container(account, f"ベンチマーク投稿 {i}", image_paths)
+                    publisher.publish_container(account, container_id)
+                    break
+                except RetryableError:
+                    continue
+            durations.append(time.perf_counter() - start)
+        return durations
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.accounts) as executor:
+        durations = [d for result in executor.map(post_all, accounts) for d in result]
+    elapsed = time.perf_counter() - start
+    publisher.close()
+    server.shutdown()
+
+    posts = len(state.published)
+    result = {
+        'accounts': args.accounts,
+        'posts': posts,
+        'requests': state.requests,
+        'requests_per_post': round(state.requests / posts, 2) if posts else None,
+        'server_connections': state.connections,
+        'client_connections_reused': metrics.counter_total('api_connection') - state.connections,
+        'throttled': state.throttled,
+        'post_p50_ms': round(statistics.median(durations) * 1000, 1),
+        'post_max_ms': round(max(durations) * 1000, 1),
+        'posts_per_second': round(posts / elapsed, 2),
+    }
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
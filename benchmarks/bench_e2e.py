@@ -0,0 +1,189 @@
+# bench_e2e.py
+#
+# ローカルのThreads代替ページに対して、実際の ThreadsAutomator をヘッドレスChromeで実行するベンチマーク。
+# フェーズごとの所要時間と、アカウント数 1..N での処理スループットを出力する。
+#
+# 使い方: python benchmarks/bench_e2e.py [--accounts 3] [--latency-ms 200] [--page-latency-ms 300] [--browser-mode lean]
+# 必要なもの: Google Chrome と、対応する chromedriver（Selenium Manager で自動取得される）
+
+import argparse
+import configparser
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'src'))
+
+from PIL import Image
+import main as automation_main
+from post_manager import PostManager
+from threads_automator import ThreadsAutomator
+from driver_pool import browser_rss_mb
+
+PHASES = ('prepare_post', 'setup_driver', 'load_page', 'login', 'post_thread', 'cleanup')
+
+
+class StandinHandler(SimpleHTTPRequestHandler):
+    """代替ページを返すHTTPハンドラ。ページの応答を page_latency 秒遅らせる"""
+
+    page = b''
+    page_latency = 0.0
+
+    def do_GET(self):
+        time.sleep(self.page_latency)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(self.page)))
+        self.end_headers()
+        self.wfile.write(self.page)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(latency_ms, page_latency_ms):
+    """
+    代替ページを配信するHTTPサーバーを別スレッドで起動する
+
+    :return: (サーバー, ページのURL)のタプル
+    """
+    with open(os.path.join(BENCH_DIR, 'threads_standin.html'), 'r', encoding='utf-8') as f:
+        page = f.read().replace('__LATENCY_MS__', str(int(latency_ms)))
+    handler = type('Handler', (StandinHandler,), {'page': page.encode('utf-8'), 'page_latency': page_latency_ms / 1000})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/?hl=ja"
+
+
+def create_post_library(directory, count):
+    """ベンチマーク用の投稿セット（キャプション1つと画像2枚）を作成する"""
+    for i in range(count):
+        post_dir = os.path.join(directory, f"set_{i:04d}")
+        os.makedirs(post_dir)
+        with open(os.path.join(post_dir, 'caption.txt'), 'w', encoding='utf-8') as f:
+            f.write(f"ベンチマーク投稿 {i}")
+        for name in ('a.jpg', 'b.jpg'):
+            Image.effect_noise((1600, 1200), 40).convert('RGB').save(os.path.join(post_dir, name), quality=90)
+
+
+def build_config(base_url, posts_directory, concurrency, browser_mode):
+    """ベンチマーク用の設定を作成する（ランダムな遅延やペーシングは無効にする）"""
+    config = configparser.ConfigParser()
+    config.read_dict({
+        'Paths': {'posts_directory': posts_directory},
+        'Settings': {
+            'headless': 'true',
+            'base_url': base_url,
+            'max_concurrent_accounts': str(concurrency),
+            'account_timeout': '300',
+        },
+        'Cycle': {'start_delay_min': '0', 'start_delay_max': '0'},
+        'Browser': {'mode': browser_mode},
+        'Waits': {'timeout': '15', 'post_confirm_timeout': '15', 'poll_frequency': '0.05'},
+        'Watermark': {'enabled': 'true', 'font_size': '20'},
+    })
+    return config
+
+
+def timed_automator_class(timings, rss, lock):
+    """各フェーズの所要時間を timings に、終了直前のブラウザのメモリ使用量を rss に記録する ThreadsAutomator のサブクラスを作る"""
+
+    class TimedAutomator(ThreadsAutomator):
+        def _cleanup_driver(self, driver):
+            rss_mb = browser_rss_mb(driver)
+            if rss_mb is not None:
+                with lock:
+                    rss.append(rss_mb)
+            super()._cleanup_driver(driver)
+
+        def _timed(self, phase, func):
+            start = time.perf_counter()
+            try:
+                return func()
+            finally:
+                with lock:
+                    timings.setdefault(phase, []).append(time.perf_counter() - start)
+
+    for phase in PHASES:
+        def method(self, _phase=phase):
+            return self._timed(_phase, getattr(super(TimedAutomator, self), _phase))
+        setattr(TimedAutomator, phase, method)
+    return TimedAutomator
+
+
+def summarize(values):
+    """所要時間のリストから平均・中央値・最大値（ミリ秒）を求める"""
+    return {
+        'count': len(values),
+        'mean_ms': round(statistics.mean(values) * 1000, 1),
+        'p50_ms': round(statistics.median(values) * 1000, 1),
+        'max_ms': round(max(values) * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ThreadsAutomator のエンドツーエンドベンチマーク")
+    parser.add_argument('--accounts', type=int, default=3, help="計測するアカウント数の上限 N（1..N を順に計測）")
+    parser.add_argument('--latency-ms', type=int, default=200, help="代替ページの各操作への応答遅延（ミリ秒）")
+    parser.add_argument('--page-latency-ms', type=int, default=300, help="ページ読み込みの応答遅延（ミリ秒）")
+    parser.add_argument('--browser-mode', choices=('normal', 'lean'), default='normal', help="ブラウザの動作モード")
+    parser.add_argument('--json', help="結果をJSONで保存するパス")
+    args = parser.parse_args()
+
+    server, base_url = start_server(args.latency_ms, args.page_latency_ms)
+    workdir = tempfile.mkdtemp(prefix='threads_bench_')
+    original_cwd = os.getcwd()
+    # クッキー・キャッシュ・スクリーンショットは作業ディレクトリ内に出力させる
+    os.chdir(workdir)
+    os.makedirs('logs')
+    posts_directory = os.path.join(workdir, 'posts')
+    create_post_library(posts_directory, args.accounts * (args.accounts + 1) // 2 + 1)
+
+    results = []
+    try:
+        for n in range(1, args.accounts + 1):
+            timings = {}
+            rss = []
+            automation_main.ThreadsAutomator = timed_automator_class(timings, rss, threading.Lock())
+            config = build_config(base_url, posts_directory, n, args.browser_mode)
+            accounts = [{'username': f"bench_user_{i}", 'password': 'bench'} for i in range(n)]
+            post_manager = PostManager(posts_directory)
+
+            start = time.perf_counter()
+            succeeded = automation_main.run_automation(config, accounts, post_manager)
+            elapsed = time.perf_counter() - start
+
+            result = {
+                'accounts': n,
+                'browser_mode': args.browser_mode,
+                'succeeded': succeeded,
+                'wall_seconds': round(elapsed, 2),
+                'accounts_per_hour': round(n / elapsed * 3600, 1),
+                'phases': {phase: summarize(timings[phase]) for phase in PHASES if phase in timings},
+                # psutil が無い環境では計測しない
+                'rss_mb_mean': round(statistics.mean(rss), 1) if rss else None,
+            }
+            results.append(result)
+            print(f"\n=== アカウント数 {n}: 成功 {succeeded}/{n}, {elapsed:.2f}秒, {result['accounts_per_hour']} アカウント/時")
+            for phase, stats in result['phases'].items():
+                print(f"  {phase:<13} 平均 {stats['mean_ms']:>9.1f} ms  中央値 {stats['p50_ms']:>9.1f} ms  最大 {stats['max_ms']:>9.1f} ms")
+            if result['rss_mb_mean'] is not None:
+                print(f"  ブラウザのメモリ使用量 平均 {result['rss_mb_mean']:.1f} MB/セッション")
+    finally:
+        os.chdir(original_cwd)
+        server.shutdown()
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    return 0 if all(r['succeeded'] == r['accounts'] for r in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
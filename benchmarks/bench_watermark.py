@@ -0,0 +1,64 @@
+# bench_watermark.py
+#
+# 透かし描画のマイクロベンチマーク。
+# 従来の全面合成と、キャッシュ済みスプライトを使った領域合成の処理時間を比較し、出力が一致することを確認する。
+#
+# 使い方: python benchmarks/bench_watermark.py [--width 4000] [--height 3000] [--repeat 10]
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from PIL import Image, ImageChops, ImageColor, ImageDraw, ImageFont
+from image_processor import render_watermark
+
+
+def legacy_watermark(img, text, font_size, font_color, opacity, position_x, position_y):
+    """従来の ImageProcessor.add_watermark と同じ全面合成"""
+    watermark = Image.new('RGBA', img.size, (0,0,0,0))
+    draw = ImageDraw.Draw(watermark)
+    font = ImageFont.load_default().font_variant(size=font_size)
+    bbox = draw.textbbox((0, 0), text, font=font)
+    x = int((img.width - (bbox[2] - bbox[0])) * position_x)
+    y = int((img.height - (bbox[3] - bbox[1])) * position_y)
+    draw.text((x, y), text, font=font, fill=(*ImageColor.getrgb(font_color), opacity))
+    return Image.alpha_composite(img.convert('RGBA'), watermark).convert('RGB')
+
+
+def measure(func, img, args, repeat):
+    """func を repeat 回実行し、1回あたりの平均秒数と最後の結果を返す"""
+    result = None
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func(img, *args)
+    return (time.perf_counter() - start) / repeat, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="透かし描画のベンチマーク")
+    parser.add_argument('--width', type=int, default=4000)
+    parser.add_argument('--height', type=int, default=3000)
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    img = Image.effect_noise((args.width, args.height), 64).convert('RGB')
+    watermark_args = ("@haruka_uraaka_10", 20, 'white', 50, 0.6, 0.5)
+
+    legacy_time, legacy_result = measure(legacy_watermark, img, watermark_args, args.repeat)
+    region_time, region_result = measure(render_watermark, img, watermark_args, args.repeat)
+
+    identical = ImageChops.difference(legacy_result, region_result).getbbox() is None
+    megapixels = args.width * args.height / 1_000_000
+    print(f"画像サイズ: {args.width}x{args.height} ({megapixels:.1f}MP), 試行回数: {args.repeat}")
+    print(f"従来の全面合成: {legacy_time * 1000:.1f} ms/枚")
+    print(f"領域合成:       {region_time * 1000:.1f} ms/枚")
+    print(f"高速化率:       {legacy_time / region_time:.1f}倍")
+    print(f"出力の一致:     {'一致' if identical else '不一致'}")
+    return 0 if identical else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,192 @@
+# simulate.py
+#
+# 実際のChromeと壁時計を使わずに、スケジューラ → PostManager → ImageProcessor → ThreadsAutomator の
+# 処理全体を仮想時計で実行するシミュレーション。数週間分のスケジュールと数百アカウントを数秒〜数分で実行し、
+# Python側の処理のオーバーヘッドだけを計測する。
+#
+# 使い方: python benchmarks/simulate.py [--accounts 100] [--days 7] [--failure-rate 0.01] [--profile]
+
+import argparse
+import configparser
+import cProfile
+import json
+import os
+import pstats
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.join(BENCH_DIR, '..')
+sys.path.insert(0, os.path.join(ROOT_DIR, 'src'))
+
+from PIL import Image
+import main as automation_main
+import threads_automator
+from metrics import metrics
+from post_manager import PostManager
+from scheduler import Scheduler
+from services import Services
+from simulation import FakeDriver, VirtualClock, VirtualEvent, real_perf_counter
+from utils import setup_logging, stop_logging
+
+
+def create_post_library(directory, count):
+    """シミュレーション用の投稿セット（キャプション1つと小さな画像2枚）を作成する"""
+    image_path = os.path.join(directory, '_source.jpg')
+    os.makedirs(directory)
+    Image.effect_noise((320, 240), 40).convert('RGB').save(image_path, quality=85)
+    for i in range(count):
+        post_dir = os.path.join(directory, f"set_{i:05d}")
+        os.makedirs(post_dir)
+        with open(os.path.join(post_dir, 'caption.txt'), 'w', encoding='utf-8') as f:
+            f.write(f"シミュレーション投稿 {i}")
+        for name in ('a.jpg', 'b.jpg'):
+            shutil.copyfile(image_path, os.path.join(post_dir, name))
+    os.remove(image_path)
+
+
+def build_config(posts_directory, verbose):
+    """
+    リポジトリの config.ini を元に、シミュレーション用の設定を作成する
+
+    待機時間・リトライ・透かしなどの設定はそのまま使い、外部の資源を使う機能と並列実行は無効にする。
+    """
+    config = configparser.ConfigParser()
+    with open(os.path.join(ROOT_DIR, 'config', 'config.ini'), 'r', encoding='utf-8') as f:
+        config.read_file(f)
+    overrides = {
+        'Paths': {'posts_directory': posts_directory},
+        # 仮想時計は全スレッドの待機時間を合算するため、アカウントは1つずつ処理する
+        'Settings': {'max_concurrent_accounts': '1', 'headless': 'true'},
+        'Cycle': {'start_delay_min': '0', 'start_delay_max': '0', 'adherence_log': 'logs/schedule_adherence.jsonl'},
+        'Logging': {'log_file': 'logs/automation.log', 'level': 'INFO' if verbose else 'WARNING', 'console': 'false'},
+        'Metrics': {'enabled': 'false'},
+        'Artifacts': {'enabled': 'false'},
+        'Admission': {'enabled': 'false'},
+        'DriverPool': {'enabled': 'false'},
+        'Prefetch': {'enabled': 'false'},
+        'PostIndex': {'enabled': 'false'},
+        'Ledger': {'enabled': 'false'},
+        'Session': {'mode': 'cookies'},
+        'ImageCache': {'directory': 'cache/images'},
+    }
+    for section, values in overrides.items():
+        if not config.has_section(section):
+            config.add_section(section)
+        for key, value in values.items():
+            config.set(section, key, value)
+    return config
+
+
+def count_slots(schedule_file, days):
+    """期間中の実行予定の数を概算する（投稿セットの必要数の見積もり用）"""
+    with open(schedule_file, 'r', encoding='utf-8') as f:
+        return len(json.load(f)['schedules']) * (days + 1)
+
+
+def simulate(config, accounts, schedule_file, clock, end, failure_rate, seed):
+    """
+    仮想時計で end までのスケジュールを実行する
+
+    :return: 集計結果の辞書
+    """
+    rng = random.Random(seed)
+    threads_automator.create_driver = lambda config, profile_dir=None: FakeDriver(
+        clock, failure_rate=failure_rate, rng=random.Random(rng.random())
+    )
+    post_manager = PostManager(config.get('Paths', 'posts_directory'))
+    services = Services(config)
+    scheduler = Scheduler(schedule_file, reload_check_interval=3600, stop_event=VirtualEvent(clock))
+
+    slots = runs = succeeded = 0
+    while True:
+        scheduled_run = scheduler.wait_until_next_run()
+        if scheduled_run is None or scheduled_run.time > end:
+            break
+        due_accounts = [
+            account for account in accounts
+            if scheduled_run.accounts is None or account['username'] in scheduled_run.accounts
+        ]
+        slots += 1
+        runs += len(due_accounts)
+        succeeded += automation_main.run_automation(
+            config, due_accounts, post_manager, deadline=scheduled_run.deadline, services=services
+        )
+    return {'slots': slots, 'account_runs': runs, 'succeeded': succeeded}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="仮想時計とFakeDriverによる全処理のシミュレーション")
+    parser.add_argument('--accounts', type=int, default=100, help="アカウント数")
+    parser.add_argument('--days', type=int, default=7, help="シミュレーションする日数")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="画面が操作に応答しない確率（0〜1）")
+    parser.add_argument('--schedule', default=os.path.join(ROOT_DIR, 'config', 'schedule.json'), help="スケジュールファイル")
+    parser.add_argument('--seed', type=int, default=1, help="乱数のシード")
+    parser.add_argument('--profile', action='store_true', help="cProfileで計測し、累積時間の上位を表示する")
+    parser.add_argument('--verbose', action='store_true', help="INFOレベルのログも出力する（遅くなる）")
+    parser.add_argument('--json', help="結果をJSONで保存するパス")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    schedule_file = os.path.abspath(args.schedule)
+    workdir = tempfile.mkdtemp(prefix='threads_sim_')
+    original_cwd = os.getcwd()
+    # クッキー・ログ・画像キャッシュは作業ディレクトリ内に出力させる
+    os.chdir(workdir)
+    os.makedirs('logs')
+    posts_directory = os.path.join(workdir, 'posts')
+    create_post_library(posts_directory, args.accounts * count_slots(schedule_file, args.days) + 1)
+    config = build_config(posts_directory, args.verbose)
+    accounts = [{'username': f"sim_user_{i:04d}", 'password': 'sim'} for i in range(args.accounts)]
+    setup_logging(config)
+
+    clock = VirtualClock(datetime.now().replace(second=0, microsecond=0)).install()
+    start = clock.now()
+    end = start + timedelta(days=args.days)
+    profiler = cProfile.Profile() if args.profile else None
+    wall_start = real_perf_counter()
+    cpu_start = time.process_time()
+    try:
+        if profiler:
+            profiler.enable()
+        result = simulate(config, accounts, schedule_file, clock, end, args.failure_rate, args.seed)
+        if profiler:
+            profiler.disable()
+    finally:
+        clock.uninstall()
+        stop_logging()
+        os.chdir(original_cwd)
+    wall = real_perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+
+    result.update({
+        'accounts': args.accounts,
+        'days': args.days,
+        'failure_rate': args.failure_rate,
+        'retries': metrics.counter_total('retry'),
+        'simulated_seconds': round(clock.monotonic(), 1),
+        'wall_seconds': round(wall, 2),
+        'cpu_seconds': round(cpu, 2),
+        'speedup': round(clock.monotonic() / wall, 1) if wall > 0 else None,
+        'cpu_ms_per_account_run': round(cpu / result['account_runs'] * 1000, 2) if result['account_runs'] else None,
+    })
+    print(f"シミュレーション期間: {start:%Y-%m-%d %H:%M} 〜 {end:%Y-%m-%d %H:%M}（{args.days}日, {args.accounts}アカウント）")
+    print(f"実行予定: {result['slots']}回, アカウントの処理: {result['account_runs']}回, 成功: {result['succeeded']}回, 再試行: {result['retries']}回")
+    print(f"仮想時間: {result['simulated_seconds']:.0f}秒, 実時間: {wall:.2f}秒（{result['speedup']}倍速）, CPU時間: {cpu:.2f}秒")
+    print(f"1アカウント処理あたりのCPU時間: {result['cpu_ms_per_account_run']} ms")
+    print(f"作業ディレクトリ: {workdir}")
+    if profiler:
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(25)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
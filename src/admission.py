@@ -0,0 +1,158 @@
+# admission.py
+
+import logging
+import os
+import threading
+import time
+from metrics import metrics
+
+try:
+    import psutil
+except ImportError:  # psutilが無い場合は /proc/meminfo と load average で代用する
+    psutil = None
+
+
+def sample_host():
+    """
+    ホストの空きメモリとCPU使用率を取得する
+
+    :return: (空きメモリ（MB）, CPU使用率（%）)のタプル。取得できない値はNone
+    """
+    if psutil is not None:
+        return psutil.virtual_memory().available / (1024 * 1024), psutil.cpu_percent(interval=None)
+
+    available_mb = None
+    try:
+        with open('/proc/meminfo', 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    available_mb = int(line.split()[1]) / 1024
+                    break
+    except OSError:
+        pass
+    cpu_percent = None
+    if hasattr(os, 'getloadavg'):
+        cpu_percent = os.getloadavg()[0] / (os.cpu_count() or 1) * 100
+    return available_mb, cpu_percent
+
+
+class AdmissionController:
+    def __init__(self, max_sessions=4, reserve_mb=1024, session_rss_mb=600, max_cpu_percent=85, poll_interval=5,
+                 startup_seconds=30):
+        """
+        AdmissionControllerクラスのコンストラクタ
+
+        ホストの空きメモリ・CPU使用率と、1セッションあたりのChromeのメモリ使用量の実測値から、
+        新しいアカウントのセッションを開始できるかを判断する。余裕が無い間は開始を待たせる。
+        実行中のセッションが1つも無い場合は、処理が止まらないよう常に開始を許可する。
+        開始を許可してから startup_seconds 秒以内のセッションはChromeがまだメモリを確保していないため、
+        空きメモリからその分の見積もりを差し引いて判断する。
+
+        :param max_sessions: 同時に実行するセッション数の上限
+        :param reserve_mb: OSやその他のプロセスのために残しておく空きメモリ（MB）
+        :param session_rss_mb: 1セッションあたりのメモリ使用量の初期見積もり（MB、実測値で更新する）
+        :param max_cpu_percent: 新しいセッションを開始できるCPU使用率の上限（%）
+        :param poll_interval: 待機中に空き状況を再確認する間隔（秒）
+        :param startup_seconds: 開始を許可したセッションのメモリ使用量が空きメモリに反映されるまでの秒数
+        """
+        self.max_sessions = max_sessions
+        self.reserve_mb = reserve_mb
+        self.session_rss_mb = session_rss_mb
+        self.max_cpu_percent = max_cpu_percent
+        self.poll_interval = poll_interval
+        self.startup_seconds = startup_seconds
+        # 実行中のセッションのユーザー名から開始を許可した時刻（time.monotonic）への辞書
+        self._active = {}
+        self._condition = threading.Condition()
+        # 最初のCPU使用率の取得は基準値の設定のみとなるため、ここで一度呼んでおく
+        sample_host()
+        logging.info(
+            f"セッション数の自動調整を有効にしました。上限: {max_sessions}, 予備メモリ: {reserve_mb}MB, "
+            f"CPU使用率の上限: {max_cpu_percent}%"
+        )
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        設定ファイルの [Admission] セクションからAdmissionControllerを生成する
+
+        :param config: 設定情報
+        :return: AdmissionControllerインスタンス（無効な場合はNone）
+        """
+        if not config.getboolean('Admission', 'enabled', fallback=False):
+            return None
+        return cls(
+            max_sessions=config.getint('Admission', 'max_sessions', fallback=4),
+            reserve_mb=config.getfloat('Admission', 'reserve_mb', fallback=1024),
+            session_rss_mb=config.getfloat('Admission', 'session_rss_mb', fallback=600),
+            max_cpu_percent=config.getfloat('Admission', 'max_cpu_percent', fallback=85),
+            poll_interval=config.getfloat('Admission', 'poll_interval', fallback=5),
+            startup_seconds=config.getfloat('Admission', 'startup_seconds', fallback=30),
+        )
+
+    def _has_capacity(self):
+        """新しいセッションを開始する余裕があるかどうかを判定する（ロック取得済みで呼び出す）"""
+        if not self._active:
+            return True, "実行中のセッションなし"
+        if len(self._active) >= self.max_sessions:
+            return False, f"セッション数が上限（{self.max_sessions}）に達しています"
+        now = time.monotonic()
+        # 起動中のセッションは実測の空きメモリにまだ表れていないため、見積もりを先に差し引く
+        pending = sum(1 for admitted_at in self._active.values() if now - admitted_at < self.startup_seconds)
+        available_mb, cpu_percent = sample_host()
+        if available_mb is not None and available_mb - self.reserve_mb < (pending + 1) * self.session_rss_mb:
+            return False, (
+                f"空きメモリ {available_mb:.0f}MB（1セッションの見積もり {self.session_rss_mb:.0f}MB, "
+                f"起動中 {pending}）"
+            )
+        if cpu_percent is not None and cpu_percent > self.max_cpu_percent:
+            return False, f"CPU使用率 {cpu_percent:.0f}%"
+        return True, "空きあり"
+
+    def acquire(self, username, timeout=None):
+        """
+        セッションを開始できるまで待機し、実行中として登録する
+
+        :param username: アカウントのユーザー名
+        :param timeout: 待機する最大秒数（Noneの場合は無制限）
+        :raises TimeoutError: timeout 秒以内に開始できなかった場合
+        """
+        start = time.monotonic()
+        logged = False
+        with self._condition:
+            while True:
+                admitted, reason = self._has_capacity()
+                if admitted:
+                    break
+                remaining = None if timeout is None else timeout - (time.monotonic() - start)
+                if remaining is not None and remaining <= 0:
+                    metrics.increment('admission_timeout')
+                    raise TimeoutError(f"アカウント {username} は {timeout:.0f}秒待機しても開始できませんでした: {reason}")
+                if not logged:
+                    logging.info(f"アカウント {username} の開始を待機します: {reason}")
+                    logged = True
+                # セッションの終了時に通知されるが、他のプロセスによる変化も拾うため定期的に再確認する
+                self._condition.wait(self.poll_interval if remaining is None else min(self.poll_interval, remaining))
+            self._active[username] = time.monotonic()
+            active = len(self._active)
+        waited = time.monotonic() - start
+        metrics.observe('admission_wait', waited)
+        metrics.gauge('active_sessions', active)
+        if logged:
+            logging.info(f"アカウント {username} の開始を許可しました（待機 {waited:.1f}秒, 実行中 {active}）。")
+
+    def release(self, username, rss_mb=None):
+        """
+        セッションの終了を登録し、待機中のアカウントに通知する
+
+        :param username: アカウントのユーザー名
+        :param rss_mb: 終了したセッションのChromeのメモリ使用量（MB、見積もりの更新に使用する）
+        """
+        with self._condition:
+            self._active.pop(username, None)
+            if rss_mb is not None:
+                # 直近の実測値を重く見た移動平均で見積もりを更新する
+                self.session_rss_mb = 0.7 * self.session_rss_mb + 0.3 * rss_mb
+            active = len(self._active)
+            self._condition.notify_all()
+        metrics.gauge('active_sessions', active)
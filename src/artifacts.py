@@ -0,0 +1,159 @@
+# artifacts.py
+
+import gzip
+import json
+import logging
+import os
+import random
+import re
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+
+class ArtifactCapture:
+    def __init__(self):
+        """
+        ArtifactCaptureクラスのコンストラクタ
+
+        失敗時（または抽出時）にブラウザのスクリーンショット・DOM・コンソールログを取得し、
+        圧縮と書き込みはバックグラウンドのスレッドで行う。保存先はアカウントごとのリングバッファで、
+        件数と保存期間の上限を超えた古いものから削除する。
+        configure() を呼ぶまでは何も保存しない。
+        """
+        self.directory = None
+        self.sample_rate = 0.0
+        self.max_per_account = 10
+        self.max_age_days = 14
+        self.max_pending = 4
+        self._pending = 0
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def configure(self, config):
+        """
+        設定ファイルの [Artifacts] セクションに従って保存先と保存条件を設定する
+
+        :param config: 設定情報
+        """
+        if not config.getboolean('Artifacts', 'enabled', fallback=True):
+            return
+        self.directory = config.get('Artifacts', 'directory', fallback='logs/artifacts')
+        self.sample_rate = config.getfloat('Artifacts', 'sample_rate', fallback=0.0)
+        self.max_per_account = config.getint('Artifacts', 'max_per_account', fallback=10)
+        self.max_age_days = config.getfloat('Artifacts', 'max_age_days', fallback=14)
+        self.max_pending = config.getint('Artifacts', 'max_pending', fallback=4)
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="artifacts")
+        logging.info(f"失敗時の記録の保存先を設定しました: {self.directory}")
+
+    @property
+    def enabled(self):
+        return self.directory is not None
+
+    def should_capture(self, succeeded):
+        """
+        今回の実行の記録を残すかどうかを判定する
+
+        :param succeeded: 処理に成功したかどうか
+        :return: 失敗した場合、または成功時に sample_rate の確率で抽出された場合はTrue
+        """
+        if not self.enabled:
+            return False
+        return not succeeded or random.random() < self.sample_rate
+
+    def capture(self, driver, username, reason, details=None):
+        """
+        ブラウザの状態を取得し、書き込みをバックグラウンドに依頼する
+
+        ブラウザからの取得のみ呼び出し元のスレッドで行い、圧縮とファイルの書き込みは待たずに戻る。
+        書き込み待ちが max_pending 件を超えている場合は取得せずに破棄する。
+
+        :param driver: Seleniumのwebdriverインスタンス
+        :param username: アカウントのユーザー名
+        :param reason: 記録する理由（failure / sampled）
+        :param details: メタデータに含める情報（エラー内容や投稿セット名など）
+        """
+        with self._lock:
+            if self._executor is None:
+                return
+            if self._pending >= self.max_pending:
+                logging.warning(f"書き込み待ちの記録が多いため、{username} の記録を破棄しました。")
+                return
+            self._pending += 1
+
+        captured_at = datetime.now()
+        metadata = {'account': username, 'reason': reason, 'captured_at': captured_at.isoformat(), **(details or {})}
+        screenshot = page_source = None
+        console_logs = []
+        try:
+            metadata['url'] = driver.current_url
+            screenshot = driver.get_screenshot_as_png()
+            page_source = driver.page_source
+            console_logs = driver.get_log('browser')
+        except Exception as e:
+            # 取得できた分だけ保存する
+            metadata['capture_error'] = str(e)
+
+        try:
+            self._executor.submit(self._write, username, captured_at, metadata, screenshot, page_source, console_logs)
+        except RuntimeError:
+            # シャットダウン後に呼ばれた場合
+            with self._lock:
+                self._pending -= 1
+
+    def _write(self, username, captured_at, metadata, screenshot, page_source, console_logs):
+        """記録を圧縮して書き込み、古い記録を削除する（バックグラウンドのスレッドで実行）"""
+        try:
+            account_dir = os.path.join(self.directory, _safe_name(username))
+            target = os.path.join(account_dir, f"{captured_at:%Y%m%d-%H%M%S-%f}_{metadata['reason']}")
+            os.makedirs(target, exist_ok=True)
+            if screenshot:
+                # PNGは既に圧縮されているためそのまま保存する
+                with open(os.path.join(target, 'screenshot.png'), 'wb') as f:
+                    f.write(screenshot)
+            if page_source:
+                with gzip.open(os.path.join(target, 'dom.html.gz'), 'wt', encoding='utf-8') as f:
+                    f.write(page_source)
+            if console_logs:
+                with gzip.open(os.path.join(target, 'console.json.gz'), 'wt', encoding='utf-8') as f:
+                    json.dump(console_logs, f, ensure_ascii=False)
+            with open(os.path.join(target, 'metadata.json'), 'w', encoding='utf-8') as f:
+                json.dump(metadata, f, ensure_ascii=False, indent=2, default=str)
+            logging.info(f"{username} の記録を保存しました: {target}")
+            self._prune(account_dir)
+        except Exception as e:
+            logging.error(f"{username} の記録の保存に失敗しました: {str(e)}")
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def _prune(self, account_dir):
+        """件数と保存期間の上限を超えた古い記録を削除する"""
+        entries = sorted(
+            (entry for entry in os.scandir(account_dir) if entry.is_dir()),
+            key=lambda entry: entry.name, reverse=True
+        )
+        cutoff = time.time() - self.max_age_days * 86400
+        for index, entry in enumerate(entries):
+            if index >= self.max_per_account or entry.stat().st_mtime < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+    def shutdown(self):
+        """書き込み待ちの記録をすべて書き込んでから停止する"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=True)
+
+
+def _safe_name(name):
+    """ユーザー名をディレクトリ名として安全な文字列に変換する"""
+    return re.sub(r'[^\w.@-]', '_', name)
+
+
+# プロセス全体で共有する記録の保存先
+artifacts = ArtifactCapture()
@@ -0,0 +1,101 @@
+# config_watcher.py
+
+import logging
+import os
+from utils import load_config, load_accounts
+
+# 実行中には切り替えられない（再起動が必要な）設定セクション
+RESTART_SECTIONS = ('Paths', 'PostIndex', 'Validation', 'Ledger', 'Session', 'DriverPool', 'Prefetch')
+
+
+class ConfigWatcher:
+    def __init__(self, config_path='config/config.ini', accounts_path='config/accounts.json'):
+        """
+        ConfigWatcherクラスのコンストラクタ
+
+        設定ファイルとアカウント情報の更新を更新日時で検知し、新しい内容を読み込む。
+        読み込みや検証に失敗した場合は、現在の設定をそのまま使い続ける。
+
+        :param config_path: 設定ファイルのパス
+        :param accounts_path: アカウント情報ファイルのパス
+        """
+        self.config_path = config_path
+        self.accounts_path = accounts_path
+        self._mtimes = self._current_mtimes()
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        設定ファイルの [Daemon] セクションからConfigWatcherを生成する
+
+        :param config: 設定情報
+        :return: ConfigWatcherインスタンス（無効な場合はNone）
+        """
+        if not config.getboolean('Daemon', 'hot_reload', fallback=False):
+            return None
+        logging.info("設定ファイルとアカウント情報の自動再読み込みを有効にしました。")
+        return cls()
+
+    def _current_mtimes(self):
+        """監視対象のファイルの更新日時を返す"""
+        mtimes = []
+        for path in (self.config_path, self.accounts_path):
+            try:
+                mtimes.append(os.path.getmtime(path))
+            except OSError:
+                mtimes.append(None)
+        return tuple(mtimes)
+
+    def changed(self):
+        """
+        前回の読み込み以降にファイルが更新されたかどうかを返す
+
+        :return: 更新されていればTrue
+        """
+        return self._current_mtimes() != self._mtimes
+
+    def reload(self, current_config):
+        """
+        設定ファイルとアカウント情報を読み込み直す
+
+        再起動が必要なセクション（RESTART_SECTIONS）は現在の値を引き継ぎ、変更があれば警告する。
+
+        :param current_config: 現在の設定情報
+        :return: (新しい設定情報, 新しいアカウント情報のリスト)のタプル。失敗した場合はNone
+        """
+        mtimes = self._current_mtimes()
+        try:
+            config = load_config(self.config_path)
+            accounts = load_accounts(self.accounts_path)
+            _validate_accounts(accounts)
+        except Exception as e:
+            logging.error(f"設定の再読み込みに失敗しました。現在の設定を使い続けます: {str(e)}")
+            # 同じ内容で失敗し続けないよう、次にファイルが更新されるまでは再読み込みしない
+            self._mtimes = mtimes
+            return None
+
+        for section in RESTART_SECTIONS:
+            old = dict(current_config[section]) if current_config.has_section(section) else None
+            new = dict(config[section]) if config.has_section(section) else None
+            if old == new:
+                continue
+            logging.warning(f"[{section}] の変更は再起動後に反映されます。")
+            if config.has_section(section):
+                config.remove_section(section)
+            if old is not None:
+                config.add_section(section)
+                for key, value in old.items():
+                    config.set(section, key, value)
+
+        self._mtimes = mtimes
+        logging.info(f"設定ファイルとアカウント情報を再読み込みしました。アカウント数: {len(accounts)}")
+        return config, accounts
+
+
+def _validate_accounts(accounts):
+    """アカウント情報に必要な項目が揃っているかを確認する"""
+    if not accounts:
+        raise ValueError("アカウントが1つも登録されていません。")
+    for account in accounts:
+        if not account.get('username') or not account.get('password'):
+            raise ValueError(f"username と password が必要です: {account.get('username', '(不明)')}")
@@ -11,8 +11,7 @@ class CookieManager:
         :param cookies_dir: クッキーを保存するディレクトリ
         """
         self.cookies_dir = cookies_dir
-        if not os.path.exists(cookies_dir):
-            os.makedirs(cookies_dir)
+        os.makedirs(cookies_dir, exist_ok=True)
         logging.info(f"クッキー保存ディレクトリを設定: {cookies_dir}")
 
     def save_cookies(self, driver, username):
@@ -0,0 +1,212 @@
+# dom_probe.py
+
+import logging
+import time
+from collections import namedtuple
+from selenium.common.exceptions import JavascriptException, TimeoutException
+from selenium.webdriver.common.by import By
+from metrics import metrics
+
+# 1つのロケーターの評価結果。elements は条件を満たした場合のみ要素のリストが入る
+ProbeResult = namedtuple('ProbeResult', ['count', 'matched', 'elements'])
+
+_STRATEGIES = {By.XPATH: 'xpath', By.CSS_SELECTOR: 'css'}
+
+# ページ遷移で非同期スクリプトが中断された場合のエラーメッセージ（ChromeDriver / geckodriver）
+_NAVIGATION_INTERRUPT_MESSAGES = ('document unloaded', 'document was unloaded')
+
+
+def _interrupted_by_navigation(error):
+    """
+    スクリプトの失敗がページ遷移による中断かどうかを判定する
+
+    :param error: JavascriptException
+    :return: ページ遷移による中断であればTrue
+    """
+    message = (error.msg or '').lower()
+    return any(text in message for text in _NAVIGATION_INTERRUPT_MESSAGES)
+
+# 指定したロケーターをまとめて評価し、条件を満たすまでMutationObserverでDOMの変化を待つ
+_WAIT_SCRIPT = """
+const specs = arguments[0], mode = arguments[1], timeoutMs = arguments[2], done = arguments[arguments.length - 1];
+
+function isVisible(el) {
+  const style = window.getComputedStyle(el);
+  if (style.visibility === 'hidden' || style.display === 'none') return false;
+  if (el.disabled || el.getAttribute('aria-disabled') === 'true') return false;
+  const rect = el.getBoundingClientRect();
+  return rect.width > 0 && rect.height > 0;
+}
+
+function evaluate(spec) {
+  let nodes = [];
+  if (spec.using === 'xpath') {
+    // XPathはページごとに一度だけコンパイルし、MutationObserverによる再評価ではコンパイル済みの式を使う
+    const compiled = window.__domProbeXPath || (window.__domProbeXPath = new Map());
+    let expression = compiled.get(spec.value);
+    if (!expression) {
+      expression = document.createExpression(spec.value, null);
+      compiled.set(spec.value, expression);
+    }
+    const snapshot = expression.evaluate(document, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+    for (let i = 0; i < snapshot.snapshotLength; i++) nodes.push(snapshot.snapshotItem(i));
+  } else {
+    nodes = Array.from(document.querySelectorAll(spec.value));
+  }
+  return spec.visible ? nodes.filter(isVisible) : nodes;
+}
+
+function check() {
+  const results = {};
+  let first = null, hits = 0;
+  for (const spec of specs) {
+    const nodes = evaluate(spec);
+    const matched = nodes.length >= spec.min_count;
+    results[spec.name] = {count: nodes.length, matched: matched, elements: matched ? nodes : []};
+    if (matched) { hits++; if (first === null) first = spec.name; }
+  }
+  const satisfied = mode === 'all' ? hits === specs.length : hits > 0;
+  return {satisfied: satisfied, first: first, results: results};
+}
+
+const initial = check();
+if (initial.satisfied || timeoutMs <= 0) { done(initial); return; }
+
+let finished = false, scheduled = false;
+function finish(result) {
+  if (finished) return;
+  finished = true;
+  observer.disconnect();
+  clearTimeout(timer);
+  clearInterval(fallback);
+  done(result);
+}
+function recheck() {
+  scheduled = false;
+  const result = check();
+  if (result.satisfied) finish(result);
+}
+const observer = new MutationObserver(() => {
+  if (!scheduled) { scheduled = true; setTimeout(recheck, 0); }
+});
+observer.observe(document.documentElement, {childList: true, subtree: true, attributes: true, characterData: true});
+// スタイルシートの読み込みなど、DOMの変更を伴わない表示状態の変化に備えて低頻度でも確認する
+const fallback = setInterval(recheck, 500);
+const timer = setTimeout(() => finish(check()), timeoutMs);
+"""
+
+
+class DomProbe:
+    def __init__(self, driver, default_timeout=20):
+        """
+        DomProbeクラスのコンストラクタ
+
+        複数のロケーターを1回の execute_script でまとめて評価し、
+        待機はブラウザ内のMutationObserverで行うため、WebDriverとの往復はステップごとにほぼ1回で済む。
+
+        :param driver: Seleniumのwebdriverインスタンス
+        :param default_timeout: 待機の既定のタイムアウト（秒）
+        """
+        self.driver = driver
+        self.default_timeout = default_timeout
+        self._script_timeout = None
+
+    def _specs(self, locators, visible, min_counts):
+        """ロケーターの辞書をブラウザに渡す形式に変換する"""
+        specs = []
+        for name, (by, value) in locators.items():
+            if by not in _STRATEGIES:
+                raise ValueError(f"DomProbeが対応していないロケーターです: {by}")
+            specs.append({
+                'name': name,
+                'using': _STRATEGIES[by],
+                'value': value,
+                'visible': visible,
+                'min_count': (min_counts or {}).get(name, 1),
+            })
+        return specs
+
+    def _run(self, locators, mode, timeout, visible, min_counts):
+        """ブラウザ内で評価・待機し、結果を返す"""
+        specs = self._specs(locators, visible, min_counts)
+        # ブラウザ内の待機より長くなるよう、スクリプトのタイムアウトを設定する
+        script_timeout = timeout + 5
+        if self._script_timeout != script_timeout:
+            self.driver.set_script_timeout(script_timeout)
+            self._script_timeout = script_timeout
+        metrics.increment('dom_probe', mode=mode)
+        raw = self.driver.execute_async_script(_WAIT_SCRIPT, specs, mode, int(timeout * 1000))
+        results = {
+            name: ProbeResult(value['count'], value['matched'], value['elements'])
+            for name, value in raw['results'].items()
+        }
+        return raw['satisfied'], raw['first'], results
+
+    def probe(self, locators, visible=False, min_counts=None):
+        """
+        ロケーターをまとめて1回だけ評価する（待機しない）
+
+        :param locators: 名前から (By, 値) への辞書
+        :param visible: 表示中かつ操作可能な要素だけを数えるかどうか
+        :param min_counts: 名前ごとの必要な要素数（既定は1）
+        :return: 名前からProbeResultへの辞書
+        """
+        _, _, results = self._run(locators, 'any', 0, visible, min_counts)
+        return results
+
+    def _wait(self, locators, mode, description, timeout, visible, min_counts):
+        """
+        wait_any / wait_all の本体。ページ遷移でスクリプトが中断された場合のみ残り時間で再評価する
+
+        セッションの消失やセレクターの誤りなど、それ以外のWebDriverのエラーは待たずにそのまま送出し、
+        呼び出し元の再試行の判定（utils.is_retryable）に任せる。
+        """
+        timeout = self.default_timeout if timeout is None else timeout
+        start = time.monotonic()
+        deadline = start + timeout
+        while True:
+            remaining = max(0.0, deadline - time.monotonic())
+            try:
+                satisfied, first, results = self._run(locators, mode, remaining, visible, min_counts)
+            except TimeoutException:
+                satisfied, first, results = False, None, {}
+            except JavascriptException as e:
+                if not _interrupted_by_navigation(e):
+                    raise
+                if remaining <= 0:
+                    raise TimeoutException(f"{description} を {timeout:.0f}秒以内に確認できませんでした: {e.msg}")
+                # ページ遷移中はスクリプトが中断されるため、少し待って再評価する
+                time.sleep(0.1)
+                continue
+            if satisfied:
+                logging.info(f"{description} を確認しました（{time.monotonic() - start:.2f}秒）。")
+                return first, results
+            if time.monotonic() >= deadline:
+                raise TimeoutException(f"{description} を {timeout:.0f}秒以内に確認できませんでした。")
+
+    def wait_any(self, locators, description, timeout=None, visible=False, min_counts=None):
+        """
+        いずれかのロケーターが条件を満たすまで待機する
+
+        :param locators: 名前から (By, 値) への辞書（先に書いたものが優先される）
+        :param description: ログ・エラーメッセージ用の待機内容の説明
+        :param timeout: タイムアウト秒数（省略時は既定値）
+        :param visible: 表示中かつ操作可能な要素だけを数えるかどうか
+        :param min_counts: 名前ごとの必要な要素数（既定は1）
+        :return: (条件を満たした最初の名前, 名前からProbeResultへの辞書)のタプル
+        """
+        return self._wait(locators, 'any', description, timeout, visible, min_counts)
+
+    def wait_all(self, locators, description, timeout=None, visible=False, min_counts=None):
+        """
+        すべてのロケーターが条件を満たすまで待機する
+
+        :param locators: 名前から (By, 値) への辞書
+        :param description: ログ・エラーメッセージ用の待機内容の説明
+        :param timeout: タイムアウト秒数（省略時は既定値）
+        :param visible: 表示中かつ操作可能な要素だけを数えるかどうか
+        :param min_counts: 名前ごとの必要な要素数（既定は1）
+        :return: 名前からProbeResultへの辞書
+        """
+        _, results = self._wait(locators, 'all', description, timeout, visible, min_counts)
+        return results
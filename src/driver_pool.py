@@ -0,0 +1,173 @@
+# driver_pool.py
+
+import logging
+import threading
+
+try:
+    import psutil
+except ImportError:  # psutilが無い場合はメモリ監視を行わない
+    psutil = None
+
+
+def browser_rss_mb(driver):
+    """
+    chromedriverとその子プロセス（Chrome本体）のメモリ使用量を取得する
+
+    :param driver: Seleniumのwebdriverインスタンス
+    :return: メモリ使用量（MB）。取得できない場合はNone
+    """
+    if psutil is None:
+        return None
+    try:
+        process = psutil.Process(driver.service.process.pid)
+        processes = [process] + process.children(recursive=True)
+        return sum(p.memory_info().rss for p in processes) / (1024 * 1024)
+    except Exception:
+        return None
+
+
+class PooledDriver:
+    def __init__(self, driver):
+        """
+        プール内のドライバーとその利用状況
+
+        :param driver: Seleniumのwebdriverインスタンス
+        """
+        self.driver = driver
+        self.uses = 0
+
+
+class DriverPool:
+    def __init__(self, driver_factory, max_uses=20, max_rss_mb=1500):
+        """
+        DriverPoolクラスのコンストラクタ
+
+        起動済みのChromeをアカウントごとに保持し、次のサイクルで再利用する。
+        アカウント間でクッキーやストレージが混ざらないよう、1つのChromeは1アカウント専用とする。
+
+        :param driver_factory: ユーザー名を受け取り新しいwebdriverを生成する呼び出し可能オブジェクト
+        :param max_uses: 1つのChromeを再利用する最大回数（超えたら作り直す）
+        :param max_rss_mb: Chromeプロセスツリーのメモリ使用量の上限（MB、超えたら作り直す）
+        """
+        self.driver_factory = driver_factory
+        self.max_uses = max_uses
+        self.max_rss_mb = max_rss_mb
+        self._drivers = {}
+        self._in_use = set()
+        self._lock = threading.Lock()
+        logging.info(f"ドライバープールを初期化しました。最大再利用回数: {max_uses}, メモリ上限: {max_rss_mb}MB")
+
+    @classmethod
+    def from_config(cls, config, driver_factory):
+        """
+        設定ファイルの [DriverPool] セクションからプールを生成する
+
+        :param config: 設定情報
+        :param driver_factory: ユーザー名を受け取り新しいwebdriverを生成する呼び出し可能オブジェクト
+        :return: DriverPoolインスタンス（無効な場合はNone）
+        """
+        if not config.getboolean('DriverPool', 'enabled', fallback=False):
+            return None
+        return cls(
+            driver_factory,
+            max_uses=config.getint('DriverPool', 'max_uses', fallback=20),
+            max_rss_mb=config.getint('DriverPool', 'max_rss_mb', fallback=1500),
+        )
+
+    def acquire(self, username):
+        """
+        アカウント用のドライバーを取得する。温まったドライバーがあればそれを返す。
+
+        :param username: ドライバーを使用するアカウントのユーザー名
+        :return: Seleniumのwebdriverインスタンス
+        """
+        with self._lock:
+            if username in self._in_use:
+                raise RuntimeError(f"アカウント {username} のドライバーは既に使用中です。")
+            self._in_use.add(username)
+            pooled = self._drivers.pop(username, None)
+
+        try:
+            if pooled and self._is_healthy(pooled):
+                pooled.uses += 1
+                logging.info(f"{username} の起動済みドライバーを再利用します（{pooled.uses}回目）。")
+            else:
+                if pooled:
+                    self._quit(pooled, username)
+                pooled = PooledDriver(self.driver_factory(username))
+                pooled.uses = 1
+                logging.info(f"{username} 用に新しいドライバーを起動しました。")
+        except Exception:
+            with self._lock:
+                self._in_use.discard(username)
+            raise
+
+        with self._lock:
+            self._drivers[username] = pooled
+        return pooled.driver
+
+    def release(self, username, driver, healthy=True):
+        """
+        使用済みのドライバーをプールに戻す。異常があった場合や上限を超えた場合は終了する。
+
+        :param username: ドライバーを使用したアカウントのユーザー名
+        :param driver: 返却するwebdriverインスタンス
+        :param healthy: 処理が正常に終了したかどうか
+        """
+        with self._lock:
+            self._in_use.discard(username)
+            pooled = self._drivers.get(username)
+            if pooled is None or pooled.driver is not driver:
+                pooled = PooledDriver(driver)
+            else:
+                del self._drivers[username]
+
+        if not healthy:
+            logging.info(f"{username} の処理が失敗したため、ドライバーを破棄します。")
+            self._quit(pooled, username)
+            return
+        if pooled.uses >= self.max_uses:
+            logging.info(f"{username} のドライバーが再利用上限（{self.max_uses}回）に達したため終了します。")
+            self._quit(pooled, username)
+            return
+        rss_mb = browser_rss_mb(pooled.driver)
+        if rss_mb is not None and rss_mb > self.max_rss_mb:
+            logging.info(f"{username} のドライバーのメモリ使用量が {rss_mb:.0f}MB に達したため終了します。")
+            self._quit(pooled, username)
+            return
+
+        try:
+            # 次回まで余計な処理をさせないよう空白ページに移動しておく
+            pooled.driver.get("about:blank")
+        except Exception as e:
+            logging.warning(f"{username} のドライバーのリセットに失敗したため終了します: {str(e)}")
+            self._quit(pooled, username)
+            return
+
+        with self._lock:
+            self._drivers[username] = pooled
+        logging.info(f"{username} のドライバーをプールに戻しました。")
+
+    def close_all(self):
+        """プール内のすべてのドライバーを終了する"""
+        with self._lock:
+            drivers = list(self._drivers.items())
+            self._drivers.clear()
+        for username, pooled in drivers:
+            self._quit(pooled, username)
+        logging.info("ドライバープール内のすべてのブラウザを終了しました。")
+
+    def _is_healthy(self, pooled):
+        """ドライバーが応答するかどうかを確認する"""
+        try:
+            return pooled.driver.execute_script("return 1;") == 1
+        except Exception as e:
+            logging.warning(f"ドライバーのヘルスチェックに失敗しました: {str(e)}")
+            return False
+
+    def _quit(self, pooled, username):
+        """ドライバーを終了する"""
+        try:
+            pooled.driver.quit()
+        except Exception as e:
+            logging.warning(f"{username} のドライバー終了中にエラーが発生しました: {str(e)}")
@@ -0,0 +1,154 @@
+# image_cache.py
+
+import hashlib
+import logging
+import os
+import tempfile
+import time
+
+
+class ImageCache:
+    def __init__(self, cache_dir='cache/images', max_size_mb=500, max_age_days=7):
+        """
+        ImageCacheクラスのコンストラクタ
+
+        処理済み画像を「元画像の内容のハッシュ + 処理パラメータ」をキーとして保存する。
+        同じ画像を同じ設定で処理する場合はキャッシュを返し、投稿セットのディレクトリには書き込まない。
+
+        :param cache_dir: キャッシュを保存するディレクトリ
+        :param max_size_mb: キャッシュ全体の最大サイズ（MB）。超えた場合は古いものから削除する
+        :param max_age_days: キャッシュの保持期間（日）。0以下の場合は期間で削除しない
+        """
+        # ファイル入力欄に渡すため絶対パスで保持する
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_size_bytes = max_size_mb * 1024 * 1024
+        self.max_age_seconds = max_age_days * 24 * 60 * 60
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        logging.info(f"画像キャッシュディレクトリを設定: {self.cache_dir}")
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        設定ファイルの [ImageCache] セクションからImageCacheを生成する
+
+        :param config: 設定情報
+        :return: ImageCacheインスタンス
+        """
+        return cls(
+            cache_dir=config.get('ImageCache', 'directory', fallback='cache/images'),
+            max_size_mb=config.getint('ImageCache', 'max_size_mb', fallback=500),
+            max_age_days=config.getfloat('ImageCache', 'max_age_days', fallback=7),
+        )
+
+    def make_key(self, source_path, params):
+        """
+        キャッシュキーを生成する
+
+        :param source_path: 元画像のパス
+        :param params: 処理結果に影響するパラメータのタプル
+        :return: キャッシュキー（16進文字列）
+        """
+        digest = hashlib.sha256()
+        with open(source_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        digest.update(repr(params).encode('utf-8'))
+        return digest.hexdigest()
+
+    def get_path(self, key, extension):
+        """
+        キャッシュキーに対応するファイルパスを返す
+
+        :param key: キャッシュキー
+        :param extension: ファイルの拡張子（例: '.jpg'）
+        :return: キャッシュファイルのパス
+        """
+        return os.path.join(self.cache_dir, key[:2], f"{key}{extension}")
+
+    def lookup(self, key, extension):
+        """
+        キャッシュを検索する
+
+        :param key: キャッシュキー
+        :param extension: ファイルの拡張子
+        :return: キャッシュファイルのパス（存在しない場合はNone）
+        """
+        path = self.get_path(key, extension)
+        if not os.path.exists(path):
+            return None
+        try:
+            # 最近使われたものとして更新時刻を更新する（削除時の優先度に使用）
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def store(self, key, extension, image, **save_kwargs):
+        """
+        画像をキャッシュに保存する。一時ファイルに書き込んでから置き換えるため、途中の状態は見えない。
+
+        :param key: キャッシュキー
+        :param extension: ファイルの拡張子
+        :param image: 保存するPIL画像
+        :param save_kwargs: Image.save に渡す追加引数
+        :return: キャッシュファイルのパス
+        """
+        path = self.get_path(key, extension)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=extension + '.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                image.save(f, format=image_format_for(extension), **save_kwargs)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return path
+
+    def evict(self):
+        """
+        保持期間を過ぎたキャッシュを削除し、最大サイズを超えている場合は古いものから削除する
+
+        :return: 削除したファイル数
+        """
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        now = time.time()
+        total_size = sum(size for _, size, _ in entries)
+        removed = 0
+        for mtime, size, path in sorted(entries):
+            expired = self.max_age_seconds > 0 and now - mtime > self.max_age_seconds
+            if not expired and total_size <= self.max_size_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_size -= size
+            removed += 1
+
+        if removed:
+            logging.info(f"画像キャッシュから {removed} 個のファイルを削除しました。")
+        return removed
+
+
+def image_format_for(extension):
+    """
+    拡張子からPillowの保存形式を返す
+
+    :param extension: ファイルの拡張子
+    :return: Pillowの形式名
+    """
+    return 'PNG' if extension.lower() == '.png' else 'JPEG'
@@ -2,7 +2,159 @@
 
 import os
 import logging
+from functools import lru_cache
 from PIL import Image, ImageDraw, ImageFont, ImageColor
+from image_cache import ImageCache
+from metrics import metrics
+
+# EXIFのOrientationタグの値と、正しい向きにするための変換
+EXIF_ORIENTATION_TAG = 0x0112
+ORIENTATION_TRANSPOSE = {
+    2: (Image.Transpose.FLIP_LEFT_RIGHT,),
+    3: (Image.Transpose.ROTATE_180,),
+    4: (Image.Transpose.FLIP_TOP_BOTTOM,),
+    5: (Image.Transpose.TRANSPOSE,),
+    6: (Image.Transpose.ROTATE_270,),
+    7: (Image.Transpose.TRANSVERSE,),
+    8: (Image.Transpose.ROTATE_90,),
+}
+# 処理結果に影響する処理手順の版（手順を変えた場合に古いキャッシュを使わないよう、キャッシュキーに含める）
+PIPELINE_VERSION = 2
+
+
+def apply_orientation(image):
+    """
+    EXIFのOrientationタグに従って画素を回転・反転させる
+
+    透かしは回転後の画像に描画する必要があるため、透かしの合成より前に呼び出す。
+
+    :param image: 元画像
+    :return: 正しい向きの画像（回転が不要な場合は元の画像）
+    """
+    for method in ORIENTATION_TRANSPOSE.get(image.getexif().get(EXIF_ORIENTATION_TAG), ()):
+        image = image.transpose(method)
+    return image
+
+
+@lru_cache(maxsize=16)
+def _get_font(font_size):
+    """
+    フォントサイズごとにフォントをキャッシュして返す
+    :param font_size: フォントサイズ
+    :return: ImageFontオブジェクト
+    """
+    return ImageFont.load_default().font_variant(size=font_size)
+
+
+@lru_cache(maxsize=128)
+def _render_text_sprite(text, font_size, font_color, opacity):
+    """
+    透かしテキストをインクの範囲だけの小さなRGBA画像として描画し、キャッシュする
+    :param text: 透かしテキスト
+    :param font_size: フォントサイズ
+    :param font_color: 文字色
+    :param opacity: 不透明度（0-255）
+    :return: (スプライト画像, テキストの幅, テキストの高さ, 描画原点のオフセット(x, y))のタプル
+    """
+    font = _get_font(font_size)
+    bbox = font.getbbox(text)
+    text_width = bbox[2] - bbox[0]
+    text_height = bbox[3] - bbox[1]
+
+    # 描画原点(0, 0)より左・上にはみ出すインクも含められるようにオフセットを取る
+    offset_x = -min(0, bbox[0])
+    offset_y = -min(0, bbox[1])
+    sprite = Image.new('RGBA', (max(1, bbox[2] + offset_x), max(1, bbox[3] + offset_y)), (0,0,0,0))
+    draw = ImageDraw.Draw(sprite)
+    draw.text((offset_x, offset_y), text, font=font, fill=(*ImageColor.getrgb(font_color), opacity))
+    return sprite, text_width, text_height, (offset_x, offset_y)
+
+
+def render_watermark(img, text, font_size, font_color, opacity, position_x, position_y):
+    """
+    画像に透かしを合成した新しい画像を返す
+
+    テキストが重なる矩形領域だけをRGBAに変換して合成するため、
+    画像全体を合成していた従来の処理と同じ結果をより少ない計算量で得られる。
+
+    :param img: 元画像
+    :param text: 透かしテキスト
+    :param font_size: フォントサイズ
+    :param font_color: 文字色
+    :param opacity: 不透明度（0-255）
+    :param position_x: 横位置（0.0-1.0）
+    :param position_y: 縦位置（0.0-1.0）
+    :return: 透かしを合成したRGB画像
+    """
+    sprite, text_width, text_height, (offset_x, offset_y) = _render_text_sprite(text, font_size, font_color, opacity)
+
+    # 透かしの位置を計算
+    x = int((img.width - text_width) * position_x) - offset_x
+    y = int((img.height - text_height) * position_y) - offset_y
+
+    # RGB画像はそのまま、それ以外（透過PNGなど）は従来どおりRGBA上で合成する
+    base = img.convert('RGB') if img.mode == 'RGB' else img.convert('RGBA')
+
+    # スプライトと画像が重なる領域
+    left, top = max(0, x), max(0, y)
+    right, bottom = min(base.width, x + sprite.width), min(base.height, y + sprite.height)
+    if left < right and top < bottom:
+        region = base.crop((left, top, right, bottom)).convert('RGBA')
+        sprite_region = sprite.crop((left - x, top - y, right - x, bottom - y))
+        region = Image.alpha_composite(region, sprite_region)
+        base.paste(region.convert(base.mode), (left, top))
+
+    return base.convert('RGB')
+
+class EncodingProfile:
+    def __init__(self, config):
+        """
+        アップロード用のエンコード設定
+
+        長辺の最大サイズへの縮小、JPEGの品質・プログレッシブ・ハフマンテーブル最適化、
+        メタデータ（EXIFなど）の削除を行い、アップロードするファイルサイズを小さくする。
+
+        :param config: 設定情報を含むConfigParserオブジェクト
+        """
+        self.enabled = config.getboolean('Encoding', 'enabled', fallback=False)
+        self.max_long_edge = config.getint('Encoding', 'max_long_edge', fallback=2048)
+        self.quality = config.getint('Encoding', 'jpeg_quality', fallback=85)
+        self.progressive = config.getboolean('Encoding', 'progressive', fallback=True)
+        self.optimize = config.getboolean('Encoding', 'optimize', fallback=True)
+        self.strip_metadata = config.getboolean('Encoding', 'strip_metadata', fallback=True)
+        # 色の見え方が変わらないよう、カラープロファイルはメタデータ削除の対象外にできる
+        self.keep_icc_profile = config.getboolean('Encoding', 'keep_icc_profile', fallback=True)
+
+    def params(self):
+        """
+        キャッシュキーに含めるエンコード設定を返す
+        :return: パラメータのタプル
+        """
+        return (self.max_long_edge, self.quality, self.progressive, self.optimize, self.strip_metadata, self.keep_icc_profile)
+
+    def apply(self, image, source):
+        """
+        画像をアップロード用に変換する（縮小と保存の設定のみ。向きは apply_orientation で補正済みとする）
+        :param image: 変換する画像（向きの補正・透かし合成後）
+        :param source: 元画像（EXIFとカラープロファイルの取得に使用）
+        :return: (変換後のRGB画像, Image.save に渡す引数の辞書)のタプル
+        """
+        exif = source.getexif()
+        if self.max_long_edge > 0 and max(image.size) > self.max_long_edge:
+            scale = self.max_long_edge / max(image.size)
+            size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+            image = image.resize(size, Image.Resampling.LANCZOS)
+
+        save_kwargs = {'quality': self.quality, 'progressive': self.progressive, 'optimize': self.optimize}
+        if not self.strip_metadata and exif:
+            # 画素は回転済みのため、閲覧時に二重に回転されないよう向きを標準に戻す
+            if EXIF_ORIENTATION_TAG in exif:
+                exif[EXIF_ORIENTATION_TAG] = 1
+            save_kwargs['exif'] = exif.tobytes()
+        if self.keep_icc_profile and source.info.get('icc_profile'):
+            save_kwargs['icc_profile'] = source.info['icc_profile']
+        return image.convert('RGB'), save_kwargs
+
 
 class ImageProcessor:
     def __init__(self, config):
@@ -17,56 +169,72 @@ class ImageProcessor:
         self.opacity = self.config.getint('Watermark', 'opacity', fallback=128)
         self.position_x = self.config.getfloat('Watermark', 'position_x', fallback=0.5)
         self.position_y = self.config.getfloat('Watermark', 'position_y', fallback=0.5)
+        self.encoding = EncodingProfile(self.config)
+        self.cache = ImageCache.from_config(self.config) if self.watermark_enabled or self.encoding.enabled else None
         
-        logging.info("ImageProcessorが初期化されました。透かし機能: %s", "有効" if self.watermark_enabled else "無効")
+        logging.info("ImageProcessorが初期化されました。透かし機能: %s, アップロード用エンコード: %s",
+                     "有効" if self.watermark_enabled else "無効", "有効" if self.encoding.enabled else "無効")
 
-    def add_watermark(self, image_path, username):
+    def process_image(self, image_path, username):
         """
-        画像に透かしを追加する
+        画像に透かしを追加し、アップロード用にエンコードする
         :param image_path: 処理する画像のパス
         :param username: 透かしとして追加するユーザーネーム
         :return: 処理された画像のパス
         """
-        if not self.watermark_enabled:
+        if not self.watermark_enabled and not self.encoding.enabled:
             logging.info("透かし機能が無効です。画像 %s は処理されません。", image_path)
             return image_path
 
         try:
-            with Image.open(image_path) as img:
-                # 透かし用のレイヤーを作成
-                watermark = Image.new('RGBA', img.size, (0,0,0,0))
-                draw = ImageDraw.Draw(watermark)
-
-                # フォントの設定（システムデフォルトフォントを使用）
-                font = ImageFont.load_default()
-                font = font.font_variant(size=self.font_size)
-
-                # テキストサイズの取得（更新された方法）
-                bbox = draw.textbbox((0, 0), username, font=font)
-                text_width = bbox[2] - bbox[0]
-                text_height = bbox[3] - bbox[1]
-
-                # 透かしの位置を計算
-                x = int((img.width - text_width) * self.position_x)
-                y = int((img.height - text_height) * self.position_y)
+            # 元画像の内容と処理の設定が同じであれば、以前の出力を再利用する
+            extension = '.jpg' if self.encoding.enabled else os.path.splitext(image_path)[1].lower()
+            key = self.cache.make_key(image_path, self._cache_params(username))
+            cached_path = self.cache.lookup(key, extension)
+            if cached_path:
+                metrics.increment('image_cache', result='hit')
+                logging.info("画像 %s の処理済み画像をキャッシュから取得しました: %s", image_path, cached_path)
+                return cached_path
+            metrics.increment('image_cache', result='miss')
 
-                # 透かしを描画
-                draw.text((x, y), username, font=font, fill=(*ImageColor.getrgb(self.font_color), self.opacity))
+            save_kwargs = {}
+            with metrics.span('image_render'), Image.open(image_path) as img:
+                # 透かしが画像と一緒に回転しないよう、向きの補正は透かしの合成より前に行う
+                result = apply_orientation(img)
+                if self.watermark_enabled:
+                    result = render_watermark(
+                        result, username, self.font_size, self.font_color, self.opacity, self.position_x, self.position_y
+                    )
+                if self.encoding.enabled:
+                    result, save_kwargs = self.encoding.apply(result, img)
 
-                # 元の画像と透かしを合成
-                combined = Image.alpha_composite(img.convert('RGBA'), watermark)
-
-                # 処理後の画像を保存
-                output_path = os.path.join(os.path.dirname(image_path), f"watermarked_{os.path.basename(image_path)}")
-                combined.convert('RGB').save(output_path)
+            # 処理後の画像をキャッシュに保存（投稿セットのディレクトリには書き込まない）
+            with metrics.span('image_save'):
+                output_path = self.cache.store(key, extension, result, **save_kwargs)
 
+            if self.watermark_enabled:
                 logging.info("画像 %s に透かし(@%s)を追加しました。出力: %s", image_path, username, output_path)
-                return output_path
+            if self.encoding.enabled:
+                before, after = os.path.getsize(image_path), os.path.getsize(output_path)
+                logging.info("画像 %s をアップロード用にエンコードしました: %d バイト → %d バイト (%.1f%%)",
+                             image_path, before, after, after / before * 100 if before else 0.0)
+            return output_path
 
         except Exception as e:
-            logging.error("画像 %s への透かし追加中にエラーが発生しました: %s", image_path, str(e))
+            logging.error("画像 %s の処理中にエラーが発生しました: %s", image_path, str(e))
             return image_path
 
+    def _cache_params(self, username):
+        """
+        キャッシュキーに含める処理のパラメータを返す
+        :param username: 透かしとして追加するユーザーネーム
+        :return: パラメータのタプル
+        """
+        watermark = (username, self.font_size, self.font_color, self.opacity, self.position_x, self.position_y) \
+            if self.watermark_enabled else None
+        encoding = self.encoding.params() if self.encoding.enabled else None
+        return (PIPELINE_VERSION, watermark, encoding)
+
     def process_images(self, image_paths, username):
         """
         複数の画像を処理する
@@ -76,8 +244,12 @@ class ImageProcessor:
         """
         processed_paths = []
         for path in image_paths:
-            processed_path = self.add_watermark(path, f"@{username}")
+            processed_path = self.process_image(path, f"@{username}")
             processed_paths.append(processed_path)
         
-        logging.info("%d 枚の画像を処理しました", len(processed_paths))
+        if self.cache:
+            self.cache.evict()
+        before = sum(os.path.getsize(path) for path in image_paths)
+        after = sum(os.path.getsize(path) for path in processed_paths)
+        logging.info("%d 枚の画像を処理しました。合計サイズ: %d バイト → %d バイト", len(processed_paths), before, after)
         return processed_paths
\ No newline at end of file
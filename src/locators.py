@@ -0,0 +1,282 @@
+# locators.py
+
+import logging
+import threading
+import time
+from collections import namedtuple
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.common.by import By
+from metrics import metrics
+
+# UI要素の定義。strategies は優先順に並べた (By, 値) のタプル
+Locator = namedtuple('Locator', ['name', 'description', 'strategies'])
+
+
+def xpath(value):
+    """XPathによる探索戦略"""
+    return (By.XPATH, value)
+
+
+def css(value):
+    """CSSセレクターによる探索戦略"""
+    return (By.CSS_SELECTOR, value)
+
+
+def aria(role, label):
+    """ARIAのroleとaria-labelによる探索戦略（CSSセレクターに変換する）"""
+    return (By.CSS_SELECTOR, f'[role="{role}"][aria-label="{label}"]')
+
+
+class LocatorRegistry:
+    def __init__(self):
+        """
+        LocatorRegistryクラスのコンストラクタ
+
+        UI要素ごとの探索戦略のチェーンを一元管理し、ロケーターごとの成功率と所要時間を集計する。
+        """
+        self._locators = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, description, *strategies):
+        """
+        ロケーターを登録する
+
+        :param name: ロケーター名
+        :param description: ログ・エラーメッセージ用の説明
+        :param strategies: 優先順に並べた (By, 値) のタプル
+        :return: 登録したLocator
+        """
+        if not strategies:
+            raise ValueError(f"ロケーター '{name}' に探索戦略が指定されていません。")
+        for by, _ in strategies:
+            if by not in (By.XPATH, By.CSS_SELECTOR):
+                raise ValueError(f"ロケーター '{name}' に対応していない探索戦略が含まれています: {by}")
+        locator = Locator(name, description, tuple(strategies))
+        self._locators[name] = locator
+        return locator
+
+    def get(self, name):
+        """
+        登録済みのロケーターを取得する
+
+        :param name: ロケーター名
+        :return: Locator
+        """
+        return self._locators[name]
+
+    def names(self):
+        """
+        登録済みのロケーター名を返す
+
+        :return: ロケーター名のリスト
+        """
+        return list(self._locators)
+
+    def primary(self, name):
+        """
+        ロケーターの第一候補の値を返す（シミュレーションで要素を識別するために使う）
+
+        :param name: ロケーター名
+        :return: 第一候補の (By, 値) のタプル
+        """
+        return self._locators[name].strategies[0]
+
+    def _entry(self, name):
+        """集計用のエントリを返す（ロック取得済みで呼び出す）"""
+        entry = self._stats.get(name)
+        if entry is None:
+            strategies = len(self._locators[name].strategies)
+            entry = self._stats[name] = {'attempts': 0, 'misses': 0, 'seconds': 0.0, 'wins': [0] * strategies}
+        return entry
+
+    def record_hit(self, name, index, seconds):
+        """
+        ロケーターが見つかったことを記録する
+
+        :param name: ロケーター名
+        :param index: 一致した探索戦略の番号
+        :param seconds: 所要時間（秒）
+        """
+        with self._lock:
+            entry = self._entry(name)
+            entry['attempts'] += 1
+            entry['wins'][index] += 1
+            entry['seconds'] += seconds
+        metrics.observe('locator', seconds, locator=name, strategy=index)
+
+    def record_miss(self, name, seconds):
+        """
+        ロケーターがタイムアウトまでに見つからなかったことを記録する
+
+        :param name: ロケーター名
+        :param seconds: 所要時間（秒）
+        """
+        with self._lock:
+            entry = self._entry(name)
+            entry['attempts'] += 1
+            entry['misses'] += 1
+            entry['seconds'] += seconds
+        metrics.increment('locator_miss', locator=name)
+
+    def stats(self):
+        """
+        ロケーターごとの集計結果を返す
+
+        :return: ロケーター名から集計結果（attempts, hit_rate, avg_seconds, wins）への辞書
+        """
+        with self._lock:
+            return {
+                name: {
+                    'attempts': entry['attempts'],
+                    'hit_rate': (entry['attempts'] - entry['misses']) / entry['attempts'],
+                    'avg_seconds': entry['seconds'] / entry['attempts'],
+                    'wins': list(entry['wins']),
+                }
+                for name, entry in self._stats.items() if entry['attempts']
+            }
+
+    def log_stats(self):
+        """ロケーターごとの成功率・平均所要時間・戦略別の一致回数をログに出力する"""
+        for name, entry in sorted(self.stats().items()):
+            message = (f"ロケーター '{name}': 成功率 {entry['hit_rate']:.0%}（{entry['attempts']}回中）, "
+                       f"平均 {entry['avg_seconds']:.2f}秒, 戦略別の一致回数 {entry['wins']}")
+            # 第一候補以外で見つかっている場合はセレクターの更新が必要な可能性が高い
+            if entry['hit_rate'] < 1 or any(entry['wins'][1:]):
+                logging.warning(message)
+            else:
+                logging.info(message)
+
+
+class LocatorSession:
+    def __init__(self, probe, registry):
+        """
+        LocatorSessionクラスのコンストラクタ
+
+        ブラウザセッションごとに、各ロケーターで一致した探索戦略を記憶する。
+        探索時は記憶した戦略を先頭にしてチェーン全体をDomProbeで1回の呼び出しにまとめて評価するため、
+        第一候補のセレクターが壊れていてもタイムアウトを待たずに代替の戦略で見つかる。
+
+        :param probe: DomProbeインスタンス
+        :param registry: LocatorRegistryインスタンス
+        """
+        self.probe = probe
+        self.registry = registry
+        self._winners = {}
+
+    def _ordered(self, name):
+        """記憶した戦略を先頭にした (番号, 戦略) のリストを返す"""
+        strategies = list(enumerate(self.registry.get(name).strategies))
+        winner = self._winners.get(name)
+        if winner is not None:
+            strategies.insert(0, strategies.pop(winner))
+        return strategies
+
+    def wait(self, names, timeout=None, visible=False, min_count=1):
+        """
+        いずれかのロケーターが見つかるまで待機する
+
+        :param names: ロケーター名のリスト（先に書いたものが優先される）
+        :param timeout: タイムアウト秒数（省略時はDomProbeの既定値）
+        :param visible: 表示中かつ操作可能な要素だけを数えるかどうか
+        :param min_count: 必要な要素数
+        :return: (見つかったロケーター名, 要素のリスト)のタプル
+        """
+        locators = {}
+        keys = {}
+        for name in names:
+            for index, strategy in self._ordered(name):
+                key = f"{name}#{index}"
+                locators[key] = strategy
+                keys[key] = (name, index)
+        description = '・'.join(self.registry.get(name).description for name in names)
+        min_counts = {key: min_count for key in locators}
+
+        start = time.monotonic()
+        try:
+            first, results = self.probe.wait_any(locators, description, timeout, visible, min_counts)
+        except TimeoutException:
+            for name in names:
+                self.registry.record_miss(name, time.monotonic() - start)
+            raise
+        name, index = keys[first]
+        self.registry.record_hit(name, index, time.monotonic() - start)
+        if self._winners.get(name) != index:
+            if index > 0:
+                logging.warning(f"{self.registry.get(name).description} は代替の探索戦略 #{index} で見つかりました。")
+            self._winners[name] = index
+        return name, results[first].elements
+
+    def find(self, name, timeout=None, visible=False, min_count=1):
+        """
+        ロケーターが見つかるまで待機し、要素のリストを返す
+
+        :param name: ロケーター名
+        :param timeout: タイムアウト秒数（省略時はDomProbeの既定値）
+        :param visible: 表示中かつ操作可能な要素だけを数えるかどうか
+        :param min_count: 必要な要素数
+        :return: 要素のリスト
+        """
+        return self.wait([name], timeout, visible, min_count)[1]
+
+
+# プロセス全体で共有するロケーターの定義
+registry = LocatorRegistry()
+
+registry.register(
+    'login_link', "ログインリンク",
+    xpath("//div[contains(@class, 'x6s0dn4') and contains(@class, 'x78zum5')]//a[@role='link']//div[contains(text(), 'ログイン')]"),
+    xpath("//a[@role='link']//div[normalize-space(text())='ログイン']"),
+    css('a[href^="/login"]'),
+)
+registry.register(
+    'username_input', "ユーザー名入力欄",
+    css('input[name="username"], input[name="email"]'),
+    xpath("//input[contains(@placeholder, 'ユーザーネーム') or contains(@placeholder, 'メールアドレス')]"),
+    css('input[autocomplete="username"]'),
+)
+registry.register(
+    'password_input', "パスワード入力欄",
+    css('input[name="password"]'),
+    xpath("//input[contains(@placeholder, 'パスワード')]"),
+    css('input[type="password"]'),
+)
+registry.register(
+    'login_button', "ログインボタン",
+    xpath("//div[@role='button']//div[contains(@class, 'x6s0dn4') and contains(@class, 'x78zum5')]//div[contains(text(), 'ログイン')]"),
+    xpath("//div[@role='button']//div[normalize-space(text())='ログイン']"),
+)
+registry.register(
+    'logged_in', "ログイン状態",
+    xpath("//div[contains(text(), 'Post') or contains(text(), '投稿')]"),
+    xpath("//*[local-name()='svg'][@aria-label='ホーム' or @aria-label='Home']"),
+)
+registry.register(
+    'post_button', "投稿ボタン",
+    xpath("//div[contains(@class, 'x1i10hfl') and contains(@class, 'x1ypdohk') and contains(@class, 'xdl72j9')]//div[contains(text(), 'Post') or contains(text(), '投稿')]"),
+    xpath("//*[@role='button'][.//*[local-name()='svg'][@aria-label='作成' or @aria-label='Create']]"),
+    aria('button', '作成'),
+)
+registry.register(
+    'file_input', "画像アップロード欄",
+    css('input[type="file"]'),
+)
+registry.register(
+    'upload_thumbnail', "画像サムネイル",
+    css('div[role="dialog"] img[src^="blob:"]'),
+)
+registry.register(
+    'caption_input', "キャプション入力欄",
+    css('div[role="textbox"]'),
+    css('div[contenteditable="true"]'),
+)
+registry.register(
+    'final_post_button', "最終Postボタン",
+    xpath("//div[@role='button']//div[contains(text(), 'Post') or contains(text(), '投稿')]"),
+)
+registry.register(
+    'post_success', "投稿完了メッセージ",
+    xpath("//div[contains(text(), 'Your thread was posted') or contains(text(), 'スレッドが投稿されました')]"),
+    # 送信後に表示されるトースト内の完了メッセージ（他の通知やフィード上のリンクには一致させない）
+    xpath("//*[@role='alert' or @role='status']//*[normalize-space(text())='Your thread was posted' or normalize-space(text())='Posted' or normalize-space(text())='スレッドが投稿されました' or normalize-space(text())='投稿しました']"),
+)
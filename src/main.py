@@ -1,69 +1,367 @@
 # main.py
 
+import contextvars
+import json
 import logging
-from utils import load_config, load_accounts, setup_logging
-from threads_automator import ThreadsAutomator
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+from utils import load_config, load_accounts, setup_logging, stop_logging, log_context, set_log_context
+from services import Services
+from config_watcher import ConfigWatcher
+from threads_automator import ThreadsAutomator, create_driver
+from driver_pool import DriverPool
+from admission import AdmissionController
+from prefetcher import PostPrefetcher
 from post_manager import PostManager
+from post_index import PostIndex
+from post_ledger import PostLedger
+from post_validator import PostSetValidator
 from scheduler import Scheduler
+from metrics import metrics
+from artifacts import artifacts
+from locators import registry as locator_registry
 import random
 import time
 
-def run_automation(config, accounts, post_manager):
+# タイムアウトしたアカウントのブラウザを終了した後、ワーカーが終わるのを待つ時間（秒）
+KILL_GRACE_SECONDS = 60
+# アカウントのタイムアウトを確認する間隔（秒）
+WATCHDOG_INTERVAL = 1.0
+
+def run_account(config, account, post_manager, automators, driver_pool=None, prefetcher=None, planned_start=None,
+                admission=None, services=None):
+    """
+    1アカウント分の自動投稿処理を実行する
+
+    :param config: 設定情報
+    :param account: アカウント情報
+    :param post_manager: PostManagerインスタンス
+    :param automators: 実行中のThreadsAutomatorを登録する辞書（タイムアウト時のクリーンアップ用）
+    :param driver_pool: DriverPoolインスタンス（Noneの場合は毎回Chromeを起動する）
+    :param prefetcher: PostPrefetcherインスタンス（Noneの場合は投稿時に画像を処理する）
+    :param planned_start: 予定していた開始時刻（ログ出力用）
+    :param admission: AdmissionControllerインスタンス（指定時はホストに余裕ができるまで開始を待つ）
+    :param services: 共有のServicesインスタンス
+    :return: 処理に成功したかどうか
+    """
+    if planned_start:
+        lag = (datetime.now() - planned_start).total_seconds()
+        logging.info(f"アカウント {account['username']} の処理を開始します。予定: {planned_start:%H:%M:%S}, 遅延: {lag:.1f}秒")
+    automator = ThreadsAutomator(config, account, post_manager, driver_pool, prefetcher, services)
+    # account_timeout は開始の許可を待つ時間も含めて数える
+    automator.started_at = time.monotonic()
+    automators[account['username']] = automator
+    admitted = False
+    try:
+        if admission:
+            admission.acquire(
+                account['username'], timeout=config.getfloat('Settings', 'account_timeout', fallback=1800)
+            )
+            admitted = True
+        with log_context(account=account['username']), metrics.span('account', account=account['username']):
+            automator.run()
+        metrics.increment('account_result', result='success')
+        return True
+    except Exception as e:
+        logging.error(f"アカウント {account['username']} の処理中にエラーが発生しました: {str(e)}")
+        metrics.increment('account_result', result='failure')
+        return False
+    finally:
+        automator.cleanup()
+        if admitted:
+            admission.release(account['username'], automator.rss_mb)
+
+def plan_start_times(config, accounts, deadline=None):
+    """
+    各アカウントの開始時刻を決める
+
+    アカウントごとに [Cycle] start_delay_min～start_delay_max 分のランダムな遅延を割り当てる。
+    次の実行予定（deadline）がある場合は、その deadline_margin 分前までに全アカウントが開始するよう遅延を縮める。
+
+    :param config: 設定情報
+    :param accounts: アカウント情報のリスト
+    :param deadline: このサイクルの締め切り（次の実行予定時刻）
+    :return: (開始予定時刻, アカウント情報)のタプルを開始順に並べたリスト
+    """
+    now = datetime.now()
+    min_delay = config.getfloat('Cycle', 'start_delay_min', fallback=1) * 60
+    max_delay = config.getfloat('Cycle', 'start_delay_max', fallback=60) * 60
+    if deadline:
+        margin = config.getfloat('Cycle', 'deadline_margin', fallback=10) * 60
+        max_delay = min(max_delay, max(0.0, (deadline - now).total_seconds() - margin))
+    min_delay = min(min_delay, max_delay)
+
+    start_times = [(now + timedelta(seconds=random.uniform(min_delay, max_delay)), account) for account in accounts]
+    start_times.sort(key=lambda item: item[0])
+    for planned_start, account in start_times:
+        logging.info(f"アカウント {account['username']} の開始予定時刻: {planned_start:%Y-%m-%d %H:%M:%S}")
+    return start_times
+
+def run_automation(config, accounts, post_manager, driver_pool=None, prefetcher=None, deadline=None, admission=None,
+                   services=None):
     """
     自動投稿処理を実行する
+
+    [Settings] max_concurrent_accounts で同時に処理するアカウント数の上限を指定する（デフォルト1: 逐次実行）。
+    [Settings] account_timeout（秒）は各アカウントのワーカーが処理を開始した時刻（開始の許可を待つ時間を含む）から数え、超えたアカウントはブラウザを終了させて
+    ワーカーを空け、待機中の他のアカウントの処理を妨げないようにする。
+    各アカウントは plan_start_times で決めた開始時刻に順次投入するため、先に開始したアカウントの処理は待機中も進む。
     
     :param config: 設定情報
     :param accounts: アカウント情報のリスト
     :param post_manager: PostManagerインスタンス
+    :param driver_pool: DriverPoolインスタンス（Noneの場合は毎回Chromeを起動する）
+    :param prefetcher: PostPrefetcherインスタンス（Noneの場合は投稿時に画像を処理する）
+    :param deadline: このサイクルの締め切り（次の実行予定時刻）
+    :param admission: AdmissionControllerインスタンス（指定時は同時実行数をホストの空き状況で調整する）
+    :param services: 共有のServicesインスタンス（Noneの場合はこのサイクル用に生成する）
+    :return: 成功したアカウント数
     """
     logging.info("自動投稿処理を開始します。")
 
-    # 1分から60分までのランダムな待機時間を生成
-    wait_time_minutes = random.randint(1, 60)
-    wait_time_seconds = wait_time_minutes * 60
-    
-    logging.info(f"ランダムな待機時間: {wait_time_minutes}分 ({wait_time_seconds}秒)")
-    logging.info(f"待機開始時刻: {time.strftime('%Y-%m-%d %H:%M:%S')}")
-    
-    # 待機
-    time.sleep(wait_time_seconds)
+    start_times = plan_start_times(config, accounts, deadline)
+    services = services or Services(config)
 
-    for account in accounts:
-        automator = ThreadsAutomator(config, account, post_manager)
-        try:
-            automator.run()
-        except Exception as e:
-            logging.error(f"アカウント {account['username']} の処理中にエラーが発生しました: {str(e)}")
-        finally:
-            automator.cleanup()
-    logging.info("すべてのアカウントの処理が完了しました。")
+    if admission:
+        # 実際の同時実行数はAdmissionControllerが空き状況に応じて決める
+        max_workers = admission.max_sessions
+    else:
+        max_workers = max(1, config.getint('Settings', 'max_concurrent_accounts', fallback=1))
+    account_timeout = config.getfloat('Settings', 'account_timeout', fallback=1800)
+    logging.info(f"{len(accounts)}個のアカウントを最大{max_workers}並列で処理します。")
+
+    cycle_start = time.monotonic()
+    automators = {}
+    results = {}
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="account")
+    try:
+        futures = {}
+        # タイムアウトでブラウザを終了したアカウントのユーザー名から終了した時刻への辞書
+        killed = {}
+        queue = list(start_times)
+        while True:
+            # 開始時刻になったアカウントを投入する
+            while queue and queue[0][0] <= datetime.now():
+                planned_start, account = queue.pop(0)
+                # サイクルIDなどのログのコンテキストをワーカースレッドに引き継ぐ
+                future = executor.submit(
+                    contextvars.copy_context().run,
+                    run_account, config, account, post_manager, automators, driver_pool, prefetcher, planned_start,
+                    admission, services
+                )
+                futures[future] = account['username']
+
+            for future in [f for f in futures if f.done() and futures[f] not in results]:
+                results[futures[future]] = future.result()
+            enforce_account_timeouts(futures, automators, results, killed, account_timeout, max_workers)
+            active = [f for f in futures if futures[f] not in results]
+            if not queue and not active:
+                break
+
+            timeout = WATCHDOG_INTERVAL
+            if queue:
+                timeout = min(timeout, max(0.0, (queue[0][0] - datetime.now()).total_seconds()))
+            if active:
+                wait(active, timeout=timeout, return_when=FIRST_COMPLETED)
+            elif timeout > 0:
+                time.sleep(timeout)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    elapsed = time.monotonic() - cycle_start
+    metrics.observe('cycle', elapsed)
+    succeeded = sum(1 for ok in results.values() if ok)
+    throughput = len(accounts) / elapsed * 3600 if elapsed > 0 else 0.0
+    logging.info(
+        f"すべてのアカウントの処理が完了しました。成功: {succeeded}/{len(accounts)}, "
+        f"所要時間: {elapsed:.1f}秒, スループット: {throughput:.2f} アカウント/時"
+    )
+    return succeeded
+
+def enforce_account_timeouts(futures, automators, results, killed, account_timeout, max_workers):
+    """
+    処理を開始してから account_timeout 秒を超えたアカウントのブラウザを終了させる
+
+    ブラウザを終了すると実行中のWebDriverの呼び出しが失敗し、ワーカーが空いて次のアカウントが開始できる。
+    終了後も KILL_GRACE_SECONDS 秒以内にワーカーが終わらない場合は、そのアカウントを待たずに失敗として扱う。
+    すべてのワーカーがそのような状態になった場合は、開始前のアカウントをスキップする。
+
+    :param futures: Futureからユーザー名への辞書
+    :param automators: ユーザー名からThreadsAutomatorへの辞書
+    :param results: ユーザー名から処理結果への辞書（結果が決まったアカウントを追加する）
+    :param killed: ユーザー名からブラウザを終了した時刻への辞書
+    :param account_timeout: 1アカウントあたりの処理時間の上限（秒）
+    :param max_workers: ワーカー数
+    """
+    now = time.monotonic()
+    for future, username in futures.items():
+        if username in results or future.done():
+            continue
+        if username in killed:
+            if now - killed[username] >= KILL_GRACE_SECONDS:
+                logging.error(f"アカウント {username} のワーカーがブラウザの終了後も応答しません。処理を打ち切ります。")
+                results[username] = False
+            continue
+        automator = automators.get(username)
+        started_at = automator.started_at if automator else None
+        if started_at is None or now - started_at < account_timeout:
+            continue
+        logging.error(f"アカウント {username} の処理が {account_timeout:.0f}秒を超えました。ブラウザを強制終了します。")
+        metrics.increment('account_timeout')
+        killed[username] = now
+        # 応答しないブラウザからスクリーンショット等を取得すると、ここでも待たされるため記録しない
+        automator.cleanup(capture=False)
+
+    stuck = sum(1 for future, username in futures.items() if results.get(username) is False and future.running())
+    if stuck >= max_workers:
+        for future, username in futures.items():
+            if username not in results and future.cancel():
+                logging.error(f"アカウント {username} は空いているワーカーが無いため開始前にスキップしました。")
+                results[username] = False
+
+def record_slot(path, record):
+    """
+    実行予定ごとの予定時刻・実際の開始時刻・終了時刻をJSON Lines形式で記録する
+
+    :param path: 記録ファイルのパス
+    :param record: 記録する内容の辞書
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + '\n')
 
 def main():
     """
     メイン関数。スケジューリングと自動投稿の実行を管理します。
     """
-    # ログの設定
-    setup_logging()
-    
     # 設定とアカウント情報の読み込み
     config = load_config()
+    
+    # ログの設定
+    setup_logging(config)
+    
     accounts = load_accounts()
+    metrics.configure(config)
+    artifacts.configure(config)
     
     # PostManagerの初期化
     posts_directory = config.get('Paths', 'posts_directory')
-    post_manager = PostManager(posts_directory)
+    post_index = PostIndex.from_config(config, posts_directory)
+    post_manager = PostManager(
+        posts_directory,
+        index=post_index,
+        refresh_interval=config.getfloat('PostIndex', 'refresh_interval', fallback=300),
+        ledger=PostLedger.from_config(config),
+        validator=PostSetValidator.from_config(config),
+    )
+    
+    # アカウント・サイクルをまたいで共有するサービス
+    services = Services(config)
+    
+    # ドライバープールの初期化（[DriverPool] enabled = true の場合のみ）
+    # 設定の再読み込み後も最新の設定でChromeを起動するよう、services を実行時に参照する
+    driver_pool = DriverPool.from_config(
+        config,
+        lambda username: create_driver(
+            services.config,
+            services.profile_manager.get_profile_dir(username) if services.profile_manager else None,
+        ),
+    )
+    
+    # ホストの空き状況による同時実行数の調整（[Admission] enabled = true の場合のみ）
+    admission = AdmissionController.from_config(config)
+    
+    # 投稿の先読みの初期化（[Prefetch] enabled = true の場合のみ）
+    prefetcher = PostPrefetcher.from_config(config, post_manager)
     
     # スケジューラの初期化
-    scheduler = Scheduler()
+    misfire_policy = config.get('Cycle', 'misfire_policy', fallback='skip')
+    scheduler = Scheduler(misfire_policy=misfire_policy)
+    adherence_log = config.get('Cycle', 'adherence_log', fallback='logs/schedule_adherence.jsonl')
+    
+    # 設定ファイルとアカウント情報の自動再読み込み（[Daemon] hot_reload = true の場合のみ）
+    config_watcher = ConfigWatcher.from_config(config)
     
     logging.info("スケジューリングされた自動投稿プロセスを開始します。")
     
-    while True:
-        # 次の実行時間まで待機
-        scheduler.wait_until_next_run()
-        
-        # 自動投稿処理の実行
-        run_automation(config, accounts, post_manager)
+    try:
+        while True:
+            # 待機中に次のサイクルの投稿を準備しておく
+            if prefetcher:
+                prefetcher.prefetch_all(accounts)
+
+            # 次の実行時間まで待機
+            scheduled_run = scheduler.wait_until_next_run()
+            if scheduled_run is None:
+                break
+            set_log_context(cycle=f"{scheduled_run.time:%Y%m%d-%H%M}")
+            
+            # 設定が更新されていれば、サイクルの開始前にまとめて切り替える
+            if config_watcher and config_watcher.changed():
+                reloaded = config_watcher.reload(config)
+                if reloaded:
+                    config, accounts = reloaded
+                    setup_logging(config)
+                    metrics.configure(config)
+                    artifacts.configure(config)
+                    previous_services, services = services, Services(config)
+                    previous_services.close()
+                    admission = AdmissionController.from_config(config)
+                    misfire_policy = config.get('Cycle', 'misfire_policy', fallback='skip')
+                    scheduler.misfire_policy = misfire_policy
+                    adherence_log = config.get('Cycle', 'adherence_log', fallback='logs/schedule_adherence.jsonl')
+                    if prefetcher:
+                        prefetcher.update_image_settings(config)
+            
+            # 自動投稿処理の実行（アカウント指定のある予定はそのアカウントのみ）
+            due_accounts = [
+                account for account in accounts
+                if scheduled_run.accounts is None or account['username'] in scheduled_run.accounts
+            ]
+            actual_start = datetime.now()
+            start_lag = (actual_start - scheduled_run.time).total_seconds()
+            logging.info(
+                f"実行予定 {scheduled_run.time} のサイクルを開始します。実際の開始: {actual_start:%Y-%m-%d %H:%M:%S}, "
+                f"遅延: {start_lag:.1f}秒, 締め切り: {scheduled_run.deadline}"
+            )
+            succeeded = run_automation(
+                config, due_accounts, post_manager, driver_pool, prefetcher, deadline=scheduled_run.deadline,
+                admission=admission, services=services
+            )
+
+            end = datetime.now()
+            overrun = scheduled_run.deadline is not None and end > scheduled_run.deadline
+            if overrun:
+                overrun_seconds = (end - scheduled_run.deadline).total_seconds()
+                logging.warning(
+                    f"サイクルが次の実行予定 {scheduled_run.deadline} を {overrun_seconds:.0f} 秒超過しました。"
+                    f"超過した予定は {misfire_policy} ポリシーで処理します。"
+                )
+            record_slot(adherence_log, {
+                'planned': scheduled_run.time.isoformat(),
+                'actual_start': actual_start.isoformat(),
+                'start_lag_seconds': round(start_lag, 3),
+                'end': end.isoformat(),
+                'deadline': scheduled_run.deadline.isoformat() if scheduled_run.deadline else None,
+                'overrun': overrun,
+                'policy': misfire_policy,
+                'accounts': len(due_accounts),
+                'succeeded': succeeded,
+            })
+            locator_registry.log_stats()
+            metrics.write_prometheus()
+    finally:
+        if driver_pool:
+            driver_pool.close_all()
+        if prefetcher:
+            prefetcher.shutdown()
+        artifacts.shutdown()
+        services.close()
+        metrics.shutdown()
+        stop_logging()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,292 @@
+# metrics.py
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+# ヒストグラムのバケット（秒）
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _label_key(labels):
+    """ラベルの辞書を集計用のキーに変換する"""
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(label_key, extra=()):
+    """Prometheusのラベル表記に変換する"""
+    pairs = list(label_key) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (f'{k}="{_escape_label_value(v)}"' for k, v in pairs)
+    return '{' + ','.join(escaped) + '}'
+
+
+def _escape_label_value(value):
+    """Prometheusのラベル値をエスケープする"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class _EventFormatter(logging.Formatter):
+    """キューに入れたイベント（レコードのmsgに格納した辞書）をJSON Linesの1行に整形するフォーマッター"""
+
+    def format(self, record):
+        return json.dumps(record.msg, ensure_ascii=False, default=str)
+
+
+class Metrics:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        Metricsクラスのコンストラクタ
+
+        処理フェーズごとの所要時間（ヒストグラム）とイベント数（カウンター）を集計し、
+        JSON Lines形式のイベントログとPrometheusのテキスト形式ファイルに出力する。
+        イベントログはキューに入れるだけで呼び出し元に戻り、書き込みとローテーションは
+        QueueListenerのスレッドで行う。
+
+        :param buckets: ヒストグラムのバケットの上限値（秒）
+        """
+        self.buckets = tuple(sorted(buckets))
+        self.jsonl_path = None
+        self.prometheus_path = None
+        self._histograms = {}
+        self._counters = {}
+        self._gauges = {}
+        self._event_queue = None
+        self._event_listener = None
+        # capture_events() の後に記録したイベント（子プロセスで親プロセスに返すために使う）
+        self._captured = None
+        self._lock = threading.Lock()
+
+    def configure(self, config):
+        """
+        設定ファイルの [Metrics] セクションに従って出力先を設定する
+
+        再読み込みで無効にした場合は、イベントログの書き込みスレッドを停止し、Prometheusのファイルも更新しない。
+
+        :param config: 設定情報
+        """
+        if not config.getboolean('Metrics', 'enabled', fallback=False):
+            self.shutdown()
+            self.jsonl_path = None
+            self.prometheus_path = None
+            return
+        self.jsonl_path = config.get('Metrics', 'jsonl_path', fallback='logs/metrics.jsonl')
+        self.prometheus_path = config.get('Metrics', 'prometheus_path', fallback='logs/metrics.prom')
+        for path in (self.jsonl_path, self.prometheus_path):
+            directory = os.path.dirname(path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+        handler = logging.handlers.RotatingFileHandler(
+            self.jsonl_path, maxBytes=config.getint('Metrics', 'jsonl_max_bytes', fallback=50 * 1024 * 1024),
+            backupCount=config.getint('Metrics', 'jsonl_backup_count', fallback=3), encoding='utf-8'
+        )
+        handler.setFormatter(_EventFormatter())
+        event_queue = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(event_queue, handler)
+        listener.start()
+        with self._lock:
+            previous, self._event_queue, self._event_listener = self._event_listener, event_queue, listener
+        # 古いキューに残ったイベントを書き出してからファイルを閉じる
+        self._stop_listener(previous)
+        logging.info(f"メトリクスの出力先を設定しました: {self.jsonl_path}, {self.prometheus_path}")
+
+    @contextmanager
+    def span(self, name, **labels):
+        """
+        ブロックの所要時間を計測する
+
+        使い方:
+            with metrics.span('login', account=username):
+                ...
+
+        :param name: フェーズ名
+        :param labels: 付加するラベル（アカウント名など）
+        """
+        start = time.perf_counter()
+        outcome = 'ok'
+        try:
+            yield
+        except BaseException:
+            outcome = 'error'
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - start, outcome=outcome, **labels)
+
+    def observe(self, name, seconds, **labels):
+        """
+        所要時間を記録する
+
+        :param name: フェーズ名
+        :param seconds: 所要時間（秒）
+        :param labels: 付加するラベル
+        """
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram['buckets'][i] += 1
+            histogram['sum'] += seconds
+            histogram['count'] += 1
+            self._write_event({'type': 'span', 'name': name, 'seconds': round(seconds, 6), **labels})
+
+    def increment(self, name, amount=1, **labels):
+        """
+        カウンターを増やす
+
+        :param name: イベント名
+        :param amount: 増分
+        :param labels: 付加するラベル
+        """
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+            self._write_event({'type': 'counter', 'name': name, 'amount': amount, **labels})
+
+    def gauge(self, name, value, **labels):
+        """
+        現在値を記録する（メモリ使用量など）
+
+        :param name: 項目名（Prometheusでは threads_<name> として出力する）
+        :param value: 値
+        :param labels: 付加するラベル
+        """
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._gauges[key] = value
+            self._write_event({'type': 'gauge', 'name': name, 'value': value, **labels})
+
+    def counter_total(self, name):
+        """
+        カウンターの値をラベルを問わず合計して返す
+
+        :param name: イベント名
+        :return: 合計値
+        """
+        with self._lock:
+            return sum(value for (counter_name, _), value in self._counters.items() if counter_name == name)
+
+    def _write_event(self, event):
+        """イベントを書き込みスレッドのキューに入れる（ロック取得済みで呼び出す）"""
+        if self._captured is not None:
+            self._captured.append(event)
+            return
+        if self._event_queue is None:
+            return
+        event['timestamp'] = time.time()
+        self._event_queue.put(logging.makeLogRecord({'msg': event}))
+
+    def capture_events(self):
+        """
+        以降のイベントを出力せずに保持する（プロセスプールの子プロセスの初期化時に呼び出す）
+
+        子プロセスには書き込みスレッドが無いため、保持したイベントを drain_events で取り出して親プロセスに返し、
+        親プロセスで replay して記録する。
+        """
+        # fork時に親プロセスの他のスレッドが取得していたロックを引き継がないよう作り直す
+        self._lock = threading.Lock()
+        self._event_queue = None
+        self._event_listener = None
+        self._captured = []
+
+    def drain_events(self):
+        """
+        capture_events の後に保持したイベントを取り出す
+
+        :return: イベントの辞書のリスト
+        """
+        with self._lock:
+            events, self._captured = self._captured or [], []
+        return events
+
+    def replay(self, events):
+        """
+        子プロセスから返されたイベントを記録する
+
+        :param events: drain_events で取り出したイベントの辞書のリスト
+        """
+        for event in events:
+            event = dict(event)
+            kind, name = event.pop('type'), event.pop('name')
+            if kind == 'span':
+                self.observe(name, event.pop('seconds'), **event)
+            elif kind == 'counter':
+                self.increment(name, event.pop('amount'), **event)
+            elif kind == 'gauge':
+                self.gauge(name, event.pop('value'), **event)
+
+    @staticmethod
+    def _stop_listener(listener):
+        """QueueListenerを停止し、その出力先のハンドラーを閉じる（Noneの場合は何もしない）"""
+        if listener is None:
+            return
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+
+    def shutdown(self):
+        """キューに残っているイベントを書き出して書き込みスレッドを停止する"""
+        with self._lock:
+            listener, self._event_queue, self._event_listener = self._event_listener, None, None
+        self._stop_listener(listener)
+
+    def render_prometheus(self):
+        """
+        集計結果をPrometheusのテキスト形式に変換する
+
+        :return: テキスト形式の文字列
+        """
+        with self._lock:
+            histograms = {k: {'buckets': list(v['buckets']), 'sum': v['sum'], 'count': v['count']}
+                          for k, v in self._histograms.items()}
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+
+        lines = [
+            '# HELP threads_phase_duration_seconds Duration of automation phases.',
+            '# TYPE threads_phase_duration_seconds histogram',
+        ]
+        for (name, label_key), histogram in sorted(histograms.items()):
+            labels = (('phase', name),) + label_key
+            for bound, count in zip(self.buckets, histogram['buckets']):
+                lines.append(f"threads_phase_duration_seconds_bucket{_format_labels(labels, [('le', bound)])} {count}")
+            lines.append(f"threads_phase_duration_seconds_bucket{_format_labels(labels, [('le', '+Inf')])} {histogram['count']}")
+            lines.append(f"threads_phase_duration_seconds_sum{_format_labels(labels)} {histogram['sum']:.6f}")
+            lines.append(f"threads_phase_duration_seconds_count{_format_labels(labels)} {histogram['count']}")
+
+        lines += [
+            '# HELP threads_events_total Number of automation events.',
+            '# TYPE threads_events_total counter',
+        ]
+        for (name, label_key), value in sorted(counters.items()):
+            lines.append(f"threads_events_total{_format_labels((('event', name),) + label_key)} {value}")
+
+        for name in sorted({name for name, _ in gauges}):
+            lines.append(f'# TYPE threads_{name} gauge')
+            for (gauge_name, label_key), value in sorted(gauges.items()):
+                if gauge_name == name:
+                    lines.append(f"threads_{name}{_format_labels(label_key)} {value}")
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self):
+        """Prometheusのテキスト形式ファイルを書き出す（node_exporterのtextfileコレクタ向けに置き換えで書き込む）"""
+        if not self.prometheus_path:
+            return
+        tmp_path = f"{self.prometheus_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.render_prometheus())
+        os.replace(tmp_path, self.prometheus_path)
+
+
+# プロセス全体で共有するメトリクス
+metrics = Metrics()
+atexit.register(metrics.shutdown)
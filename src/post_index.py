@@ -0,0 +1,234 @@
+# post_index.py
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def stat_post_set(post_dir: str) -> Tuple[Optional[float], str, str]:
+    """
+    投稿セットのファイルの更新時刻とサイズから、変更の有無を判定するための値（シグネチャ）を作成する
+
+    ファイルを上書きしてもディレクトリの更新時刻は変わらないため、中のファイルも確認する。
+
+    :param post_dir: 投稿セットのディレクトリのパス
+    :return: (最も新しい更新時刻, 画像サイズのJSON, 画像の更新時刻のJSON)のタプル（インデックスの列と同じ形式）。
+             ディレクトリを読めない場合、最も新しい更新時刻はNone
+    """
+    try:
+        newest = os.stat(post_dir).st_mtime
+    except OSError:
+        return None, '[]', '[]'
+    images = []
+    try:
+        with os.scandir(post_dir) as entries:
+            for entry in sorted(entries, key=lambda e: e.name):
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+                newest = max(newest, stat.st_mtime)
+                if entry.name.endswith(IMAGE_EXTENSIONS) and not entry.name.startswith('watermarked_'):
+                    images.append((stat.st_size, stat.st_mtime))
+    except OSError:
+        # 読めないディレクトリは読み込み時にエラーとして記録する
+        pass
+    return (
+        newest,
+        json.dumps([size for size, _ in images]),
+        json.dumps([mtime for _, mtime in images]),
+    )
+
+
+class PostIndex:
+    def __init__(self, db_path: str, posts_directory: str, verify_batch: int = 200):
+        """
+        PostIndexクラスのコンストラクタ
+
+        投稿セットのキャプション・画像パス・サイズ・更新時刻をSQLiteに保存する。
+        再読み込み時は投稿セットのディレクトリの更新時刻だけを確認し、ファイルの追加・削除があった投稿セットの
+        ファイルを確認する。ファイルの上書きではディレクトリの更新時刻が変わらないため、それ以外の投稿セットも
+        1回につき verify_batch 件ずつ順番にファイルの更新時刻とサイズを確認する（投稿セット数 / verify_batch 回で一巡する）。
+        大量の投稿セットやネットワーク共有上のディレクトリでも、再読み込みのたびに全ファイルを確認しない。
+        dir_mtime 列にはディレクトリと中のファイルのうち最も新しい更新時刻を保存する。
+
+        :param db_path: インデックスを保存するSQLiteファイルのパス
+        :param posts_directory: 投稿セットが保存されているディレクトリのパス
+        :param verify_batch: 再読み込み1回あたりにファイルを確認する投稿セット数（0の場合は毎回すべて確認する）
+        """
+        self.db_path = db_path
+        self.posts_directory = posts_directory
+        self.verify_batch = verify_batch
+        # 次にファイルを確認する投稿セットの位置（名前順）
+        self._verify_cursor = 0
+        db_dir = os.path.dirname(db_path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._conn:
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS post_sets (
+                    name TEXT PRIMARY KEY,
+                    dir_mtime REAL NOT NULL,
+                    caption TEXT,
+                    image_paths TEXT,
+                    image_sizes TEXT,
+                    image_mtimes TEXT,
+                    valid INTEGER NOT NULL,
+                    error TEXT
+                )"""
+            )
+        logging.info(f"投稿セットのインデックスを開きました: {db_path}")
+
+    @classmethod
+    def from_config(cls, config, posts_directory: str) -> Optional['PostIndex']:
+        """
+        設定ファイルの [PostIndex] セクションからPostIndexを生成する
+
+        :param config: 設定情報
+        :param posts_directory: 投稿セットが保存されているディレクトリのパス
+        :return: PostIndexインスタンス（無効な場合はNone）
+        """
+        if not config.getboolean('PostIndex', 'enabled', fallback=False):
+            return None
+        return cls(
+            config.get('PostIndex', 'path', fallback='cache/post_index.sqlite3'), posts_directory,
+            verify_batch=config.getint('PostIndex', 'verify_batch', fallback=200),
+        )
+
+    def refresh(self) -> Tuple[int, int]:
+        """
+        ファイルの更新時刻とサイズを比較し、追加・変更された投稿セットだけを読み直す
+
+        ファイルを確認するのは、新しい投稿セット・ディレクトリの更新時刻が記録より新しい投稿セットと、
+        順番に選んだ verify_batch 件の投稿セットのみ。
+
+        :return: (更新した投稿セット数, 削除した投稿セット数)のタプル
+        """
+        start = time.monotonic()
+        dir_mtimes: Dict[str, float] = {}
+        with os.scandir(self.posts_directory) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    dir_mtimes[entry.name] = entry.stat().st_mtime
+        known = self.signatures()
+
+        to_verify = self._next_verify_batch(sorted(name for name in dir_mtimes if name in known))
+        current: Dict[str, Tuple[float, str, str]] = {}
+        for name, dir_mtime in dir_mtimes.items():
+            if name not in known or dir_mtime > known[name][0] or name in to_verify:
+                current[name] = stat_post_set(os.path.join(self.posts_directory, name))
+        changed = [name for name, signature in current.items() if known.get(name) != signature]
+        removed = [name for name in known if name not in dir_mtimes]
+
+        with self._lock:
+            rows = [self._scan_post_set(name, current[name][0] or 0.0) for name in changed]
+            with self._conn:
+                self._conn.executemany("INSERT OR REPLACE INTO post_sets VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                self._conn.executemany("DELETE FROM post_sets WHERE name = ?", [(name,) for name in removed])
+
+        logging.info(
+            f"投稿セットのインデックスを更新しました。更新: {len(changed)}件, 削除: {len(removed)}件, "
+            f"ファイルを確認: {len(current)}件 ({time.monotonic() - start:.2f}秒)"
+        )
+        return len(changed), len(removed)
+
+    def _next_verify_batch(self, names: List[str]) -> Set[str]:
+        """
+        今回ファイルを確認する既知の投稿セットを、前回の続きから verify_batch 件選ぶ
+
+        :param names: 既知の投稿セット名（名前順）
+        :return: 投稿セット名の集合
+        """
+        if not self.verify_batch or len(names) <= self.verify_batch:
+            return set(names)
+        start = self._verify_cursor % len(names)
+        self._verify_cursor = start + self.verify_batch
+        return set((names + names)[start:start + self.verify_batch])
+
+    def _scan_post_set(self, name: str, dir_mtime: float) -> tuple:
+        """
+        1つの投稿セットのディレクトリを読み、インデックスの行を作成する
+
+        :param name: 投稿セット名
+        :param dir_mtime: ディレクトリと中のファイルのうち最も新しい更新時刻
+        :return: post_sets テーブルの1行分のタプル
+        """
+        post_dir = os.path.join(self.posts_directory, name)
+        caption = None
+        images = []
+        error = None
+        try:
+            with os.scandir(post_dir) as entries:
+                for entry in sorted(entries, key=lambda e: e.name):
+                    if not entry.is_file():
+                        continue
+                    if entry.name.endswith('.txt') and caption is None:
+                        with open(entry.path, 'r', encoding='utf-8') as f:
+                            caption = f.read().strip()
+                    elif entry.name.endswith(IMAGE_EXTENSIONS) and not entry.name.startswith('watermarked_'):
+                        stat = entry.stat()
+                        images.append((entry.path, stat.st_size, stat.st_mtime))
+            if caption is None:
+                error = "キャプションファイルがありません。"
+            elif len(images) != 2:
+                error = f"投稿セット {name} には2つの画像が必要です。"
+        except (OSError, UnicodeDecodeError) as e:
+            error = str(e)
+
+        return (
+            name,
+            dir_mtime,
+            caption,
+            json.dumps([path for path, _, _ in images]),
+            json.dumps([size for _, size, _ in images]),
+            json.dumps([mtime for _, _, mtime in images]),
+            int(error is None),
+            error,
+        )
+
+    def signatures(self) -> Dict[str, Tuple[float, str, str]]:
+        """
+        インデックスに記録した各投稿セットのシグネチャ（stat_post_set と同じ形式）を返す
+
+        :return: 投稿セット名からシグネチャへの辞書
+        """
+        with self._lock:
+            return {name: (mtime, sizes, mtimes) for name, mtime, sizes, mtimes in self._conn.execute(
+                "SELECT name, dir_mtime, image_sizes, image_mtimes FROM post_sets"
+            )}
+
+    def valid_post_sets(self) -> List[str]:
+        """
+        投稿可能な投稿セット名の一覧を返す
+
+        :return: 投稿セット名のリスト
+        """
+        with self._lock:
+            return [name for (name,) in self._conn.execute("SELECT name FROM post_sets WHERE valid = 1 ORDER BY name")]
+
+    def get(self, name: str) -> Optional[Tuple[str, List[str]]]:
+        """
+        投稿セットのキャプションと画像パスを返す
+
+        :param name: 投稿セット名
+        :return: (キャプション, [画像パスのリスト])のタプル。見つからない・無効な場合はNone
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT caption, image_paths FROM post_sets WHERE name = ? AND valid = 1", (name,)
+            ).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    def close(self):
+        """データベース接続を閉じる"""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,186 @@
+# post_ledger.py
+
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Set
+
+
+# 投稿セットを使用済みとして扱う結果（unconfirmed: 送信後に投稿完了を確認できなかったもの。重複投稿を避けるため再使用しない）
+USED_OUTCOMES = ('success', 'unconfirmed')
+
+
+class PostLedger:
+    def __init__(self, journal_path: str, compact_every: int = 1000):
+        """
+        PostLedgerクラスのコンストラクタ
+
+        投稿セットの使用記録（投稿セット, アカウント, 時刻, 結果）を追記専用のジャーナルに書き込む。
+        一定件数ごとにスナップショットへまとめ、起動時はスナップショットとジャーナルの末尾だけを読み込む。
+
+        :param journal_path: ジャーナルファイル（JSON Lines）のパス。スナップショットは同じ場所に保存する
+        :param compact_every: スナップショットにまとめるまでのジャーナルの件数
+        """
+        self.journal_path = journal_path
+        self.snapshot_path = f"{os.path.splitext(journal_path)[0]}.snapshot.json"
+        self.compact_every = compact_every
+        self._used: Set[str] = set()
+        self._history: Dict[str, List[dict]] = {}
+        self._seq = 0
+        self._journal_records = 0
+        self._lock = threading.Lock()
+
+        journal_dir = os.path.dirname(journal_path)
+        if journal_dir and not os.path.exists(journal_dir):
+            os.makedirs(journal_dir)
+
+        snapshot_seq = self._load_snapshot()
+        self._replay_journal(snapshot_seq)
+        self._journal = open(self.journal_path, 'a', encoding='utf-8')
+        logging.info(f"投稿セットの使用記録を読み込みました。使用済み: {len(self._used)}件, 未圧縮の記録: {self._journal_records}件")
+        if self._journal_records >= self.compact_every:
+            self.compact()
+
+    @classmethod
+    def from_config(cls, config) -> Optional['PostLedger']:
+        """
+        設定ファイルの [Ledger] セクションからPostLedgerを生成する
+
+        :param config: 設定情報
+        :return: PostLedgerインスタンス（無効な場合はNone）
+        """
+        if not config.getboolean('Ledger', 'enabled', fallback=False):
+            return None
+        return cls(
+            config.get('Ledger', 'journal_path', fallback='data/post_ledger.jsonl'),
+            compact_every=config.getint('Ledger', 'compact_every', fallback=1000),
+        )
+
+    def _load_snapshot(self) -> int:
+        """
+        スナップショットを読み込む
+
+        :return: スナップショットに含まれる最後の記録の通し番号
+        """
+        if not os.path.exists(self.snapshot_path):
+            return 0
+        with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+            snapshot = json.load(f)
+        self._used = set(snapshot['used'])
+        self._history = snapshot['history']
+        self._seq = snapshot['seq']
+        return self._seq
+
+    def _replay_journal(self, snapshot_seq: int):
+        """
+        スナップショット以降のジャーナルを再生する。書き込み途中で終了した最終行は無視する。
+
+        :param snapshot_seq: スナップショットに含まれる最後の記録の通し番号
+        """
+        if not os.path.exists(self.journal_path):
+            return
+        valid_end = 0
+        with open(self.journal_path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    logging.warning("使用記録の書き込み途中の行を破棄しました。")
+                    break
+                valid_end += len(line)
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    logging.warning("使用記録の不完全な行を読み飛ばしました。")
+                    continue
+                if record['seq'] <= snapshot_seq:
+                    continue
+                self._apply(record)
+                self._journal_records += 1
+        # 途中で終了した最終行の後ろに次の記録が続かないよう切り詰める
+        if valid_end < os.path.getsize(self.journal_path):
+            with open(self.journal_path, 'r+b') as f:
+                f.truncate(valid_end)
+
+    def _apply(self, record: dict):
+        """記録をメモリ上の状態に反映する"""
+        self._seq = max(self._seq, record['seq'])
+        if record['outcome'] in USED_OUTCOMES:
+            self._used.add(record['post_set'])
+        self._history.setdefault(record['account'], []).append(record)
+
+    def record(self, post_set: str, account: str, outcome: str):
+        """
+        投稿セットの使用結果を記録する
+
+        :param post_set: 投稿セット名
+        :param account: 投稿したアカウントのユーザー名
+        :param outcome: 結果（'success' / 'unconfirmed' / 'failure'）
+        """
+        with self._lock:
+            record = {
+                'seq': self._seq + 1,
+                'post_set': post_set,
+                'account': account,
+                'timestamp': time.time(),
+                'outcome': outcome,
+            }
+            self._journal.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            self._apply(record)
+            self._journal_records += 1
+            if self._journal_records >= self.compact_every:
+                self._compact_locked()
+
+    def compact(self):
+        """現在の状態をスナップショットに書き出し、ジャーナルを空にする"""
+        with self._lock:
+            self._compact_locked()
+
+    def _compact_locked(self):
+        """compact の本体（ロック取得済みで呼び出す）"""
+        tmp_path = f"{self.snapshot_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'seq': self._seq, 'used': sorted(self._used), 'history': self._history}, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        # スナップショットの書き込み後にジャーナルを空にする（途中で終了しても通し番号で重複を除外できる）
+        self._journal.close()
+        self._journal = open(self.journal_path, 'w', encoding='utf-8')
+        self._journal_records = 0
+        logging.info(f"投稿セットの使用記録をスナップショットにまとめました: {self.snapshot_path}")
+
+    def is_used(self, post_set: str) -> bool:
+        """
+        投稿セットが投稿済みかどうかを返す
+
+        :param post_set: 投稿セット名
+        :return: 投稿に成功した記録があるかどうか
+        """
+        return post_set in self._used
+
+    def used_post_sets(self) -> Set[str]:
+        """
+        投稿済みの投稿セット名の集合を返す
+
+        :return: 投稿セット名の集合（コピー）
+        """
+        with self._lock:
+            return set(self._used)
+
+    def history(self, account: str) -> List[dict]:
+        """
+        アカウントの使用履歴を返す
+
+        :param account: アカウントのユーザー名
+        :return: 記録のリスト（古い順）
+        """
+        with self._lock:
+            return list(self._history.get(account, []))
+
+    def close(self):
+        """ジャーナルファイルを閉じる"""
+        with self._lock:
+            self._journal.close()
@@ -1,45 +1,161 @@
 import os
 import random
 import logging
-from typing import List, Tuple
+import threading
+import time
+from typing import Dict, List, Optional, Set, Tuple
+from post_index import PostIndex
+from post_ledger import PostLedger
+from post_validator import PostSetValidator
+from metrics import metrics
 
 class PostManager:
-    def __init__(self, posts_directory: str):
+    def __init__(self, posts_directory: str, index: Optional[PostIndex] = None, refresh_interval: float = 300,
+                 ledger: Optional[PostLedger] = None, validator: Optional[PostSetValidator] = None):
         """
         PostManagerクラスのコンストラクタ
         
         :param posts_directory: 投稿セットが保存されているディレクトリのパス
+        :param index: PostIndexインスタンス（指定時は投稿セットをインデックスから読み込む）
+        :param refresh_interval: インデックスを再読み込みする間隔（秒）
+        :param ledger: PostLedgerインスタンス（指定時は再起動後も使用済みの投稿セットを除外する）
+        :param validator: PostSetValidatorインスタンス（指定時は検査に合格した投稿セットだけを選択対象にする）
         """
         self.posts_directory = posts_directory
-        self.post_sets = self._load_post_sets()
+        self.index = index
+        self.refresh_interval = refresh_interval
+        self.ledger = ledger
+        self.validator = validator
+        # 検査に合格した投稿セット名から (キャプション, [画像パスのリスト]) への辞書
+        self._validated: Dict[str, Tuple[str, List[str]]] = {}
+        self.used_post_sets: Set[str] = ledger.used_post_sets() if ledger else set()
+        # 選択済みで投稿の結果が出ていない投稿セット（複数のアカウントが同じ投稿セットを選ばないようにする）
+        self._reserved: Set[str] = set()
+        self._last_refresh = 0.0
+        # 再読み込み中の場合はTrue（再読み込みは1つのスレッドだけがロックの外で行う）
+        self._refreshing = False
+        # 複数アカウントを並列処理する場合に備えて投稿セットの選択・削除を排他制御する
+        self._lock = threading.Lock()
+        post_sets, self._validated = self._load_post_sets(set(self.used_post_sets))
+        self._set_post_sets(post_sets)
         logging.info(f"{len(self.post_sets)}個の投稿セットを読み込みました。")
 
-    def _load_post_sets(self) -> List[str]:
+    def _set_post_sets(self, post_sets: List[str]):
         """
-        投稿セットのディレクトリ一覧を読み込む
-        
-        :return: 投稿セットディレクトリのリスト
+        未使用の投稿セットの一覧を設定する（ロック取得済み、または初期化時に呼び出す）
+
+        :param post_sets: 投稿セット名のリスト
+        """
+        self.post_sets = post_sets
+        # 削除をO(1)で行うため、各投稿セットのリスト内の位置を保持する
+        self._positions = {post_set: i for i, post_set in enumerate(post_sets)}
+
+    def _load_post_sets(self, used_post_sets: Set[str]) -> Tuple[List[str], Dict[str, Tuple[str, List[str]]]]:
+        """
+        投稿セットのディレクトリ一覧を読み込み、検査する（ロックを取得せずに呼び出す）
+
+        :param used_post_sets: 使用済みの投稿セット名（読み込み開始時点の複製）
+        :return: (投稿セットディレクトリのリスト, 検査に合格した投稿セットの辞書)のタプル
+        """
+        if self.index:
+            with metrics.span('index_refresh'):
+                self.index.refresh()
+            post_sets = [d for d in self.index.valid_post_sets() if d not in used_post_sets]
+        else:
+            post_sets = [d for d in os.listdir(self.posts_directory)
+                         if os.path.isdir(os.path.join(self.posts_directory, d)) and d not in used_post_sets]
+        validated = {}
+        if self.validator:
+            with metrics.span('validate_post_sets'):
+                validated = self.validator.validate(
+                    self.posts_directory, post_sets, self.index.signatures() if self.index else None
+                )
+            post_sets = [d for d in post_sets if d in validated]
+        self._last_refresh = time.monotonic()
+        return post_sets, validated
+
+    def _refresh_if_due(self):
         """
-        return [d for d in os.listdir(self.posts_directory) 
-                if os.path.isdir(os.path.join(self.posts_directory, d))]
+        インデックス使用時、一定間隔ごとに追加・変更された投稿セットを取り込む
+
+        読み込みと検査はロックの外で行い、その間は他のスレッドが現在の一覧から選択できるようにする。
+        結果は最後にロックを取得して差し替える。
+        """
+        with self._lock:
+            if (not self.index or self._refreshing
+                    or time.monotonic() - self._last_refresh < self.refresh_interval):
+                return
+            self._refreshing = True
+            used_post_sets = set(self.used_post_sets)
+        try:
+            post_sets, validated = self._load_post_sets(used_post_sets)
+            with self._lock:
+                # 読み込み中に使用済みになった投稿セットは取り込まない
+                self._set_post_sets([d for d in post_sets if d not in self.used_post_sets])
+                self._validated = validated
+        finally:
+            with self._lock:
+                self._refreshing = False
 
     def get_random_post(self) -> Tuple[str, List[str], str]:
         """
-        ランダムな投稿セットを選択する
-        
+        ランダムな投稿セットを選択し、予約する
+
+        予約した投稿セットは remove_post_set / record_failure / release を呼ぶまで他の呼び出しでは選択されない。
+
         :return: (キャプション, [画像パスのリスト], 投稿セット名)のタプル
         """
-        if not self.post_sets:
-            raise ValueError("投稿セットが見つかりません。")
+        with metrics.span('pick_post'):
+            return self._pick_random_post()
+
+    def _pick_random_post(self) -> Tuple[str, List[str], str]:
+        """get_random_post の本体"""
+        self._refresh_if_due()
+        with self._lock:
+            candidates = [p for p in self.post_sets if p not in self._reserved]
+            if not candidates:
+                raise ValueError("投稿セットが見つかりません。")
+            post_set = random.choice(candidates)
+            self._reserved.add(post_set)
+            validated = self._validated.get(post_set)
+
+        if validated:
+            caption, image_paths = validated
+            logging.info(f"投稿セット '{post_set}' をランダムに選択しました。")
+            return caption, list(image_paths), post_set
+
+        try:
+            return self._read_post_set(post_set)
+        except Exception:
+            self.release(post_set)
+            raise
+
+    def _read_post_set(self, post_set: str) -> Tuple[str, List[str], str]:
+        """
+        予約した投稿セットのキャプションと画像パスを読み込む
+
+        :param post_set: 投稿セット名
+        :return: (キャプション, [画像パスのリスト], 投稿セット名)のタプル
+        """
+        if self.index:
+            entry = self.index.get(post_set)
+            if entry is None:
+                raise ValueError(f"投稿セット {post_set} がインデックスに見つかりません。")
+            caption, image_paths = entry
+            logging.info(f"投稿セット '{post_set}' をランダムに選択しました。")
+            return caption, image_paths, post_set
 
-        post_set = random.choice(self.post_sets)
         post_dir = os.path.join(self.posts_directory, post_set)
         
-        caption_file = next(f for f in os.listdir(post_dir) if f.endswith('.txt'))
+        caption_file = next((f for f in os.listdir(post_dir) if f.endswith('.txt')), None)
+        if caption_file is None:
+            raise ValueError(f"投稿セット {post_set} にキャプションファイルがありません。")
         with open(os.path.join(post_dir, caption_file), 'r', encoding='utf-8') as f:
             caption = f.read().strip()
 
-        image_files = [f for f in os.listdir(post_dir) if f.endswith(('.jpg', '.jpeg', '.png'))]
+        # 以前のバージョンが投稿セット内に出力した透かし済み画像は入力として数えない
+        image_files = [f for f in os.listdir(post_dir)
+                       if f.endswith(('.jpg', '.jpeg', '.png')) and not f.startswith('watermarked_')]
         if len(image_files) != 2:
             raise ValueError(f"投稿セット {post_set} には2つの画像が必要です。")
 
@@ -48,12 +164,45 @@ class PostManager:
         logging.info(f"投稿セット '{post_set}' をランダムに選択しました。")
         return caption, image_paths, post_set
 
-    def remove_post_set(self, post_set: str):
+    def remove_post_set(self, post_set: str, account: Optional[str] = None, outcome: str = 'success'):
         """
         使用済みの投稿セットをリストから削除する
         
         :param post_set: 削除する投稿セット名
+        :param account: 投稿したアカウントのユーザー名（使用記録に残す）
+        :param outcome: 使用記録に残す結果（送信後に投稿完了を確認できなかった場合は 'unconfirmed'）
+        """
+        with self._lock:
+            self.used_post_sets.add(post_set)
+            self._reserved.discard(post_set)
+            if self.ledger:
+                self.ledger.record(post_set, account or '', outcome)
+            position = self._positions.pop(post_set, None)
+            if position is None:
+                return
+            # 末尾の要素と入れ替えてから削除する
+            last = self.post_sets.pop()
+            if last != post_set:
+                self.post_sets[position] = last
+                self._positions[last] = position
+        logging.info(f"投稿セット '{post_set}' を使用済みリストから削除しました。")
+
+    def record_failure(self, post_set: str, account: str):
+        """
+        投稿に失敗したことを使用記録に残す（投稿セットは未使用のまま、予約を解除する）
+
+        :param post_set: 投稿セット名
+        :param account: 投稿を試みたアカウントのユーザー名
+        """
+        if self.ledger:
+            self.ledger.record(post_set, account, 'failure')
+        self.release(post_set)
+
+    def release(self, post_set: str):
+        """
+        投稿セットの予約を解除し、再び選択できるようにする
+
+        :param post_set: 投稿セット名
         """
-        if post_set in self.post_sets:
-            self.post_sets.remove(post_set)
-            logging.info(f"投稿セット '{post_set}' を使用済みリストから削除しました。")
\ No newline at end of file
+        with self._lock:
+            self._reserved.discard(post_set)
@@ -0,0 +1,216 @@
+# post_validator.py
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+from PIL import Image
+from metrics import metrics
+from post_index import stat_post_set
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+# 1つの投稿セットの検査結果。reasons が空であれば投稿可能
+CheckResult = namedtuple('CheckResult', ['post_set', 'caption', 'image_paths', 'reasons'])
+
+
+def check_post_set(post_dir: str, min_dimension: int = 200, max_aspect_ratio: float = 10.0,
+                   max_file_mb: float = 0, max_caption_length: int = 500) -> CheckResult:
+    """
+    1つの投稿セットを検査する（子プロセスからも呼び出せるよう、モジュールの関数にしている）
+
+    キャプションがあり読み込めること、画像がちょうど2枚であること、各画像が破損しておらず
+    サイズ・縦横比・ファイルサイズが上限内であることを確認する。
+
+    :param post_dir: 投稿セットのディレクトリのパス
+    :param min_dimension: 画像の短辺の最小ピクセル数
+    :param max_aspect_ratio: 画像の縦横比（長辺/短辺）の上限
+    :param max_file_mb: 画像ファイルの最大サイズ（MB、0で無制限）
+    :param max_caption_length: キャプションの最大文字数（0で無制限）
+    :return: CheckResult
+    """
+    post_set = os.path.basename(post_dir)
+    reasons = []
+    caption = None
+    image_paths = []
+    try:
+        names = sorted(os.listdir(post_dir))
+    except OSError as e:
+        return CheckResult(post_set, None, [], [f"ディレクトリを読み込めません: {str(e)}"])
+
+    caption_file = next((name for name in names if name.endswith('.txt')), None)
+    if caption_file is None:
+        reasons.append("キャプションファイル（.txt）がありません。")
+    else:
+        try:
+            with open(os.path.join(post_dir, caption_file), 'r', encoding='utf-8') as f:
+                caption = f.read().strip()
+        except (OSError, UnicodeDecodeError) as e:
+            reasons.append(f"キャプションを読み込めません（{caption_file}）: {str(e)}")
+        else:
+            if not caption:
+                reasons.append(f"キャプションが空です（{caption_file}）。")
+            elif max_caption_length and len(caption) > max_caption_length:
+                reasons.append(f"キャプションが長すぎます（{len(caption)}文字, 上限 {max_caption_length}文字）。")
+
+    # 以前のバージョンが投稿セット内に出力した透かし済み画像は入力として数えない
+    image_files = [name for name in names
+                   if name.endswith(IMAGE_EXTENSIONS) and not name.startswith('watermarked_')]
+    if len(image_files) != 2:
+        reasons.append(f"画像が{len(image_files)}枚あります（2枚必要です）。")
+
+    for name in image_files:
+        path = os.path.join(post_dir, name)
+        image_paths.append(path)
+        try:
+            size_mb = os.path.getsize(path) / (1024 * 1024)
+            if max_file_mb and size_mb > max_file_mb:
+                reasons.append(f"{name} のファイルサイズが大きすぎます（{size_mb:.1f}MB, 上限 {max_file_mb:g}MB）。")
+            with Image.open(path) as img:
+                img.verify()
+            # verify() の後は画像を使えないため、サイズは開き直して取得する
+            with Image.open(path) as img:
+                width, height = img.size
+        except Exception as e:
+            reasons.append(f"{name} を画像として読み込めません: {str(e)}")
+            continue
+        if min(width, height) < min_dimension:
+            reasons.append(f"{name} が小さすぎます（{width}x{height}, 短辺の下限 {min_dimension}px）。")
+        elif max_aspect_ratio and max(width, height) / min(width, height) > max_aspect_ratio:
+            reasons.append(f"{name} の縦横比が大きすぎます（{width}x{height}, 上限 {max_aspect_ratio:g}:1）。")
+
+    return CheckResult(post_set, caption, image_paths, reasons)
+
+
+class PostSetValidator:
+    def __init__(self, workers: int = 4, use_processes: bool = False, min_dimension: int = 200,
+                 max_aspect_ratio: float = 10.0, max_file_mb: float = 0, max_caption_length: int = 500,
+                 quarantine_path: Optional[str] = 'data/quarantine.json'):
+        """
+        PostSetValidatorクラスのコンストラクタ
+
+        投稿セットをスレッド（またはプロセス）プールで並列に検査し、不備のあるセットを理由とともに隔離リストに記録する。
+        隔離した投稿セットは選択対象から外し、ログイン後の投稿処理で初めて不備が見つかることの無いようにする。
+        検査結果は投稿セットのシグネチャ（各ファイルの更新時刻とサイズ、post_index.stat_post_set）とともに保持し、
+        変更の無い投稿セットは再検査しない。
+
+        :param workers: 並列に検査する数
+        :param use_processes: Trueの場合はプロセスプールで検査する
+        :param min_dimension: 画像の短辺の最小ピクセル数
+        :param max_aspect_ratio: 画像の縦横比（長辺/短辺）の上限
+        :param max_file_mb: 画像ファイルの最大サイズ（MB、0で無制限）
+        :param max_caption_length: キャプションの最大文字数（0で無制限）
+        :param quarantine_path: 隔離した投稿セットと理由を保存するJSONファイルのパス（Noneの場合は保存しない）
+        """
+        self.workers = max(1, workers)
+        self.use_processes = use_processes
+        self.limits = (min_dimension, max_aspect_ratio, max_file_mb, max_caption_length)
+        self.quarantine_path = quarantine_path
+        # 投稿セット名から (シグネチャ, CheckResult) への辞書
+        self._results: Dict[str, Tuple[tuple, CheckResult]] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config) -> Optional['PostSetValidator']:
+        """
+        設定ファイルの [Validation] セクションからPostSetValidatorを生成する
+
+        [Encoding] が有効な場合は投稿前に縮小・再エンコードされるため、元画像のファイルサイズは検査しない。
+
+        :param config: 設定情報
+        :return: PostSetValidatorインスタンス（無効な場合はNone）
+        """
+        if not config.getboolean('Validation', 'enabled', fallback=False):
+            return None
+        max_file_mb = config.getfloat('Validation', 'max_file_mb', fallback=0)
+        if config.getboolean('Encoding', 'enabled', fallback=False):
+            max_file_mb = 0
+        return cls(
+            workers=config.getint('Validation', 'workers', fallback=4),
+            use_processes=config.get('Validation', 'executor', fallback='thread') == 'process',
+            min_dimension=config.getint('Validation', 'min_dimension', fallback=200),
+            max_aspect_ratio=config.getfloat('Validation', 'max_aspect_ratio', fallback=10.0),
+            max_file_mb=max_file_mb,
+            max_caption_length=config.getint('Validation', 'max_caption_length', fallback=500),
+            quarantine_path=config.get('Validation', 'quarantine_path', fallback='data/quarantine.json') or None,
+        )
+
+    def validate(self, posts_directory: str, post_sets: Iterable[str],
+                 signatures: Optional[Dict[str, tuple]] = None) -> Dict[str, Tuple[str, List[str]]]:
+        """
+        投稿セットを並列に検査し、投稿可能なものだけを返す
+
+        :param posts_directory: 投稿セットが保存されているディレクトリのパス
+        :param post_sets: 検査する投稿セット名
+        :param signatures: 投稿セット名からシグネチャへの辞書（PostIndex.signatures。Noneの場合はここで取得する）
+        :return: 投稿可能な投稿セット名から (キャプション, [画像パスのリスト]) への辞書
+        """
+        start = time.monotonic()
+        post_sets = list(post_sets)
+        current = {}
+        for post_set in post_sets:
+            signature = signatures.get(post_set) if signatures is not None else None
+            if signature is None:
+                signature = stat_post_set(os.path.join(posts_directory, post_set))
+            current[post_set] = tuple(signature)
+        with self._lock:
+            pending = [post_set for post_set in post_sets
+                       if post_set not in self._results or self._results[post_set][0] != current[post_set]]
+
+        if pending:
+            executor_class = ProcessPoolExecutor if self.use_processes and len(pending) > 1 else ThreadPoolExecutor
+            with executor_class(max_workers=min(self.workers, len(pending))) as executor:
+                checked = list(executor.map(
+                    check_post_set,
+                    [os.path.join(posts_directory, post_set) for post_set in pending],
+                    *[[limit] * len(pending) for limit in self.limits],
+                    chunksize=16 if self.use_processes else 1,
+                ))
+            with self._lock:
+                for post_set, result in zip(pending, checked):
+                    self._results[post_set] = (current[post_set], result)
+                    if result.reasons:
+                        logging.warning(f"投稿セット '{post_set}' を隔離しました: {' '.join(result.reasons)}")
+
+        with self._lock:
+            # 削除された投稿セットの結果は残さない
+            self._results = {name: self._results[name] for name in post_sets}
+            results = [result for _, result in self._results.values()]
+        valid = {r.post_set: (r.caption, r.image_paths) for r in results if not r.reasons}
+        quarantined = {r.post_set: r.reasons for r in results if r.reasons}
+        metrics.gauge('quarantined_post_sets', len(quarantined))
+        self._save_quarantine(quarantined)
+        logging.info(
+            f"投稿セットを検査しました。投稿可能: {len(valid)}件, 隔離: {len(quarantined)}件, "
+            f"検査: {len(pending)}件 ({time.monotonic() - start:.2f}秒)"
+        )
+        return valid
+
+    def quarantined(self) -> Dict[str, List[str]]:
+        """
+        隔離中の投稿セットと理由を返す
+
+        :return: 投稿セット名から理由のリストへの辞書
+        """
+        with self._lock:
+            return {name: result.reasons for name, (_, result) in self._results.items() if result.reasons}
+
+    def _save_quarantine(self, quarantined: Dict[str, List[str]]):
+        """
+        隔離リストをJSONファイルに保存する
+
+        :param quarantined: 投稿セット名から理由のリストへの辞書
+        """
+        if not self.quarantine_path:
+            return
+        directory = os.path.dirname(self.quarantine_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{self.quarantine_path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(quarantined, f, ensure_ascii=False, indent=2, sort_keys=True)
+        os.replace(temp_path, self.quarantine_path)
@@ -0,0 +1,179 @@
+# prefetcher.py
+
+import configparser
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from image_processor import ImageProcessor
+from metrics import metrics
+
+
+# 画像処理に関係する設定セクション（子プロセスに渡す）
+IMAGE_SECTIONS = ('Watermark', 'Encoding', 'ImageCache')
+
+# 子プロセスで記録したログ（_init_worker で設定する）
+_worker_records = []
+
+
+class _ListHandler(logging.Handler):
+    """ログのレコードをリストに追加するだけのハンドラー"""
+
+    def emit(self, record):
+        _worker_records.append((record.levelno, record.getMessage()))
+
+
+def _init_worker():
+    """
+    子プロセスの初期化
+
+    forkでは出力先の無いQueueHandlerを、spawnではハンドラーの無いロガーを引き継ぐため、
+    ログとメトリクスは子プロセスで保持して結果とともに親プロセスに返す。
+    """
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(_ListHandler())
+    root.setLevel(logging.INFO)
+    metrics.capture_events()
+
+
+def _process_images(image_settings, image_paths, username):
+    """
+    子プロセスで画像を処理する
+
+    :param image_settings: 画像処理に関係する設定セクションの辞書
+    :param image_paths: 処理する画像パスのリスト
+    :param username: 透かしとして追加するユーザーネーム
+    :return: (処理された画像パスのリスト, [(ログレベル, メッセージ)のリスト], [メトリクスのイベントのリスト])のタプル
+    """
+    del _worker_records[:]
+    metrics.drain_events()
+    config = configparser.ConfigParser()
+    config.read_dict(image_settings)
+    processed_paths = ImageProcessor(config).process_images(image_paths, username)
+    return processed_paths, list(_worker_records), metrics.drain_events()
+
+
+class PostPrefetcher:
+    def __init__(self, config, post_manager, max_workers=2, take_timeout=120):
+        """
+        PostPrefetcherクラスのコンストラクタ
+
+        各アカウントの次の投稿セットを事前に選択し、画像処理をプロセスプールで先に済ませておく。
+        スケジューラの待機中やブラウザ起動前に処理を終わらせ、WebDriverのセッション中に画像処理を行わないようにする。
+
+        :param config: 設定情報
+        :param post_manager: PostManagerインスタンス
+        :param max_workers: 画像処理を行うプロセス数
+        :param take_timeout: take で画像処理の完了を待つ最大秒数（超えた場合は先読みを使わずに処理する）
+        """
+        self.post_manager = post_manager
+        self.take_timeout = take_timeout
+        self.update_image_settings(config)
+        self.executor = ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker)
+        self._pending = {}
+        self._lock = threading.Lock()
+        logging.info(f"投稿の先読みを有効化しました。プロセス数: {max_workers}")
+
+    @classmethod
+    def from_config(cls, config, post_manager):
+        """
+        設定ファイルの [Prefetch] セクションからPostPrefetcherを生成する
+
+        :param config: 設定情報
+        :param post_manager: PostManagerインスタンス
+        :return: PostPrefetcherインスタンス（無効な場合はNone）
+        """
+        if not config.getboolean('Prefetch', 'enabled', fallback=False):
+            return None
+        return cls(
+            config, post_manager,
+            max_workers=config.getint('Prefetch', 'workers', fallback=2),
+            take_timeout=config.getfloat('Prefetch', 'take_timeout', fallback=120),
+        )
+
+    def update_image_settings(self, config):
+        """
+        子プロセスに渡す画像処理の設定を更新する（以降に開始する先読みから反映される）
+
+        :param config: 設定情報
+        """
+        self.image_settings = {section: dict(config[section]) for section in IMAGE_SECTIONS if config.has_section(section)}
+
+    def prefetch(self, username):
+        """
+        アカウントの次の投稿セットを選択し、画像処理をバックグラウンドで開始する
+
+        :param username: 投稿するアカウントのユーザー名
+        """
+        with self._lock:
+            if username in self._pending:
+                return
+            try:
+                # 選択した投稿セットは PostManager が予約するため、他のアカウントとは重複しない
+                caption, image_paths, post_set = self.post_manager.get_random_post()
+            except Exception as e:
+                logging.warning(f"{username} の投稿セットを先読みできませんでした: {str(e)}")
+                return
+            future = self.executor.submit(_process_images, self.image_settings, image_paths, username)
+            self._pending[username] = (caption, post_set, future)
+        logging.info(f"{username} の投稿セット '{post_set}' の先読みを開始しました。")
+
+    def prefetch_all(self, accounts):
+        """
+        すべてのアカウントの次の投稿セットを先読みする
+
+        設定の再読み込みで削除されたアカウントの先読みは破棄し、投稿セットの予約を解除する。
+
+        :param accounts: アカウント情報のリスト
+        """
+        usernames = {account['username'] for account in accounts}
+        with self._lock:
+            departed = {username: self._pending.pop(username) for username in list(self._pending)
+                        if username not in usernames}
+        for username, (_, post_set, future) in departed.items():
+            future.cancel()
+            self.release(post_set)
+            logging.info(f"削除されたアカウント {username} の投稿セット '{post_set}' の先読みを破棄しました。")
+        for account in accounts:
+            self.prefetch(account['username'])
+
+    def take(self, username, timeout=None):
+        """
+        先読み済みの投稿を取り出す。画像処理が終わっていなければ完了まで待機する。
+
+        :param username: 投稿するアカウントのユーザー名
+        :param timeout: 画像処理の完了を待つ最大秒数（省略時は take_timeout）
+        :return: (キャプション, [処理済み画像パスのリスト], 投稿セット名)のタプル。先読みが無い・失敗した場合はNone
+        """
+        with self._lock:
+            entry = self._pending.pop(username, None)
+        if entry is None:
+            return None
+
+        caption, post_set, future = entry
+        try:
+            processed_paths, records, events = future.result(self.take_timeout if timeout is None else timeout)
+        except Exception as e:
+            future.cancel()
+            logging.warning(f"{username} の投稿セット '{post_set}' の先読みに失敗しました: {str(e) or type(e).__name__}")
+            self.release(post_set)
+            return None
+        # 子プロセスで記録したログとメトリクスを、このアカウントの処理として記録し直す
+        for level, message in records:
+            logging.log(level, message)
+        metrics.replay(events)
+        return caption, processed_paths, post_set
+
+    def release(self, post_set):
+        """
+        投稿セットの予約を解除する（投稿完了後または失敗時に呼び出す）
+
+        :param post_set: 投稿セット名
+        """
+        self.post_manager.release(post_set)
+
+    def shutdown(self):
+        """プロセスプールを終了する"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        logging.info("投稿の先読みを終了しました。")
@@ -0,0 +1,67 @@
+import os
+import shutil
+import logging
+
+class ProfileManager:
+    def __init__(self, profiles_dir='profiles'):
+        """
+        ProfileManagerクラスのコンストラクタ
+
+        アカウントごとに永続的なChromeプロファイル（user-data-dir）を割り当てる。
+        クッキーに加えてlocalStorage・IndexedDB・HTTPキャッシュも実行間で保持される。
+        
+        :param profiles_dir: プロファイルを保存するディレクトリ
+        """
+        self.profiles_dir = os.path.abspath(profiles_dir)
+        if not os.path.exists(self.profiles_dir):
+            os.makedirs(self.profiles_dir)
+        logging.info(f"プロファイル保存ディレクトリを設定: {self.profiles_dir}")
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        設定ファイルの [Session] セクションからProfileManagerを生成する
+        
+        :param config: 設定情報
+        :return: ProfileManagerインスタンス（mode が profile 以外の場合はNone）
+        """
+        if config.get('Session', 'mode', fallback='cookies') != 'profile':
+            return None
+        return cls(config.get('Session', 'profiles_dir', fallback='profiles'))
+
+    def get_profile_dir(self, username):
+        """
+        アカウント用のプロファイルディレクトリを取得する（存在しなければ作成する）
+        
+        :param username: プロファイルを使用するアカウントのユーザー名
+        :return: プロファイルディレクトリの絶対パス
+        """
+        profile_dir = os.path.join(self.profiles_dir, username)
+        if not os.path.exists(profile_dir):
+            # 複数のアカウントのスレッドから同時に呼ばれても失敗しないようにする
+            os.makedirs(profile_dir, exist_ok=True)
+            logging.info(f"{username} のプロファイルを作成しました: {profile_dir}")
+        return profile_dir
+
+    def has_profile(self, username):
+        """
+        アカウントのプロファイルが作成済みかどうかを確認する
+        
+        :param username: 確認するアカウントのユーザー名
+        :return: プロファイルが存在し、空でないかどうか
+        """
+        profile_dir = os.path.join(self.profiles_dir, username)
+        return os.path.isdir(profile_dir) and bool(os.listdir(profile_dir))
+
+    def delete_profile(self, username):
+        """
+        アカウントのプロファイルを削除する
+        
+        :param username: プロファイルを削除するアカウントのユーザー名
+        """
+        profile_dir = os.path.join(self.profiles_dir, username)
+        if os.path.exists(profile_dir):
+            shutil.rmtree(profile_dir)
+            logging.info(f"{username} のプロファイルを削除しました")
+        else:
+            logging.info(f"{username} のプロファイルが見つかりません")
@@ -0,0 +1,503 @@
+# publishers.py
+
+import hashlib
+import http.client
+import json
+import logging
+import os
+import threading
+import time
+from urllib.parse import quote, urlencode, urlsplit
+from metrics import metrics
+from utils import FatalError, RetryableError, UnconfirmedPostError
+
+THREADS_API_URL = 'https://graph.threads.net/v1.0'
+# レート制限（スロットリング）を示すAPIのエラーコード
+THROTTLE_ERROR_CODES = {4, 17, 32, 613}
+# アクセストークンが無効・期限切れであることを示すAPIのエラーコード
+INVALID_TOKEN_ERROR_CODE = 190
+# 長期アクセストークンは発行から24時間経過するまで更新できない
+TOKEN_MIN_AGE = 24 * 60 * 60
+
+
+def create_publisher(config):
+    """
+    設定ファイルの [Publisher] backend に応じてAPIによる投稿を生成する
+
+    ブラウザによる投稿（既定）はThreadsAutomatorが直接行う。
+
+    :param config: 設定情報
+    :return: ThreadsApiPublisherインスタンス（browser の場合はNone）
+    """
+    backend = config.get('Publisher', 'backend', fallback='browser')
+    if backend == 'api':
+        return ThreadsApiPublisher.from_config(config)
+    if backend != 'browser':
+        logging.warning(f"不明な投稿方法 '{backend}' が指定されました。ブラウザで投稿します。")
+    return None
+
+
+class ConnectionPool:
+    def __init__(self, base_url, max_connections=4, timeout=30):
+        """
+        ConnectionPoolクラスのコンストラクタ
+
+        1つのホストへのkeep-alive接続を保持し、リクエストごとのTCP・TLSの接続確立を省略する。
+        同時に使用する接続数は max_connections までに制限する。
+
+        :param base_url: 接続先のURL（スキーム・ホスト・ポートのみ使用する）
+        :param max_connections: 同時に使用・保持する接続数の上限
+        :param timeout: 接続と応答のタイムアウト（秒）
+        """
+        parts = urlsplit(base_url)
+        if parts.scheme not in ('http', 'https'):
+            raise ValueError(f"対応していないURLです: {base_url}")
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_connections)
+
+    def _connect(self):
+        """新しい接続を作成する"""
+        connection_class = http.client.HTTPSConnection if self.scheme == 'https' else http.client.HTTPConnection
+        return connection_class(self.host, self.port, timeout=self.timeout)
+
+    def request(self, method, path, body=None, headers=None, resend=True):
+        """
+        リクエストを送信し、応答を読み込む
+
+        保持していた接続がサーバー側で閉じられていた場合は、新しい接続で1回だけ送り直す。
+        resend=False のリクエスト（投稿の公開など）は、サーバーが処理した後に接続が切れた可能性を否定できないため
+        送り直さない。その代わり、閉じられている可能性のある保持中の接続は使わず、新しい接続で送信する。
+
+        :param method: HTTPメソッド
+        :param path: パス（クエリ文字列を含む）
+        :param body: リクエストボディ（バイト列）
+        :param headers: リクエストヘッダーの辞書
+        :param resend: 接続が切れた場合に送り直してよいかどうか
+        :return: (ステータスコード, 応答ヘッダー, 応答ボディ)のタプル
+        """
+        with self._slots:
+            connection = None
+            if resend:
+                with self._lock:
+                    connection = self._idle.pop() if self._idle else None
+            reused = connection is not None
+            while True:
+                if connection is None:
+                    connection = self._connect()
+                metrics.increment('api_connection', state='reused' if reused else 'new')
+                try:
+                    connection.request(method, path, body=body, headers=headers or {})
+                    response = connection.getresponse()
+                    data = response.read()
+                except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                    connection.close()
+                    if not reused:
+                        raise
+                    # 待機中にサーバーが閉じたkeep-alive接続。リクエストは処理されていない
+                    connection, reused = None, False
+                    continue
+                except Exception:
+                    connection.close()
+                    raise
+                break
+            if response.will_close:
+                connection.close()
+            else:
+                with self._lock:
+                    self._idle.append(connection)
+            return response.status, response.headers, data
+
+    def close(self):
+        """保持している接続をすべて閉じる"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+
+class RequestPacer:
+    def __init__(self, min_interval=1.0):
+        """
+        RequestPacerクラスのコンストラクタ
+
+        APIリクエストの間隔を min_interval 秒以上空ける。レート制限を受けた場合は defer で次のリクエストを遅らせる。
+
+        :param min_interval: リクエストの最小間隔（秒）
+        """
+        self.min_interval = min_interval
+        self._next_at = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """次のリクエストを送信できる時刻まで待機する"""
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_at)
+            self._next_at = start + self.min_interval
+        if start > now:
+            time.sleep(start - now)
+
+    def defer(self, seconds):
+        """
+        次のリクエストを少なくとも seconds 秒後まで遅らせる
+
+        :param seconds: 遅らせる時間（秒）
+        """
+        with self._lock:
+            self._next_at = max(self._next_at, time.monotonic() + seconds)
+
+
+class TokenStore:
+    def __init__(self, path):
+        """
+        TokenStoreクラスのコンストラクタ
+
+        更新したアクセストークンと有効期限をアカウントごとにJSONファイルへ保存する。
+        accounts.json のトークンが書き換えられた場合は、保存済みのトークンより新しいものとして扱う。
+
+        :param path: 保存先のファイルパス
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._tokens = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self._tokens = json.load(f)
+            except (OSError, ValueError) as e:
+                logging.warning(f"アクセストークンの保存ファイルを読み込めませんでした: {str(e)}")
+
+    @staticmethod
+    def _fingerprint(token):
+        """accounts.json のトークンが変わったかを判定するための値（トークン自体は保存しない）"""
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()[:16]
+
+    def get(self, account):
+        """
+        アカウントの現在のアクセストークン情報を返す
+
+        :param account: アカウント情報
+        :return: access_token / expires_at / refreshed_at を持つ辞書（トークンが無い場合はNone）
+        """
+        seed = account.get('threads_access_token')
+        with self._lock:
+            entry = self._tokens.get(account['username'])
+        if entry and (not seed or entry.get('seed') == self._fingerprint(seed)):
+            return dict(entry)
+        if not seed:
+            return None
+        return {'access_token': seed, 'expires_at': None, 'refreshed_at': None, 'seed': self._fingerprint(seed)}
+
+    def update(self, account, access_token, expires_in):
+        """
+        更新したアクセストークンを保存する
+
+        :param account: アカウント情報
+        :param access_token: 新しいアクセストークン
+        :param expires_in: 有効期間（秒）
+        """
+        seed = account.get('threads_access_token')
+        now = time.time()
+        with self._lock:
+            self._tokens[account['username']] = {
+                'access_token': access_token,
+                'expires_at': now + expires_in,
+                'refreshed_at': now,
+                'seed': self._fingerprint(seed) if seed else None,
+            }
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._tokens, f, indent=2)
+            os.replace(temp_path, self.path)
+
+
+class ThreadsApiPublisher:
+    def __init__(self, api_base_url=THREADS_API_URL, media_base_url='', media_root='cache/images',
+                 token_file='data/threads_tokens.json', token_refresh_days=7, max_connections=4, request_timeout=30,
+                 min_request_interval=1.0, throttle_delay=60, usage_threshold=80, container_timeout=120,
+                 status_poll_interval=3):
+        """
+        ThreadsApiPublisherクラスのコンストラクタ
+
+        Threadsの公式API（メディアコンテナの作成 → 公開）で投稿する。2枚の画像はカルーセル投稿にする。
+        コンテナの作成は何度やり直しても投稿が重複しないため再試行の対象とし、公開は結果が不明な場合に再送信しない。
+        APIは画像をURLで受け取るため、media_root 以下の処理済み画像を media_base_url で公開しておく必要がある。
+        アカウント情報の threads_access_token（長期アクセストークン）と threads_user_id（省略時は me）を使用する。
+
+        :param api_base_url: APIのベースURL（スタブサーバーで試験する場合はそのURL）
+        :param media_base_url: media_root を公開しているURL
+        :param media_root: 公開している画像のディレクトリ
+        :param token_file: 更新したアクセストークンの保存先
+        :param token_refresh_days: 有効期限の何日前にアクセストークンを更新するか
+        :param max_connections: 保持するkeep-alive接続の上限
+        :param request_timeout: リクエストのタイムアウト（秒）
+        :param min_request_interval: リクエストの最小間隔（秒）
+        :param throttle_delay: レート制限を受けた場合に次のリクエストまで空ける時間（秒、Retry-Afterが無い場合）
+        :param usage_threshold: この使用率（%）を超えたらリクエストを throttle_delay 秒控える
+        :param container_timeout: メディアコンテナの処理完了を待つ最大時間（秒）
+        :param status_poll_interval: メディアコンテナの処理状況を確認する間隔（秒）
+        """
+        self.base_path = urlsplit(api_base_url).path.rstrip('/')
+        self.media_base_url = media_base_url.rstrip('/')
+        self.media_root = os.path.abspath(media_root)
+        self.token_refresh_seconds = token_refresh_days * 24 * 60 * 60
+        self.throttle_delay = throttle_delay
+        self.usage_threshold = usage_threshold
+        self.container_timeout = container_timeout
+        self.status_poll_interval = status_poll_interval
+        self.pool = ConnectionPool(api_base_url, max_connections, request_timeout)
+        self.pacer = RequestPacer(min_request_interval)
+        self.tokens = TokenStore(token_file)
+        # アカウントごとにトークンの更新を直列化する
+        self._refresh_locks = {}
+        self._refresh_locks_lock = threading.Lock()
+        if not self.media_base_url:
+            logging.warning("[Publisher] media_base_url が設定されていません。APIでの画像の投稿はできません。")
+        logging.info(f"Threads APIによる投稿を有効にしました。API: {api_base_url}, 画像の公開URL: {self.media_base_url}")
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        設定ファイルの [Publisher] セクションからThreadsApiPublisherを生成する
+
+        :param config: 設定情報
+        :return: ThreadsApiPublisherインスタンス
+        """
+        return cls(
+            api_base_url=config.get('Publisher', 'api_base_url', fallback=THREADS_API_URL),
+            media_base_url=config.get('Publisher', 'media_base_url', fallback=''),
+            media_root=config.get('Publisher', 'media_root', fallback='')
+                       or config.get('ImageCache', 'directory', fallback='cache/images'),
+            token_file=config.get('Publisher', 'token_file', fallback='data/threads_tokens.json'),
+            token_refresh_days=config.getfloat('Publisher', 'token_refresh_days', fallback=7),
+            max_connections=config.getint('Publisher', 'max_connections', fallback=4),
+            request_timeout=config.getfloat('Publisher', 'request_timeout', fallback=30),
+            min_request_interval=config.getfloat('Publisher', 'min_request_interval', fallback=1.0),
+            throttle_delay=config.getfloat('Publisher', 'throttle_delay', fallback=60),
+            usage_threshold=config.getfloat('Publisher', 'usage_threshold', fallback=80),
+            container_timeout=config.getfloat('Publisher', 'container_timeout', fallback=120),
+            status_poll_interval=config.getfloat('Publisher', 'status_poll_interval', fallback=3),
+        )
+
+    def has_credentials(self, account):
+        """
+        このアカウントをAPIで投稿できるかどうか
+
+        :param account: アカウント情報
+        :return: 投稿に必要な情報が揃っていればTrue
+        """
+        return bool(self.media_base_url) and self.tokens.get(account) is not None
+
+    def media_url(self, image_path):
+        """
+        処理済み画像の公開URLを返す
+
+        :param image_path: 処理済みの画像パス
+        :return: 画像のURL
+        """
+        relative = os.path.relpath(os.path.abspath(image_path), self.media_root)
+        if relative.startswith(os.pardir):
+            raise FatalError(f"画像 {image_path} は公開ディレクトリ {self.media_root} の外にあります。")
+        return f"{self.media_base_url}/{quote(relative.replace(os.sep, '/'))}"
+
+    def _observe_usage(self, headers):
+        """
+        応答ヘッダーのAPI使用率を確認し、閾値を超えていれば次のリクエストを遅らせる
+
+        :param headers: 応答ヘッダー
+        """
+        for name in ('X-App-Usage', 'X-Business-Use-Case-Usage'):
+            value = headers.get(name)
+            if not value:
+                continue
+            try:
+                usage = json.loads(value)
+            except ValueError:
+                continue
+            # X-Business-Use-Case-Usage は {ID: [使用率の辞書, ...]} の形式
+            entries = [usage] if name == 'X-App-Usage' else [e for v in usage.values() for e in v]
+            percent = max((v for e in entries for v in e.values() if isinstance(v, (int, float))), default=0)
+            if percent >= self.usage_threshold:
+                logging.warning(f"APIの使用率が {percent}% に達しました。リクエストを {self.throttle_delay:.0f}秒控えます。")
+                self.pacer.defer(self.throttle_delay)
+
+    def _call(self, endpoint, method, path, params, access_token=None, resend=True):
+        """
+        APIを1回呼び出す
+
+        :param endpoint: メトリクスに記録するエンドポイント名
+        :param method: HTTPメソッド（GET / POST）
+        :param path: パス
+        :param params: パラメータの辞書（GETはクエリ、POSTはフォームとして送信する）
+        :param access_token: アクセストークン
+        :param resend: 失敗時に送り直しても投稿が重複しない呼び出しかどうか
+        :return: 応答のJSON
+        """
+        params = dict(params)
+        if access_token:
+            params['access_token'] = access_token
+        encoded = urlencode(params)
+        self.pacer.wait()
+        start = time.monotonic()
+        try:
+            if method == 'GET':
+                status, headers, body = self.pool.request('GET', f"{path}?{encoded}")
+            else:
+                status, headers, body = self.pool.request(
+                    'POST', path, encoded.encode('ascii'), {'Content-Type': 'application/x-www-form-urlencoded'},
+                    resend=resend,
+                )
+        except (OSError, http.client.HTTPException) as e:
+            metrics.increment('api_request', endpoint=endpoint, status='error')
+            if not resend:
+                raise UnconfirmedPostError(f"APIの応答を受け取れませんでした。重複投稿を避けるため再送信しません: {str(e)}")
+            raise RetryableError(f"APIへの接続に失敗しました: {str(e)}")
+        metrics.observe('api_request', time.monotonic() - start, endpoint=endpoint)
+        metrics.increment('api_request', endpoint=endpoint, status=str(status))
+        self._observe_usage(headers)
+
+        try:
+            data = json.loads(body) if body else {}
+        except ValueError:
+            data = {}
+        if status < 400:
+            return data
+
+        error = data.get('error') or {}
+        message = error.get('message') or body[:200].decode('utf-8', 'replace')
+        code = error.get('code')
+        if status == 429 or code in THROTTLE_ERROR_CODES:
+            retry_after = headers.get('Retry-After')
+            delay = float(retry_after) if retry_after and retry_after.isdigit() else self.throttle_delay
+            self.pacer.defer(delay)
+            # レート制限による拒否はリクエストが処理されていないため、公開でも再試行できる
+            raise RetryableError(f"APIのレート制限を受けました（{delay:.0f}秒後まで待機）: {message}")
+        if code == INVALID_TOKEN_ERROR_CODE:
+            raise FatalError(f"アクセストークンが無効です: {message}")
+        if resend and (status >= 500 or error.get('is_transient')):
+            raise RetryableError(f"APIの一時的なエラー（{status}）: {message}")
+        raise FatalError(f"APIがエラーを返しました（{status}, code={code}）: {message}")
+
+    def _refresh_lock(self, username):
+        """アカウントごとのトークン更新用のロックを返す"""
+        with self._refresh_locks_lock:
+            return self._refresh_locks.setdefault(username, threading.Lock())
+
+    def access_token(self, account):
+        """
+        アカウントのアクセストークンを返す。有効期限が近い場合は更新してから返す
+
+        有効期限が不明なトークン（accounts.json に設定しただけのもの）は、更新して有効期限を取得する。
+
+        :param account: アカウント情報
+        :return: アクセストークン
+        """
+        with self._refresh_lock(account['username']):
+            entry = self.tokens.get(account)
+            if entry is None:
+                raise FatalError(f"アカウント {account['username']} のアクセストークンが設定されていません。")
+            now = time.time()
+            expires_at = entry.get('expires_at')
+            refreshed_at = entry.get('refreshed_at')
+            if expires_at is not None and expires_at - now > self.token_refresh_seconds:
+                return entry['access_token']
+            if refreshed_at is not None and now - refreshed_at < TOKEN_MIN_AGE:
+                return entry['access_token']
+            try:
+                data = self._call('refresh_token', 'GET', '/refresh_access_token', {
+                    'grant_type': 'th_refresh_token',
+                    'access_token': entry['access_token'],
+                })
+            except (FatalError, RetryableError) as e:
+                if expires_at is not None and expires_at <= now:
+                    raise FatalError(f"アカウント {account['username']} のアクセストークンの有効期限が切れています: {str(e)}")
+                logging.warning(f"アカウント {account['username']} のアクセストークンを更新できませんでした: {str(e)}")
+                return entry['access_token']
+            self.tokens.update(account, data['access_token'], float(data.get('expires_in', 0)))
+            logging.info(
+                f"アカウント {account['username']} のアクセストークンを更新しました。"
+                f"有効期間: {float(data.get('expires_in', 0)) / 86400:.0f}日"
+            )
+            return data['access_token']
+
+    def create_container(self, account, caption, image_paths):
+        """
+        投稿内容のメディアコンテナを作成し、公開できる状態になるまで待つ
+
+        :param account: アカウント情報
+        :param caption: キャプション
+        :param image_paths: 処理済みの画像パスのリスト
+        :return: コンテナID
+        """
+        if not image_paths:
+            raise FatalError("投稿する画像がありません。")
+        access_token = self.access_token(account)
+        threads_path = f"{self.base_path}/{account.get('threads_user_id', 'me')}/threads"
+        urls = [self.media_url(path) for path in image_paths]
+
+        if len(urls) == 1:
+            container_id = self._call('create_container', 'POST', threads_path, {
+                'media_type': 'IMAGE', 'image_url': urls[0], 'text': caption,
+            }, access_token)['id']
+        else:
+            children = [
+                self._call('create_container', 'POST', threads_path, {
+                    'media_type': 'IMAGE', 'image_url': url, 'is_carousel_item': 'true',
+                }, access_token)['id']
+                for url in urls
+            ]
+            container_id = self._call('create_container', 'POST', threads_path, {
+                'media_type': 'CAROUSEL', 'children': ','.join(children), 'text': caption,
+            }, access_token)['id']
+
+        self._wait_until_finished(container_id, access_token)
+        logging.info(f"メディアコンテナ {container_id} を作成しました（画像 {len(urls)}枚）。")
+        return container_id
+
+    def _wait_until_finished(self, container_id, access_token):
+        """
+        メディアコンテナの処理が完了するまで待つ
+
+        :param container_id: コンテナID
+        :param access_token: アクセストークン
+        """
+        deadline = time.monotonic() + self.container_timeout
+        while True:
+            data = self._call(
+                'container_status', 'GET', f"{self.base_path}/{container_id}", {'fields': 'status,error_message'}, access_token
+            )
+            status = data.get('status')
+            if status == 'FINISHED':
+                return
+            if status in ('ERROR', 'EXPIRED'):
+                raise FatalError(f"メディアコンテナ {container_id} の処理に失敗しました（{status}）: {data.get('error_message')}")
+            if time.monotonic() + self.status_poll_interval > deadline:
+                raise RetryableError(f"メディアコンテナ {container_id} の処理が {self.container_timeout:.0f}秒以内に完了しませんでした。")
+            time.sleep(self.status_poll_interval)
+
+    def publish_container(self, account, container_id):
+        """
+        メディアコンテナを公開する
+
+        :param account: アカウント情報
+        :param container_id: create_container で作成したコンテナID
+        :return: 公開された投稿のID
+        :raises UnconfirmedPostError: 送信後に応答を受け取れなかった場合（再送信しない）
+        """
+        access_token = self.access_token(account)
+        data = self._call('publish', 'POST', f"{self.base_path}/{account.get('threads_user_id', 'me')}/threads_publish", {
+            'creation_id': container_id,
+        }, access_token, resend=False)
+        return data['id']
+
+    def close(self):
+        """保持している接続を解放する"""
+        self.pool.close()
@@ -1,65 +1,310 @@
 # scheduler.py
 
+import heapq
 import json
 import logging
+import os
+import threading
+from collections import namedtuple
 from datetime import datetime, timedelta
-import time
+from metrics import metrics
+
+# 発火した実行予定。accounts が None の場合は全アカウントが対象。deadline は次の実行予定時刻（無い場合はNone）
+ScheduledRun = namedtuple('ScheduledRun', ['time', 'accounts', 'deadline'])
+
+# 実行予定時刻を過ぎた予定の扱い
+#   skip: 実行せずに次回へ送る / coalesce: まとめて1回だけすぐに実行する / queue: 1件ずつ順番にすぐ実行する
+MISFIRE_POLICIES = ('skip', 'coalesce', 'queue')
+
+WEEKDAY_NAMES = {'sun': 0, 'mon': 1, 'tue': 2, 'wed': 3, 'thu': 4, 'fri': 5, 'sat': 6}
+
+
+def _parse_cron_field(field, minimum, maximum, names=None):
+    """
+    cron形式の1フィールドを値の集合に変換する（*, 数値, 範囲 a-b, 列挙 a,b, 間隔 */n に対応）
+
+    :param field: フィールドの文字列
+    :param minimum: 取り得る最小値
+    :param maximum: 取り得る最大値
+    :param names: 名前から値への対応表（曜日名など）
+    :return: (値の集合, ワイルドカードかどうか)のタプル
+    """
+    values = set()
+    for part in field.split(','):
+        step = 1
+        if '/' in part:
+            part, step_text = part.split('/', 1)
+            step = int(step_text)
+        if part == '*':
+            start, end = minimum, maximum
+        elif '-' in part:
+            start_text, end_text = part.split('-', 1)
+            start, end = _parse_cron_value(start_text, names), _parse_cron_value(end_text, names)
+        else:
+            start = end = _parse_cron_value(part, names)
+        if start < minimum or end > maximum or start > end:
+            raise ValueError(f"cronフィールドの値が範囲外です: {field}")
+        values.update(range(start, end + 1, step))
+    return values, field == '*'
+
+
+def _parse_cron_value(text, names):
+    """cronフィールドの1つの値を数値に変換する"""
+    if names and text.lower() in names:
+        return names[text.lower()]
+    return int(text)
+
+
+class Trigger:
+    def __init__(self, minutes, hours, days=None, months=None, weekdays=None, accounts=None, source=''):
+        """
+        事前に解析済みの実行トリガー
+
+        :param minutes: 実行する分の集合
+        :param hours: 実行する時の集合
+        :param days: 実行する日の集合（Noneの場合は毎日）
+        :param months: 実行する月の集合（Noneの場合は毎月）
+        :param weekdays: 実行する曜日の集合（0=日曜。Noneの場合は毎日）
+        :param accounts: 対象アカウントのユーザー名の集合（Noneの場合は全アカウント）
+        :param source: ログ用の元の設定文字列
+        """
+        self.minutes = sorted(minutes)
+        self.hours = sorted(hours)
+        self.days = days
+        self.months = months
+        self.weekdays = weekdays
+        self.accounts = frozenset(accounts) if accounts else None
+        self.source = source
+
+    @classmethod
+    def parse(cls, entry):
+        """
+        schedule.json の1エントリを解析する
+
+        対応する形式:
+            {"time": "HH:MM"}
+            {"cron": "分 時 日 月 曜日"}
+            いずれにも "accounts": ["ユーザー名", ...] を付けると、そのアカウントだけの予定になる
+
+        :param entry: スケジュールのエントリ（辞書）
+        :return: Triggerインスタンス
+        """
+        accounts = entry.get('accounts')
+        if 'cron' in entry:
+            fields = entry['cron'].split()
+            if len(fields) != 5:
+                raise ValueError(f"cron形式は5つのフィールドが必要です: {entry['cron']}")
+            minutes, _ = _parse_cron_field(fields[0], 0, 59)
+            hours, _ = _parse_cron_field(fields[1], 0, 23)
+            days, any_day = _parse_cron_field(fields[2], 1, 31)
+            months, any_month = _parse_cron_field(fields[3], 1, 12)
+            weekdays, any_weekday = _parse_cron_field(fields[4], 0, 7, WEEKDAY_NAMES)
+            weekdays = {weekday % 7 for weekday in weekdays}
+            return cls(
+                minutes, hours,
+                days=None if any_day else days,
+                months=None if any_month else months,
+                weekdays=None if any_weekday else weekdays,
+                accounts=accounts, source=entry['cron'],
+            )
+        scheduled = datetime.strptime(entry['time'], "%H:%M")
+        return cls({scheduled.minute}, {scheduled.hour}, accounts=accounts, source=entry['time'])
+
+    def _matches_date(self, date):
+        """日付がトリガーの日・月・曜日の条件に一致するかどうか"""
+        if self.months is not None and date.month not in self.months:
+            return False
+        weekday = (date.weekday() + 1) % 7
+        if self.days is not None and self.weekdays is not None:
+            # cronと同様に、日と曜日の両方が指定されている場合はどちらかに一致すればよい
+            return date.day in self.days or weekday in self.weekdays
+        if self.days is not None:
+            return date.day in self.days
+        if self.weekdays is not None:
+            return weekday in self.weekdays
+        return True
+
+    def next_after(self, after):
+        """
+        指定時刻より後の最初の実行時刻を返す
+
+        :param after: 基準時刻（datetime）
+        :return: 次の実行時刻（datetime）。4年以内に該当が無い場合はNone
+        """
+        date = after.date()
+        for offset in range(366 * 4 + 1):
+            day = date + timedelta(days=offset)
+            if not self._matches_date(day):
+                continue
+            for hour in self.hours:
+                for minute in self.minutes:
+                    candidate = datetime(day.year, day.month, day.day, hour, minute)
+                    if candidate > after:
+                        return candidate
+        return None
+
 
 class Scheduler:
-    def __init__(self, schedule_file='config/schedule.json'):
+    def __init__(self, schedule_file='config/schedule.json', reload_check_interval=30, misfire_grace=60,
+                 misfire_policy='skip', stop_event=None):
         """
         スケジューラクラスの初期化
-        
+
+        各トリガーの次回実行時刻を最小ヒープで管理し、次の実行予定を O(log n) で取り出す。
+        待機は reload_check_interval 秒ごとに区切り、そのたびに壁時計の時刻を見直して
+        スケジュールファイルの変更を確認する。
+
         :param schedule_file: スケジュール設定ファイルのパス
+        :param reload_check_interval: 待機中にスケジュールファイルの変更を確認する間隔（秒）
+        :param misfire_grace: 実行予定時刻を過ぎてからこの秒数を超えた予定を「実行し損ねた予定」とみなす
+        :param misfire_policy: 実行し損ねた予定の扱い（skip / coalesce / queue）
+        :param stop_event: 待機に使うEvent（省略時は threading.Event。シミュレーションでは仮想時計のものを渡す）
         """
+        if misfire_policy not in MISFIRE_POLICIES:
+            raise ValueError(f"misfire_policy は {', '.join(MISFIRE_POLICIES)} のいずれかを指定してください: {misfire_policy}")
         self.schedule_file = schedule_file
-        self.schedules = self.load_schedules()
+        self.misfire_policy = misfire_policy
+        self.reload_check_interval = reload_check_interval
+        self.misfire_grace = misfire_grace
+        self._stop_event = stop_event or threading.Event()
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._heap = []
+        self.triggers = self.load_schedules() or []
+        self._rebuild_heap(datetime.now())
         logging.info(f"スケジューラを初期化しました。スケジュールファイル: {schedule_file}")
 
     def load_schedules(self):
         """
-        JSONファイルからスケジュールを読み込む
-        
-        :return: スケジュールのリスト
+        JSONファイルからスケジュールを読み込み、トリガーに変換する
+
+        読み込んだファイルの更新時刻は失敗した場合も記録し、同じ内容を繰り返し読み込まないようにする。
+
+        :return: Triggerのリスト。読み込みに失敗した場合はNone
         """
         try:
+            self._mtime = os.path.getmtime(self.schedule_file)
             with open(self.schedule_file, 'r') as f:
                 data = json.load(f)
-            logging.info(f"スケジュールを正常に読み込みました。{len(data['schedules'])}件のスケジュールが設定されています。")
-            return data['schedules']
+            triggers = [Trigger.parse(entry) for entry in data['schedules']]
+            logging.info(f"スケジュールを正常に読み込みました。{len(triggers)}件のスケジュールが設定されています。")
+            return triggers
         except Exception as e:
             logging.error(f"スケジュールの読み込みに失敗しました: {str(e)}")
-            return []
+            return None
+
+    def _rebuild_heap(self, now):
+        """すべてのトリガーの次回実行時刻からヒープを作り直す"""
+        heap = []
+        for index, trigger in enumerate(self.triggers):
+            next_time = trigger.next_after(now)
+            if next_time is not None:
+                heap.append((next_time, index, trigger))
+        heapq.heapify(heap)
+        self._heap = heap
+
+    def _reload_if_changed(self):
+        """スケジュールファイルが更新されていれば読み込み直す"""
+        try:
+            mtime = os.path.getmtime(self.schedule_file)
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+        logging.info("スケジュールファイルの変更を検知しました。再読み込みします。")
+        triggers = self.load_schedules()
+        if triggers is None:
+            # 編集途中の保存などで壊れたファイルを読んだ場合は、次に更新されるまで現在の予定を使い続ける
+            logging.warning(f"現在のスケジュール（{len(self.triggers)}件）を引き続き使用します。")
+            return
+        self.triggers = triggers
+        self._rebuild_heap(datetime.now())
+
+    def _skip_missed(self, now):
+        """猶予時間を過ぎても実行されなかった予定を次回へ送る（misfire_policy が skip の場合のみ）"""
+        if self.misfire_policy != 'skip':
+            return
+        while self._heap and (now - self._heap[0][0]).total_seconds() > self.misfire_grace:
+            missed_time, index, trigger = self._heap[0]
+            logging.warning(f"実行予定 {missed_time} ({trigger.source}) を過ぎたため、次回に送ります。")
+            metrics.increment('slot_missed')
+            self._advance_top(now)
+
+    def _advance_top(self, after):
+        """ヒープの先頭のトリガーを次回の実行時刻で置き換える"""
+        _, index, trigger = self._heap[0]
+        next_time = trigger.next_after(after)
+        if next_time is None:
+            heapq.heappop(self._heap)
+        else:
+            heapq.heapreplace(self._heap, (next_time, index, trigger))
 
     def get_next_run_time(self):
         """
         次の実行時間を取得する
         
-        :return: 次の実行時間（datetime）
-        """
-        now = datetime.now()
-        today = now.date()
-        tomorrow = today + timedelta(days=1)
-
-        # 今日の残りのスケジュールをチェック
-        for schedule in self.schedules:
-            schedule_time = datetime.strptime(schedule['time'], "%H:%M").time()
-            schedule_datetime = datetime.combine(today, schedule_time)
-            if schedule_datetime > now:
-                logging.info(f"次の実行時間: {schedule_datetime}")
-                return schedule_datetime
-
-        # 翌日の最初のスケジュールを返す
-        first_schedule = min(self.schedules, key=lambda x: datetime.strptime(x['time'], "%H:%M").time())
-        next_run_time = datetime.combine(tomorrow, datetime.strptime(first_schedule['time'], "%H:%M").time())
-        logging.info(f"次の実行時間: {next_run_time}")
-        return next_run_time
+        :return: 次の実行時間（datetime）。スケジュールが無い場合はNone
+        """
+        with self._lock:
+            self._reload_if_changed()
+            self._skip_missed(datetime.now())
+            if not self._heap:
+                return None
+            return self._heap[0][0]
+
+    def pop_due(self, run_time):
+        """
+        指定時刻に実行予定のトリガーをすべて取り出し、それぞれ次回の実行時刻を登録する
+
+        :param run_time: この時刻までに実行予定のトリガーを取り出す
+        :return: ScheduledRun（取り出した予定をまとめ、対象アカウントを合算したもの。time は最も早い予定時刻）
+        """
+        accounts = set()
+        all_accounts = False
+        planned_time = None
+        with self._lock:
+            while self._heap and self._heap[0][0] <= run_time:
+                scheduled_time, _, trigger = self._heap[0]
+                planned_time = scheduled_time if planned_time is None else min(planned_time, scheduled_time)
+                if trigger.accounts is None:
+                    all_accounts = True
+                else:
+                    accounts.update(trigger.accounts)
+                self._advance_top(run_time)
+            deadline = self._heap[0][0] if self._heap else None
+        return ScheduledRun(planned_time or run_time, None if all_accounts else accounts, deadline)
 
     def wait_until_next_run(self):
         """
         次の実行時間まで待機する
+
+        :return: 発火したScheduledRun。stop() で中断された場合はNone
         """
-        next_run = self.get_next_run_time()
-        wait_seconds = (next_run - datetime.now()).total_seconds()
-        logging.info(f"次の実行時間まで {wait_seconds:.2f} 秒待機します。")
-        time.sleep(wait_seconds)
\ No newline at end of file
+        announced = None
+        while not self._stop_event.is_set():
+            next_run = self.get_next_run_time()
+            if next_run is None:
+                logging.warning("実行予定がありません。スケジュールファイルの更新を待ちます。")
+                self._stop_event.wait(self.reload_check_interval)
+                continue
+
+            # 壁時計の変更に追従するため、区切りごとに残り時間を計算し直す
+            now = datetime.now()
+            wait_seconds = (next_run - now).total_seconds()
+            if wait_seconds <= 0:
+                if wait_seconds < -self.misfire_grace:
+                    logging.warning(f"実行予定 {next_run} を {-wait_seconds:.0f} 秒遅れで実行します（{self.misfire_policy}）。")
+                # coalesce の場合は、現在までに実行し損ねた予定をすべてまとめて取り出す
+                scheduled_run = self.pop_due(now if self.misfire_policy == 'coalesce' else next_run)
+                metrics.observe('schedule_lag', max(0.0, (now - scheduled_run.time).total_seconds()))
+                metrics.increment('slot_fired', policy=self.misfire_policy)
+                return scheduled_run
+            if next_run != announced:
+                logging.info(f"次の実行時間: {next_run}。{wait_seconds:.2f} 秒待機します。")
+                announced = next_run
+            self._stop_event.wait(min(wait_seconds, self.reload_check_interval))
+        return None
+
+    def stop(self):
+        """待機を中断する"""
+        self._stop_event.set()
@@ -0,0 +1,34 @@
+# services.py
+
+from cookie_manager import CookieManager
+from profile_manager import ProfileManager
+from image_processor import ImageProcessor
+from waits import Waiter
+from utils import RetryPolicy
+from publishers import create_publisher
+
+
+class Services:
+    def __init__(self, config):
+        """
+        Servicesクラスのコンストラクタ
+
+        アカウントやサイクルをまたいで共有するサービスをまとめて生成する。
+        いずれも呼び出しごとの状態を持たないため、複数のアカウントのスレッドから同時に使用できる。
+        設定が変わった場合は新しいインスタンスを作り直して差し替える（既存のインスタンスは変更しない）。
+        publisher はkeep-alive接続を保持するため、差し替えた後は古いインスタンスの close を呼び出す。
+
+        :param config: 設定情報
+        """
+        self.config = config
+        self.cookie_manager = CookieManager()
+        self.profile_manager = ProfileManager.from_config(config)
+        self.image_processor = ImageProcessor(config)
+        self.waiter = Waiter(config)
+        self.retry_policy = RetryPolicy.from_config(config)
+        self.publisher = create_publisher(config)
+
+    def close(self):
+        """保持している接続などを解放する"""
+        if self.publisher:
+            self.publisher.close()
@@ -0,0 +1,375 @@
+# simulation.py
+#
+# 実際のChromeと壁時計を使わずに、スケジューラから投稿までの処理全体を実行するためのシミュレーション部品。
+# 仮想時計（VirtualClock）が time.sleep などを置き換え、FakeDriver が ThreadsAutomator の使うWebDriverの操作を再現する。
+
+import io
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime
+from PIL import Image
+from selenium.common.exceptions import NoSuchElementException
+from selenium.webdriver.common.keys import Keys
+from locators import registry
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 置き換え前の関数（シミュレーション自体の実時間の計測に使う）
+real_time = time.time
+real_monotonic = time.monotonic
+real_perf_counter = time.perf_counter
+real_sleep = time.sleep
+
+_active_clock = None
+
+
+class VirtualDateTime(datetime):
+    """now() が仮想時計の時刻を返す datetime"""
+
+    @classmethod
+    def now(cls, tz=None):
+        return datetime.fromtimestamp(_active_clock.time(), tz)
+
+
+class VirtualClock:
+    def __init__(self, start=None):
+        """
+        VirtualClockクラスのコンストラクタ
+
+        install() すると time.time / time.monotonic / time.perf_counter / time.sleep と、
+        src 内のモジュールの datetime.now() をこの時計に置き換える。sleep は待たずに時刻を進める。
+        複数のスレッドから sleep された場合は、それぞれの待機時間の合計だけ時刻が進む。
+
+        :param start: 開始時刻（datetime、省略時は現在時刻）
+        """
+        self._now = (start or datetime.now()).timestamp()
+        self._elapsed = 0.0
+        self._lock = threading.Lock()
+        self._patched = []
+
+    def time(self):
+        return self._now
+
+    def monotonic(self):
+        return self._elapsed
+
+    def sleep(self, seconds):
+        self.advance(seconds)
+
+    def advance(self, seconds):
+        """時刻を seconds 秒進める"""
+        if seconds <= 0:
+            return
+        with self._lock:
+            self._now += seconds
+            self._elapsed += seconds
+
+    def now(self):
+        """現在の仮想時刻を datetime で返す"""
+        return datetime.fromtimestamp(self._now)
+
+    def install(self):
+        """time モジュールの関数と src 内のモジュールの datetime を置き換える"""
+        global _active_clock
+        _active_clock = self
+        for name, replacement in (('time', self.time), ('monotonic', self.monotonic),
+                                  ('perf_counter', self.monotonic), ('sleep', self.sleep)):
+            self._patched.append((time, name, getattr(time, name)))
+            setattr(time, name, replacement)
+        for module in list(sys.modules.values()):
+            module_file = getattr(module, '__file__', None) or ''
+            if os.path.dirname(os.path.abspath(module_file)) == SRC_DIR and getattr(module, 'datetime', None) is datetime:
+                self._patched.append((module, 'datetime', datetime))
+                module.datetime = VirtualDateTime
+        return self
+
+    def uninstall(self):
+        """置き換えた関数を元に戻す"""
+        global _active_clock
+        for target, name, original in reversed(self._patched):
+            setattr(target, name, original)
+        self._patched = []
+        _active_clock = None
+
+
+class VirtualEvent:
+    def __init__(self, clock):
+        """
+        wait() が仮想時計を進めるだけの threading.Event の代わり（Schedulerの待機用）
+
+        :param clock: VirtualClockインスタンス
+        """
+        self.clock = clock
+        self._flag = False
+
+    def is_set(self):
+        return self._flag
+
+    def set(self):
+        self._flag = True
+
+    def clear(self):
+        self._flag = False
+
+    def wait(self, timeout=None):
+        if not self._flag and timeout:
+            self.clock.advance(timeout)
+        return self._flag
+
+
+def _blank_png():
+    """スクリーンショットの代わりに返す小さなPNG"""
+    buffer = io.BytesIO()
+    Image.new('RGB', (8, 8), 'white').save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+class FakeElement:
+    def __init__(self, driver, name, index=0):
+        """
+        FakeDriverが返す要素
+
+        :param driver: FakeDriverインスタンス
+        :param name: 対応するロケーター名
+        :param index: 同じロケーターに一致する要素の中での番号
+        """
+        self.driver = driver
+        self.name = name
+        self.index = index
+
+    @property
+    def text(self):
+        return self.driver.values.get(self.name, '')
+
+    def get_attribute(self, name):
+        return self.driver.values.get(self.name, '') if name == 'value' else None
+
+    def is_displayed(self):
+        return True
+
+    def clear(self):
+        self.driver.values[self.name] = ''
+
+    def send_keys(self, *values):
+        if Keys.DELETE in values:
+            # Ctrl+A の後の Delete による全消去
+            self.clear()
+            return
+        # Keys.TAB などの特殊キーは入力値に含めない
+        text = ''.join(value for value in values if not (len(value) == 1 and '\ue000' <= value <= '\uf8ff'))
+        self.driver.send_keys(self, text)
+
+    def click(self):
+        self.driver.click(self)
+
+
+class FakeDriver:
+    # 画面の状態ごとに表示されている要素（ロケーター名から要素数）
+    SCREENS = {
+        'blank': {},
+        'guest': {'login_link': 1},
+        'login_form': {'username_input': 1, 'password_input': 1, 'login_button': 1},
+        'home': {'logged_in': 1, 'post_button': 1},
+        'composer': {'logged_in': 1, 'post_button': 1, 'file_input': 1, 'caption_input': 1, 'final_post_button': 2},
+        'posted': {'logged_in': 1, 'post_button': 1, 'final_post_button': 1, 'post_success': 1},
+    }
+
+    def __init__(self, clock, latency=0.3, page_latency=0.8, failure_rate=0.0, rng=None):
+        """
+        FakeDriverクラスのコンストラクタ
+
+        ThreadsAutomator が使うWebDriverの操作（get・refresh・DomProbeの待機・execute_script・
+        send_keys・クッキー・スクリーンショットなど）を、Threadsの画面遷移を模した状態機械で再現する。
+        操作への応答は仮想時計で latency 秒後に反映し、failure_rate の確率で応答しない（UIの不調を模す）。
+        要素の判定には各ロケーターの第一候補の探索戦略だけを使う。
+
+        :param clock: VirtualClockインスタンス
+        :param latency: 操作に対する画面の応答時間（秒）
+        :param page_latency: ページの読み込み時間（秒）
+        :param failure_rate: 操作に画面が応答しない確率（0〜1）
+        :param rng: 乱数生成器（再現性が必要な場合に指定する）
+        """
+        self.clock = clock
+        self.latency = latency
+        self.page_latency = page_latency
+        self.failure_rate = failure_rate
+        self.rng = rng or random.Random()
+        self.screen = 'blank'
+        self.values = {}
+        self.thumbnails = 0
+        self.cookies = {}
+        self.current_url = 'about:blank'
+        self._pending = []
+        self._primary = {registry.primary(name)[1]: name for name in registry.names()}
+
+    # --- 画面の状態 ---
+
+    def _schedule(self, action):
+        """操作への応答を latency 秒後に反映するよう登録する（failure_rate の確率で応答しない）"""
+        if self.rng.random() < self.failure_rate:
+            return
+        self._pending.append((self.clock.monotonic() + self.latency, action))
+
+    def _settle(self):
+        """期限の来た応答を反映する"""
+        now = self.clock.monotonic()
+        due = [item for item in self._pending if item[0] <= now]
+        if due:
+            self._pending = [item for item in self._pending if item[0] > now]
+            for _, action in sorted(due, key=lambda item: item[0]):
+                action()
+
+    def _render(self, screen):
+        self.screen = screen
+        if screen != 'composer':
+            self.thumbnails = 0
+
+    def _render_page(self):
+        self._render('home' if 'sessionid' in self.cookies else 'guest')
+
+    def _count(self, name):
+        if name == 'upload_thumbnail':
+            return self.thumbnails if self.screen == 'composer' else 0
+        return self.SCREENS[self.screen].get(name, 0)
+
+    # --- ナビゲーション ---
+
+    def get(self, url):
+        self.clock.advance(self.page_latency)
+        self.current_url = url
+        self._pending = []
+        self._render('blank')
+        self._schedule(self._render_page)
+
+    def refresh(self):
+        self.get(self.current_url)
+
+    # --- 要素の検索と待機 ---
+
+    def find_elements(self, by=None, value=None):
+        self._settle()
+        name = self._primary.get(value)
+        return [FakeElement(self, name, i) for i in range(self._count(name))] if name else []
+
+    def find_element(self, by=None, value=None):
+        elements = self.find_elements(by, value)
+        if not elements:
+            raise NoSuchElementException(f"{value} が見つかりません")
+        return elements[0]
+
+    def _evaluate(self, specs, mode):
+        """DomProbeの待機スクリプトと同じ形式の結果を返す"""
+        self._settle()
+        results = {}
+        first = None
+        hits = 0
+        for spec in specs:
+            name = self._primary.get(spec['value'])
+            count = self._count(name) if name else 0
+            matched = count >= spec['min_count']
+            results[spec['name']] = {
+                'count': count,
+                'matched': matched,
+                'elements': [FakeElement(self, name, i) for i in range(count)] if matched else [],
+            }
+            if matched:
+                hits += 1
+                first = first or spec['name']
+        satisfied = hits == len(specs) if mode == 'all' else hits > 0
+        return {'satisfied': satisfied, 'first': first, 'results': results}
+
+    def execute_async_script(self, script, *args):
+        specs, mode, timeout_ms = args[0], args[1], args[2]
+        deadline = self.clock.monotonic() + timeout_ms / 1000
+        while True:
+            result = self._evaluate(specs, mode)
+            if result['satisfied']:
+                return result
+            # 次の画面の変化まで（無ければタイムアウトまで）時計を進める
+            upcoming = [due for due, _ in self._pending if due <= deadline]
+            target = min(upcoming) if upcoming else deadline
+            self.clock.advance(target - self.clock.monotonic())
+            if not upcoming:
+                return self._evaluate(specs, mode)
+
+    def execute_script(self, script, *args):
+        self._settle()
+        if 'document.readyState' in script:
+            return 'complete'
+        if 'click()' in script and args:
+            args[0].click()
+            return None
+        if script.strip() == 'return 1;':
+            return 1
+        return None
+
+    # --- 操作 ---
+
+    def click(self, element):
+        self._settle()
+        if element.name == 'login_link' and self.screen == 'guest':
+            self._schedule(lambda: self._render('login_form'))
+        elif element.name == 'login_button' and self.screen == 'login_form':
+            username = self.values.get('username_input', '')
+
+            def logged_in():
+                self.cookies['sessionid'] = {'name': 'sessionid', 'value': f"sim-{username}"}
+                self._render('home')
+            self._schedule(logged_in)
+        elif element.name == 'post_button' and self.screen in ('home', 'posted'):
+            self.values.pop('caption_input', None)
+            self._schedule(lambda: self._render('composer'))
+        elif element.name == 'final_post_button' and element.index == 1 and self.screen == 'composer':
+            self._schedule(lambda: self._render('posted'))
+
+    def send_keys(self, element, text):
+        self._settle()
+        if element.name == 'file_input':
+            count = len(text.split('\n'))
+
+            def uploaded():
+                self.thumbnails = count
+            self._schedule(uploaded)
+        else:
+            self.values[element.name] = self.values.get(element.name, '') + text
+
+    # --- その他のWebDriverの機能 ---
+
+    def get_cookies(self):
+        return list(self.cookies.values())
+
+    def add_cookie(self, cookie):
+        self.cookies[cookie['name']] = cookie
+
+    def delete_all_cookies(self):
+        self.cookies = {}
+
+    @property
+    def page_source(self):
+        return f"<html><body data-screen=\"{self.screen}\"></body></html>"
+
+    def get_screenshot_as_png(self):
+        return _blank_png()
+
+    def save_screenshot(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.get_screenshot_as_png())
+        return True
+
+    def get_log(self, log_type):
+        return []
+
+    def set_script_timeout(self, seconds):
+        pass
+
+    def set_page_load_timeout(self, seconds):
+        pass
+
+    def execute_cdp_cmd(self, command, params):
+        return {}
+
+    def quit(self):
+        self._pending = []
@@ -1,206 +1,489 @@
 import logging
+import threading
 import time
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.keys import Keys
-from utils import retry
-from cookie_manager import CookieManager
-from image_processor import ImageProcessor
-import random
-import time
+from selenium.common.exceptions import TimeoutException
+from utils import RetryableError, RetryBudget, UnconfirmedPostError, retry, set_log_context
+from services import Services
+from waits import document_ready
+from dom_probe import DomProbe
+from locators import LocatorSession, registry
+from metrics import metrics
+from artifacts import artifacts
+from driver_pool import browser_rss_mb
+
+THREADS_URL = "https://www.threads.net/?hl=ja"
+
+# 軽量モードで追加するChromeの起動オプション（音声・自動再生・バックグラウンド通信を止める）
+LEAN_CHROME_ARGUMENTS = (
+    "--mute-audio",
+    "--autoplay-policy=user-gesture-required",
+    "--force-prefers-reduced-motion",
+    "--disable-background-networking",
+    "--disable-component-update",
+    "--disable-default-apps",
+    "--disable-sync",
+    "--disable-features=Translate,MediaRouter,OptimizationHints",
+)
+
+# 軽量モードで各ページに挿入する、アニメーションとスムーズスクロールを無効にするスクリプト
+DISABLE_ANIMATIONS_SCRIPT = """
+(() => {
+  const css = '*, *::before, *::after { animation: none !important; transition: none !important; scroll-behavior: auto !important; }';
+  const inject = () => {
+    const style = document.createElement('style');
+    style.textContent = css;
+    (document.head || document.documentElement).appendChild(style);
+  };
+  if (document.readyState === 'loading') {
+    document.addEventListener('DOMContentLoaded', inject);
+  } else {
+    inject();
+  }
+})();
+"""
+
+
+def create_driver(config, profile_dir=None):
+    """
+    設定に従ってChromeドライバーを起動する
+    :param config: 設定情報
+    :param profile_dir: 使用するChromeプロファイル（user-data-dir）のパス。Noneの場合は一時プロファイル
+    :return: Seleniumのwebdriverインスタンス
+    """
+    lean = config.get('Browser', 'mode', fallback='normal') == 'lean'
+    chrome_options = Options()
+    if config.getboolean('Settings', 'headless'):
+        chrome_options.add_argument("--headless")
+    if profile_dir:
+        chrome_options.add_argument(f"--user-data-dir={profile_dir}")
+    if lean:
+        # DOMContentLoadedで制御を戻し、フィードの画像やフォントの読み込み完了を待たない
+        chrome_options.page_load_strategy = 'eager'
+        chrome_options.add_argument(f"--window-size={config.get('Browser', 'window_size', fallback='1024,768')}")
+        for argument in LEAN_CHROME_ARGUMENTS:
+            chrome_options.add_argument(argument)
+    else:
+        chrome_options.add_argument("--start-maximized")
+    chrome_options.add_argument("--disable-extensions")
+    chrome_options.add_argument("--disable-gpu")
+    chrome_options.add_argument("--no-sandbox")
+    chrome_options.add_argument("--disable-dev-shm-usage")
+    # 失敗時の記録に含めるため、コンソールログを取得できるようにする
+    chrome_options.set_capability('goog:loggingPrefs', {'browser': 'ALL'})
+    driver = webdriver.Chrome(options=chrome_options)
+    driver.set_page_load_timeout(30)
+    if lean:
+        apply_lean_session(driver, config)
+    return driver
+
+
+def apply_lean_session(driver, config):
+    """
+    軽量モードの設定をブラウザのセッションに適用する
+
+    自動化に不要なフィードのメディアと外部のトラッキング等へのリクエストを遮断し、
+    以降に開くすべてのページでアニメーションを無効にする。
+
+    :param driver: Seleniumのwebdriverインスタンス
+    :param config: 設定情報
+    """
+    block_urls = [url.strip() for url in config.get('Browser', 'block_urls', fallback='').split(',') if url.strip()]
+    try:
+        if block_urls:
+            driver.execute_cdp_cmd('Network.enable', {})
+            driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': block_urls})
+        driver.execute_cdp_cmd('Page.addScriptToEvaluateOnNewDocument', {'source': DISABLE_ANIMATIONS_SCRIPT})
+    except Exception as e:
+        # 軽量化は必須ではないため、適用できなくても処理を続ける
+        logging.warning(f"軽量モードの設定を適用できませんでした: {str(e)}")
+    else:
+        logging.info(f"軽量モードを適用しました。遮断するURLパターン: {len(block_urls)}件")
 
 
 class ThreadsAutomator:
-    def __init__(self, config, account, post_manager):
+    def __init__(self, config, account, post_manager, driver_pool=None, prefetcher=None, services=None):
         """
         ThreadsAutomatorクラスのコンストラクタ
         :param config: 設定情報
         :param account: アカウント情報
         :param post_manager: PostManagerインスタンス
+        :param driver_pool: DriverPoolインスタンス（指定時は起動済みのChromeを再利用する）
+        :param prefetcher: PostPrefetcherインスタンス（指定時は先読み済みの投稿を使用する）
+        :param services: 共有のServicesインスタンス（Noneの場合はこのインスタンス用に生成する）
         """
         self.config = config
         self.account = account
         self.driver = None
-        self.cookie_manager = CookieManager()
-        self.image_processor = ImageProcessor(config)
+        self.driver_pool = driver_pool
+        self.base_url = config.get('Settings', 'base_url', fallback=THREADS_URL)
+        self.browser_mode = config.get('Browser', 'mode', fallback='normal')
+        self.succeeded = False
+        self.error = None
+        self.rss_mb = None
+        # 処理を開始した時刻（time.monotonic）。開始前はNone（タイムアウトの判定に使う。呼び出し元が先に設定する場合がある）
+        self.started_at = None
+        # 投稿セットを使用済みにしたかどうか（送信済みの投稿セットは失敗しても未使用に戻さない）
+        self.post_consumed = False
+        services = services or Services(config)
+        self.cookie_manager = services.cookie_manager
+        self.profile_manager = services.profile_manager
+        self.image_processor = services.image_processor
         self.post_manager = post_manager
+        self.prefetcher = prefetcher
+        self.prepared_post = None
+        self.waiter = services.waiter
+        self.retry_policy = services.retry_policy
+        self.publisher = services.publisher
+        self.retry_budget = RetryBudget.from_config(config)
+        # 完了したステップ名からその戻り値への辞書（再試行時に完了済みのステップを飛ばす）
+        self.checkpoints = {}
+        self.probe = None
+        self.locators = None
+        self._cleanup_lock = threading.Lock()
 
 
+    def span(self, phase):
+        """
+        このアカウントの処理フェーズの所要時間を計測する
+        :param phase: フェーズ名
+        :return: metrics.span のコンテキストマネージャ
+        """
+        return metrics.span(phase, account=self.account['username'])
+
     def setup_driver(self):
         """Seleniumドライバーのセットアップ"""
-        chrome_options = Options()
-        if self.config.getboolean('Settings', 'headless'):
-            chrome_options.add_argument("--headless")
-        chrome_options.add_argument("--start-maximized")
-        chrome_options.add_argument("--disable-extensions")
-        chrome_options.add_argument("--disable-gpu")
-        chrome_options.add_argument("--no-sandbox")
-        chrome_options.add_argument("--disable-dev-shm-usage")
-        self.driver = webdriver.Chrome(options=chrome_options)
-        self.driver.set_page_load_timeout(30)
+        with self.span('setup_driver'):
+            if self.driver_pool:
+                self.driver = self.driver_pool.acquire(self.account['username'])
+            else:
+                self.driver = create_driver(self.config, self.get_profile_dir())
+        self.probe = DomProbe(self.driver, self.waiter.timeout)
+        self.locators = LocatorSession(self.probe, registry)
         logging.info("Chromeドライバーのセットアップが完了しました。")
 
-    @retry(max_attempts=3)
+    def get_profile_dir(self):
+        """
+        プロファイルモードの場合、アカウント用のChromeプロファイルのパスを返す
+        :return: プロファイルディレクトリのパス（クッキーモードの場合はNone）
+        """
+        if self.profile_manager is None:
+            return None
+        return self.profile_manager.get_profile_dir(self.account['username'])
+
     def click_login_link(self):
         """ログインリンクをクリック"""
-        login_link_xpath = "//div[contains(@class, 'x6s0dn4') and contains(@class, 'x78zum5')]//a[@role='link']//div[contains(text(), 'ログイン')]"
-        login_link = WebDriverWait(self.driver, 20).until(
-            EC.presence_of_element_located((By.XPATH, login_link_xpath))
-        )
-        self.driver.execute_script("arguments[0].scrollIntoView({behavior: 'smooth', block: 'center'});", login_link)
-        time.sleep(2)
-        self.driver.execute_script("arguments[0].click();", login_link)
+        login_link = self.locators.find('login_link')[0]
+        self.driver.execute_script("arguments[0].scrollIntoView({block: 'center'}); arguments[0].click();", login_link)
+        # クリックの成否はログインフォームの表示で判定する
+        self.locators.find('username_input')
         logging.info("ログインリンクのクリックに成功しました。")
 
-    @retry(max_attempts=3)
+    def open_base_url(self):
+        """トップページを開き、読み込みを待つ"""
+        self.driver.get(self.base_url)
+        self.waiter.until(self.driver, document_ready(), "ページの読み込み")
+
     def login(self):
-        """ログイン処理"""
+        """
+        ログイン処理
+
+        ページの読み込みと通常ログインはそれぞれのステップ単位で再試行する。
+        """
+        self.load_page()
+        if self.restore_session():
+            return
+        self.form_login()
+
+    @retry(step='page_load')
+    def load_page(self):
+        """トップページの読み込み"""
+        with metrics.span('page_load', account=self.account['username'], mode=self.browser_mode):
+            self.open_base_url()
+
+    def restore_session(self):
+        """
+        保存済みのプロファイルまたはクッキーでログイン状態を復元する
+        :return: ログイン状態を復元できた場合はTrue
+        """
         username = self.account['username']
-        password = self.account['password']
-        
+
+        # プロファイルモードではセッションがプロファイルに残っているため、そのまま確認する
+        if self.profile_manager and self.profile_manager.has_profile(username) and self.is_logged_in():
+            logging.info(f"保存済みプロファイルを使用して {username} でログインしました。")
+            return True
+
         # クッキーを使用してログインを試みる
-        self.driver.get("https://www.threads.net/?hl=ja")
-        if self.cookie_manager.load_cookies(self.driver, username):
-            self.driver.refresh()
-            if self.is_logged_in():
-                logging.info(f"クッキーを使用して {username} でログインしました。")
-                return
-        
-        # クッキーでのログインに失敗した場合、通常のログインを実行
+        with self.span('cookie_load'):
+            cookies_loaded = self.cookie_manager.load_cookies(self.driver, username)
+            if cookies_loaded:
+                self.driver.refresh()
+        if cookies_loaded and self.is_logged_in():
+            logging.info(f"クッキーを使用して {username} でログインしました。")
+            return True
+        return False
+
+    @retry(step='form_login', before_retry=open_base_url)
+    def form_login(self):
+        """ユーザー名とパスワードによる通常ログイン（再試行時はトップページから入力し直す）"""
+        username = self.account['username']
+        password = self.account['password']
+
         logging.info(f"{username} の通常ログインを開始します。")
         self.click_login_link()
         
-        username_xpath = "//input[@name='username' or @name='email' or contains(@placeholder, 'ユーザーネーム') or contains(@placeholder, 'メールアドレス')]"
-        username_input = WebDriverWait(self.driver, 10).until(
-            EC.presence_of_element_located((By.XPATH, username_xpath))
-        )
+        username_input = self.locators.find('username_input')[0]
         username_input.clear()
         username_input.send_keys(username)
         username_input.send_keys(Keys.TAB)
+        self.waiter.until(
+            self.driver, lambda driver: username in (username_input.get_attribute('value') or ''), "ユーザー名の入力"
+        )
         logging.info(f"ユーザー名/メールアドレス {username} を入力しました。")
 
-        time.sleep(10)
+        self.waiter.pace()
 
-        password_xpath = "//input[@name='password' or contains(@placeholder, 'パスワード')]"
-        password_input = WebDriverWait(self.driver, 10).until(
-            EC.presence_of_element_located((By.XPATH, password_xpath))
-        )
+        password_input = self.locators.find('password_input')[0]
         password_input.clear()
         password_input.send_keys(password)
         logging.info("パスワードを入力しました。")
 
-        time.sleep(20)
+        self.waiter.pace()
 
-        login_button_xpath = "//div[@role='button']//div[contains(@class, 'x6s0dn4') and contains(@class, 'x78zum5')]//div[contains(text(), 'ログイン')]"
-        login_button = WebDriverWait(self.driver, 10).until(
-            EC.presence_of_element_located((By.XPATH, login_button_xpath))
-        )
+        login_button = self.locators.find('login_button', visible=True)[0]
         self.driver.execute_script("arguments[0].click();", login_button)
         
         if self.is_logged_in():
             logging.info(f"アカウント {username} でログインに成功しました。")
             self.cookie_manager.save_cookies(self.driver, username)
         else:
-            raise Exception(f"アカウント {username} でのログインに失敗しました。")
+            raise RetryableError(f"アカウント {username} でのログインに失敗しました。")
     
     def is_logged_in(self):
-        """ログイン状態を確認する"""
-        try:
-            WebDriverWait(self.driver, 20).until(
-                EC.presence_of_element_located((By.XPATH, "//div[contains(text(), 'Post') or contains(text(), '投稿')]"))
-            )
-            return True
-        except:
-            return False
-
-    def random_wait(min_seconds=10, max_seconds=30):
         """
-        指定された範囲内でランダムな秒数待機する
-        
-        :param min_seconds: 最小待機秒数
-        :param max_seconds: 最大待機秒数
+        ログイン状態を確認する
+
+        ログイン後の要素とログインリンクを同時に待ち、ログインリンクが先に現れた場合は
+        タイムアウトを待たずに未ログインと判定する。
         """
-        wait_time = random.uniform(min_seconds, max_seconds)
-        logging.info(f"{wait_time:.2f}秒待機します。")
-        time.sleep(wait_time)
+        with self.span('is_logged_in'):
+            try:
+                state, _ = self.locators.wait(['logged_in', 'login_link'])
+            except TimeoutException:
+                return False
+            return state == 'logged_in'
     
-    @retry(max_attempts=3)
+    def prepare_post(self):
+        """
+        投稿する内容を準備する。ブラウザを起動する前に呼び出し、画像処理をセッション外で済ませる。
+        先読み済みの投稿があればそれを使用し、無ければその場で選択・処理する。
+        """
+        username = self.account['username']
+        with self.span('prefetch_take'):
+            prepared = self.prefetcher.take(username) if self.prefetcher else None
+        if prepared is None:
+            # 選択した投稿セットは PostManager が予約するため、先読み中の他のアカウントの投稿セットとは重複しない
+            caption, image_paths, post_set = self.post_manager.get_random_post()
+            try:
+                with self.span('process_images'):
+                    processed_image_paths = self.image_processor.process_images(image_paths, username)
+            except Exception:
+                self.post_manager.release(post_set)
+                raise
+            prepared = (caption, processed_image_paths, post_set)
+        else:
+            logging.info(f"先読み済みの投稿セット '{prepared[2]}' を使用します。")
+        self.prepared_post = prepared
+        set_log_context(post_set=prepared[2])
+
     def post_thread(self):
-        """スレッドの投稿"""
-        caption, image_paths, post_set = self.post_manager.get_random_post()
+        """
+        スレッドの投稿
 
-        # 画像を処理
-        processed_image_paths = self.image_processor.process_images(image_paths, self.account['username'])
-        
-        post_button_xpath = "//div[contains(@class, 'x1i10hfl') and contains(@class, 'x1ypdohk') and contains(@class, 'xdl72j9')]//div[contains(text(), 'Post') or contains(text(), '投稿')]"
-        post_button = WebDriverWait(self.driver, 20).until(
-            EC.element_to_be_clickable((By.XPATH, post_button_xpath))
-        )
+        各ステップは個別に再試行し、完了したステップはチェックポイントにより再実行しない。
+        投稿する内容（投稿セットと処理済みの画像）は prepare_post で確定済みのものを使い続ける。
+        """
+        caption, processed_image_paths, post_set = self.prepared_post
+
+        self.open_composer()
+        self.waiter.pace()
+        self.upload_media(processed_image_paths, post_set)
+        self.waiter.pace()
+        self.enter_caption(caption, post_set)
+        self.waiter.pace()
+        self.submit_post(post_set)
+        self.confirm_post(post_set)
+
+        logging.info(f"アカウント {self.account['username']} で投稿セット '{post_set}' の投稿に成功しました。")
+        self.post_manager.remove_post_set(post_set, self.account['username'])
+
+    @retry(step='open_composer')
+    def open_composer(self):
+        """投稿ボタンをクリックして投稿画面を開く"""
+        post_button = self.locators.find('post_button', visible=True)[0]
         self.driver.execute_script("arguments[0].click();", post_button)
         logging.info("投稿ボタンをクリックしました。")
 
-        self.random_wait()
-
-        file_input = WebDriverWait(self.driver, 20).until(
-            EC.presence_of_element_located((By.XPATH, "//input[@type='file']"))
-        )
-        file_input.send_keys('\n'.join(processed_image_paths))
+    @retry(step='upload')
+    def upload_media(self, processed_image_paths, post_set):
+        """処理済みの画像をアップロードする"""
+        with self.span('upload'):
+            file_input = self.locators.find('file_input')[0]
+            file_input.send_keys('\n'.join(processed_image_paths))
+            try:
+                self.locators.find('upload_thumbnail', visible=True, min_count=len(processed_image_paths))
+            except TimeoutException as e:
+                # サムネイルの表示はUIの変更で確認できなくなることがあるため、確認できなくても続行する
+                logging.warning(f"{e.msg} 処理を続行します。")
         logging.info(f"投稿セット '{post_set}' の画像をアップロードしました。")
 
-        self.random_wait()
-
-        caption_input = WebDriverWait(self.driver, 20).until(
-            EC.presence_of_element_located((By.XPATH, "//div[@role='textbox']"))
-        )
-        caption_input.send_keys(caption)
+    @retry(step='caption')
+    def enter_caption(self, caption, post_set):
+        """キャプションを入力する（再試行時に途中まで入力された文字が残らないよう、先に消去する）"""
+        with self.span('caption'):
+            caption_input = self.locators.find('caption_input')[0]
+            if caption_input.text:
+                caption_input.send_keys(Keys.CONTROL, 'a')
+                caption_input.send_keys(Keys.DELETE)
+            caption_input.send_keys(caption)
         logging.info(f"投稿セット '{post_set}' のキャプションを入力しました。")
 
-        self.random_wait()
+    def submit_post(self, post_set):
+        """
+        最終Postボタンをクリックする
 
-        final_post_button_xpath = "//div[@role='button']//div[contains(text(), 'Post') or contains(text(), '投稿')]"
-        all_post_buttons = WebDriverWait(self.driver, 20).until(
-            EC.presence_of_all_elements_located((By.XPATH, final_post_button_xpath))
+        再試行するのはボタンの探索のみとする。クリックを送った後のエラーは投稿されたかどうかが分からないため、
+        二重投稿を避けて再クリックせず、投稿セットを未確認（unconfirmed）として使用済みにする。
+        """
+        with self.span('submit'):
+            final_post_button = self.find_submit_button()
+            try:
+                self.driver.execute_script("arguments[0].click();", final_post_button)
+            except Exception as e:
+                self._mark_unconfirmed(post_set)
+                raise UnconfirmedPostError(f"投稿セット '{post_set}' の送信中にエラーが発生しました: {str(e)}") from e
+
+    @retry(step='locate_submit')
+    def find_submit_button(self):
+        """最終Postボタンを探す"""
+        try:
+            all_post_buttons = self.locators.find('final_post_button', visible=True, min_count=2)
+        except TimeoutException:
+            raise RetryableError("必要な数のPostボタンが見つかりません。")
+        return all_post_buttons[1]
+
+    def confirm_post(self, post_set):
+        """
+        投稿完了メッセージの表示をもって成功とみなす
+
+        送信後に確認できなかった場合は、重複投稿を避けるため再送信せずに失敗とする。
+        実際には投稿されている可能性があるため、投稿セットは未確認（unconfirmed）として使用済みにし、次回以降も選択しない。
+        """
+        with self.span('confirm'):
+            try:
+                self.locators.find('post_success', timeout=self.waiter.post_confirm_timeout)
+            except TimeoutException:
+                self._mark_unconfirmed(post_set)
+                raise UnconfirmedPostError(f"投稿セット '{post_set}' の投稿完了を確認できませんでした。")
+
+    def _mark_unconfirmed(self, post_set):
+        """送信済みで結果が不明な投稿セットを未確認（unconfirmed）として使用済みにする"""
+        self.post_manager.remove_post_set(post_set, self.account['username'], outcome='unconfirmed')
+        self.post_consumed = True
+        logging.warning(f"投稿セット '{post_set}' は送信済みのため、投稿完了を確認できなくても再使用しません。")
+
+    def post_via_api(self):
+        """
+        ブラウザを使わず、APIでスレッドを投稿する
+
+        メディアコンテナの作成は再試行しても重複投稿にならないため再試行し、作成済みのコンテナは公開の再試行で使い回す。
+        """
+        caption, processed_image_paths, post_set = self.prepared_post
+
+        container_id = self.create_container(caption, processed_image_paths)
+        try:
+            media_id = self.publish_container(container_id)
+        except UnconfirmedPostError:
+            self._mark_unconfirmed(post_set)
+            raise
+
+        logging.info(
+            f"アカウント {self.account['username']} で投稿セット '{post_set}' をAPIで投稿しました。投稿ID: {media_id}"
         )
-        
-        if len(all_post_buttons) < 2:
-            raise Exception("必要な数のPostボタンが見つかりません。")
-        
-        final_post_button = all_post_buttons[1]
-        self.driver.execute_script("arguments[0].click();", final_post_button)
-        
-        time.sleep(30)
+        self.post_manager.remove_post_set(post_set, self.account['username'])
 
-        logging.info(f"アカウント {self.account['username']} で投稿セット '{post_set}' の投稿に成功しました。")
-        self.post_manager.remove_post_set(post_set)
+    @retry(step='api_container')
+    def create_container(self, caption, processed_image_paths):
+        """投稿内容のメディアコンテナを作成する"""
+        with self.span('api_container'):
+            return self.publisher.create_container(self.account, caption, processed_image_paths)
+
+    @retry(step='api_publish')
+    def publish_container(self, container_id):
+        """メディアコンテナを公開する（応答を確認できなかった場合は publisher が UnconfirmedPostError とし、再送信しない）"""
+        with self.span('api_publish'):
+            return self.publisher.publish_container(self.account, container_id)
 
     def run(self):
         """自動投稿プロセスの実行"""
+        if self.started_at is None:
+            self.started_at = time.monotonic()
         try:
-            self.setup_driver()
-            self.driver.get("https://www.threads.net/?hl=ja")
-            WebDriverWait(self.driver, 20).until(
-                EC.presence_of_element_located((By.TAG_NAME, "body"))
-            )
-            logging.info("Threadsのページを正常に読み込みました。")
-
-            self.click_login_link()
-            time.sleep(15)
-            self.login()
-            time.sleep(22)
-            self.post_thread()
+            with self.span('prepare_post'):
+                self.prepare_post()
+            if self.publisher and self.publisher.has_credentials(self.account):
+                with self.span('api_post'):
+                    self.post_via_api()
+            else:
+                self.setup_driver()
+                # ページの読み込みとログインリンクのクリックは login() 内で行う
+                with self.span('login'):
+                    self.login()
+                with self.span('post_thread'):
+                    self.post_thread()
+            self.succeeded = True
             
             logging.info(f"アカウント {self.account['username']} での操作が完了しました。")
         except Exception as e:
+            self.error = e
             logging.error(f"アカウント {self.account['username']} でエラーが発生しました: {str(e)}")
+            if self.prepared_post and not self.post_consumed:
+                self.post_manager.record_failure(self.prepared_post[2], self.account['username'])
             raise
+        finally:
+            if self.prefetcher and self.prepared_post:
+                self.prefetcher.release(self.prepared_post[2])
+
+    def cleanup(self, capture=True):
+        """
+        リソースのクリーンアップ（複数回・別スレッドから呼ばれても安全）
+
+        :param capture: Falseの場合はブラウザの状態を記録しない（応答しないブラウザを強制終了する場合など）
+        """
+        with self._cleanup_lock:
+            driver, self.driver = self.driver, None
+        if driver:
+            self._cleanup_driver(driver, capture)
 
-    def cleanup(self):
-        """リソースのクリーンアップ"""
-        if self.driver:
-            self.driver.save_screenshot(f"logs/final_state_screenshot_{self.account['username']}.png")
-            logging.info(f"スクリーンショットを保存しました: logs/final_state_screenshot_{self.account['username']}.png")
-            self.driver.quit()
-            logging.info("ブラウザを終了しました。")
\ No newline at end of file
+    def _cleanup_driver(self, driver, capture=True):
+        """失敗時（または抽出時）にブラウザの状態を記録し、ドライバーを返却または終了する"""
+        with self.span('cleanup'):
+            if capture and artifacts.should_capture(self.succeeded):
+                with self.span('capture_artifacts'):
+                    artifacts.capture(driver, self.account['username'], 'sampled' if self.succeeded else 'failure', {
+                        'error': str(self.error) if self.error else None,
+                        'error_type': type(self.error).__name__ if self.error else None,
+                        'post_set': self.prepared_post[2] if self.prepared_post else None,
+                        'completed_steps': list(self.checkpoints),
+                    })
+            self.rss_mb = browser_rss_mb(driver)
+            if self.rss_mb is not None:
+                metrics.gauge('browser_rss_megabytes', round(self.rss_mb, 1), account=self.account['username'], mode=self.browser_mode)
+                logging.info(f"ブラウザのメモリ使用量: {self.rss_mb:.0f}MB（{self.browser_mode}モード）")
+            if self.driver_pool:
+                self.driver_pool.release(self.account['username'], driver, healthy=self.succeeded)
+            else:
+                driver.quit()
+                logging.info("ブラウザを終了しました。")
\ No newline at end of file
@@ -1,51 +1,370 @@
+import atexit
+import contextvars
 import json
 import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
 import time
 import configparser
+from contextlib import contextmanager
 from functools import wraps
+from selenium.common.exceptions import (
+    InvalidArgumentException, InvalidSessionIdException, NoSuchWindowException, WebDriverException
+)
+from metrics import metrics
 
-def load_config():
+def load_config(path='config/config.ini'):
     """設定ファイルを読み込む"""
     config = configparser.ConfigParser()
-    with open('config/config.ini', 'r', encoding='utf-8') as f:
+    with open(path, 'r', encoding='utf-8') as f:
         config.read_file(f)
     return config
 
-def load_accounts():
+def load_accounts(path='config/accounts.json'):
     """アカウント情報を読み込む"""
-    with open('config/accounts.json', 'r', encoding='utf-8') as f:
+    with open(path, 'r', encoding='utf-8') as f:
         data = json.load(f)
     return data['accounts']
 
-def setup_logging():
-    """ログの設定"""
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(levelname)s: %(message)s',
-        handlers=[
-            logging.FileHandler("logs/automation.log", encoding='utf-8'),
-            logging.StreamHandler()
-        ]
-    )
+# ログに自動で付加するコンテキスト（アカウント名・投稿セット・サイクルID）
+_log_context = contextvars.ContextVar('log_context', default={})
 
-def retry(max_attempts, delay=5):
+# setup_logging で開始したQueueListener
+_log_listener = None
+
+TEXT_LOG_FORMAT = '%(asctime)s - %(levelname)s: %(context)s%(message)s'
+
+
+def set_log_context(**values):
+    """
+    現在のコンテキスト（スレッド・タスク）のログに付加する値を設定する
+
+    :param values: account / post_set / cycle などの値
+    """
+    _log_context.set({**_log_context.get(), **values})
+
+
+@contextmanager
+def log_context(**values):
+    """
+    ブロック内のログに値を付加する
+
+    :param values: account / post_set / cycle などの値
+    """
+    token = _log_context.set({**_log_context.get(), **values})
+    try:
+        yield
+    finally:
+        _log_context.reset(token)
+
+
+class _ContextFilter(logging.Filter):
+    """ログを出力したスレッドのコンテキストをレコードに写す（キューに入れる前に呼ばれる）"""
+
+    def filter(self, record):
+        context = _log_context.get()
+        record.log_context = context
+        record.context = ''.join(f"[{key}={value}] " for key, value in context.items())
+        return True
+
+
+class _LocalQueueHandler(logging.handlers.QueueHandler):
+    """
+    同一プロセス内のキューに入れるだけのハンドラー
+
+    標準のQueueHandlerは呼び出し元のスレッドでメッセージを整形するため、
+    整形もQueueListener側のスレッドで行うよう、レコードをそのままキューに入れる。
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """ログを1行1レコードのJSONで出力するフォーマッター"""
+
+    def format(self, record):
+        event = {
+            'timestamp': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+            **getattr(record, 'log_context', {}),
+        }
+        if record.exc_info:
+            event['exception'] = self.formatException(record.exc_info)
+        return json.dumps(event, ensure_ascii=False, default=str)
+
+
+class _TextFormatter(logging.Formatter):
+    """コンテキストを持たないレコード（別のハンドラー経由など）も整形できるテキストフォーマッター"""
+
+    def format(self, record):
+        if not hasattr(record, 'context'):
+            record.context = ''
+        return super().format(record)
+
+
+def _create_file_handler(config):
+    """設定に従ってローテーション付きのファイルハンドラーを作成する"""
+    log_file = config.get('Logging', 'log_file', fallback='logs/automation.log')
+    directory = os.path.dirname(log_file)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    backup_count = config.getint('Logging', 'backup_count', fallback=5)
+    rotation = config.get('Logging', 'rotation', fallback='size')
+    if rotation == 'time':
+        return logging.handlers.TimedRotatingFileHandler(
+            log_file, when=config.get('Logging', 'when', fallback='midnight'),
+            backupCount=backup_count, encoding='utf-8'
+        )
+    if rotation == 'size':
+        return logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=config.getint('Logging', 'max_bytes', fallback=10 * 1024 * 1024),
+            backupCount=backup_count, encoding='utf-8'
+        )
+    raise ValueError(f"不明なログのローテーション方式です: {rotation}（size / time のいずれかを指定してください）")
+
+
+def setup_logging(config=None):
+    """
+    ログの設定
+
+    ログはキューに入れるだけで呼び出し元に戻り、整形とファイル・コンソールへの書き込みは
+    QueueListenerのスレッドで行う。設定は [Logging] セクションから読み込む。
+
+    :param config: 設定情報（Noneの場合は既定値）
+    :return: 開始したQueueListener
+    """
+    global _log_listener
+    if config is None:
+        config = configparser.ConfigParser()
+
+    if config.get('Logging', 'format', fallback='text') == 'json':
+        file_formatter = JsonFormatter()
+    else:
+        file_formatter = _TextFormatter(TEXT_LOG_FORMAT)
+    file_handler = _create_file_handler(config)
+    file_handler.setFormatter(file_formatter)
+    handlers = [file_handler]
+    if config.getboolean('Logging', 'console', fallback=True):
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(_TextFormatter(TEXT_LOG_FORMAT))
+        handlers.append(console_handler)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = _LocalQueueHandler(log_queue)
+    queue_handler.addFilter(_ContextFilter())
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(config.get('Logging', 'level', fallback='INFO').upper())
+    # 古いキューに残ったログを書き出してからファイルを閉じる（Windowsでは開いたままだとローテーションに失敗する）
+    _stop_listener(_log_listener)
+
+    _log_listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _log_listener.start()
+    return _log_listener
+
+
+def _stop_listener(listener):
+    """
+    QueueListenerを停止し、その出力先のハンドラーを閉じる
+
+    :param listener: 停止するQueueListener（Noneの場合は何もしない）
+    """
+    if listener is None:
+        return
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
+
+
+def stop_logging():
+    """キューに残っているログを書き出してQueueListenerを停止する"""
+    global _log_listener
+    if _log_listener:
+        _stop_listener(_log_listener)
+        _log_listener = None
+        for handler in logging.getLogger().handlers[:]:
+            if isinstance(handler, logging.handlers.QueueHandler):
+                logging.getLogger().removeHandler(handler)
+
+
+atexit.register(stop_logging)
+
+
+class FatalError(Exception):
+    """再試行しても回復しないエラー"""
+
+
+class RetryableError(Exception):
+    """再試行で回復する可能性のあるエラー"""
+
+
+class RetryError(FatalError):
+    """再試行の上限または予算に達したエラー"""
+
+
+class UnconfirmedPostError(FatalError):
+    """投稿を送信した後に結果を確認できなかったエラー（実際には投稿されている可能性があるため再送信しない）"""
+
+
+# ブラウザ自体が失われている・引数が不正など、同じステップを再試行しても回復しないWebDriverのエラー
+FATAL_WEBDRIVER_ERRORS = (InvalidSessionIdException, NoSuchWindowException, InvalidArgumentException)
+
+
+def is_retryable(error):
+    """
+    エラーが再試行の対象かどうかを判定する
+
+    :param error: 発生した例外
+    :return: 再試行の対象であればTrue
+    """
+    if isinstance(error, FatalError):
+        return False
+    if isinstance(error, RetryableError):
+        return True
+    if isinstance(error, FATAL_WEBDRIVER_ERRORS):
+        return False
+    return isinstance(error, (WebDriverException, ConnectionError, TimeoutError))
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts=3, base_delay=5, max_delay=60, multiplier=2, jitter=0.5):
+        """
+        RetryPolicyクラスのコンストラクタ
+
+        :param max_attempts: 最大試行回数
+        :param base_delay: 1回目の再試行までの待機時間（秒）
+        :param max_delay: 待機時間の上限（秒）
+        :param multiplier: 再試行ごとの待機時間の倍率
+        :param jitter: 待機時間をランダムに短くする割合（0〜1）
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        設定ファイルの [Settings] セクションからRetryPolicyを生成する
+
+        :param config: 設定情報
+        :return: RetryPolicyインスタンス
+        """
+        return cls(
+            max_attempts=config.getint('Settings', 'max_retries', fallback=3),
+            base_delay=config.getfloat('Settings', 'retry_delay', fallback=5),
+            max_delay=config.getfloat('Settings', 'retry_max_delay', fallback=60),
+            jitter=config.getfloat('Settings', 'retry_jitter', fallback=0.5),
+        )
+
+    def delay(self, attempt):
+        """
+        指数バックオフとジッターによる待機時間を計算する
+
+        :param attempt: 失敗した試行の回数（1始まり）
+        :return: 待機時間（秒）
+        """
+        delay = min(self.max_delay, self.base_delay * self.multiplier ** (attempt - 1))
+        return delay * (1 - self.jitter * random.random())
+
+
+class RetryBudget:
+    def __init__(self, total=None):
+        """
+        RetryBudgetクラスのコンストラクタ
+
+        1回の実行（1アカウント分の処理）全体で使える再試行の回数を管理する。
+
+        :param total: 再試行の総数の上限（Noneの場合は無制限）
+        """
+        self.total = total
+        self.used = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        設定ファイルの [Settings] retry_budget からRetryBudgetを生成する（0で無制限）
+
+        :param config: 設定情報
+        :return: RetryBudgetインスタンス
+        """
+        total = config.getint('Settings', 'retry_budget', fallback=0)
+        return cls(total if total > 0 else None)
+
+    def consume(self):
+        """
+        再試行を1回分消費する
+
+        :return: 予算が残っていて消費できた場合はTrue
+        """
+        with self._lock:
+            if self.total is not None and self.used >= self.total:
+                return False
+            self.used += 1
+            return True
+
+
+def retry(max_attempts=3, delay=5, step=None, before_retry=None):
     """
     リトライデコレータ
-    :param max_attempts: 最大試行回数
-    :param delay: リトライ間の待機時間（秒）
+
+    再試行の対象となるエラー（is_retryable）の場合のみ、指数バックオフで待機して再試行する。
+    メソッドに付けた場合、インスタンスに retry_policy / retry_budget / checkpoints 属性があればそれを使用する。
+    step を指定すると成功時の戻り値を checkpoints に記録し、再度呼ばれた場合は実行せずに記録した値を返す。
+
+    :param max_attempts: 最大試行回数（retry_policy が無い場合に使用）
+    :param delay: 1回目の再試行までの待機時間（秒）（retry_policy が無い場合に使用）
+    :param step: チェックポイントに記録するステップ名
+    :param before_retry: 再試行の直前に、関数と同じ引数で呼び出す関数（画面の状態を戻すなど）
     """
     def decorator(func):
+        label = step or func.__name__
+
         @wraps(func)
         def wrapper(*args, **kwargs):
-            attempts = 0
-            while attempts < max_attempts:
+            owner = args[0] if args else None
+            policy = getattr(owner, 'retry_policy', None) or RetryPolicy(max_attempts, delay)
+            budget = getattr(owner, 'retry_budget', None)
+            checkpoints = getattr(owner, 'checkpoints', None) if step else None
+            if checkpoints is not None and step in checkpoints:
+                logging.info(f"ステップ '{step}' は完了済みのためスキップします。")
+                return checkpoints[step]
+
+            attempt = 1
+            while True:
                 try:
-                    return func(*args, **kwargs)
+                    if attempt > 1 and before_retry:
+                        before_retry(*args, **kwargs)
+                    result = func(*args, **kwargs)
+                    break
                 except Exception as e:
-                    attempts += 1
-                    logging.warning(f"試行 {attempts} 回目が失敗しました: {str(e)}。{delay}秒後に再試行します...")
-                    time.sleep(delay)
-            raise Exception(f"関数 {func.__name__} が {max_attempts} 回の試行後も失敗しました")
+                    if not is_retryable(e):
+                        raise
+                    if attempt >= policy.max_attempts:
+                        raise RetryError(f"{label} が {attempt} 回の試行後も失敗しました: {str(e)}") from e
+                    if budget is not None and not budget.consume():
+                        raise RetryError(f"再試行の上限に達したため {label} を中止します: {str(e)}") from e
+                    wait = policy.delay(attempt)
+                    logging.warning(f"{label} の試行 {attempt} 回目が失敗しました: {str(e)}。{wait:.1f}秒後に再試行します...")
+                    metrics.increment('retry', step=label)
+                    time.sleep(wait)
+                    attempt += 1
+
+            if checkpoints is not None:
+                checkpoints[step] = result
+            return result
         return wrapper
     return decorator
 
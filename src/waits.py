@@ -0,0 +1,62 @@
+# waits.py
+
+import logging
+import random
+import time
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.support.ui import WebDriverWait
+
+
+def document_ready():
+    """
+    document.readyState が interactive 以降になるまで待機する条件
+
+    :return: WebDriverWait.until に渡す条件関数
+    """
+    def _predicate(driver):
+        return driver.execute_script("return document.readyState;") in ('interactive', 'complete')
+    return _predicate
+
+
+class Waiter:
+    def __init__(self, config):
+        """
+        Waiterクラスのコンストラクタ
+
+        各ステップをDOMの状態変化で完了させるための待機処理と、
+        その上に任意で加える人間らしい間隔（ペーシング）を提供する。
+
+        :param config: 設定情報を含むConfigParserオブジェクト
+        """
+        self.timeout = config.getfloat('Waits', 'timeout', fallback=20)
+        self.post_confirm_timeout = config.getfloat('Waits', 'post_confirm_timeout', fallback=60)
+        self.poll_frequency = config.getfloat('Waits', 'poll_frequency', fallback=0.25)
+        self.min_pace = config.getfloat('Waits', 'min_pace', fallback=0)
+        self.max_pace = config.getfloat('Waits', 'max_pace', fallback=0)
+
+    def until(self, driver, condition, description, timeout=None):
+        """
+        条件が成立するまで待機する
+
+        :param driver: Seleniumのwebdriverインスタンス
+        :param condition: WebDriverWait.until に渡す条件
+        :param description: ログ・エラーメッセージ用の待機内容の説明
+        :param timeout: タイムアウト秒数（省略時は設定値）
+        :return: 条件関数の戻り値
+        """
+        timeout = self.timeout if timeout is None else timeout
+        start = time.monotonic()
+        try:
+            result = WebDriverWait(driver, timeout, poll_frequency=self.poll_frequency).until(condition)
+        except TimeoutException:
+            raise TimeoutException(f"{description} を {timeout:.0f}秒以内に確認できませんでした。")
+        logging.info(f"{description} を確認しました（{time.monotonic() - start:.2f}秒）。")
+        return result
+
+    def pace(self):
+        """設定されている場合のみ、ステップ間にランダムな間隔を空ける"""
+        if self.max_pace <= 0:
+            return
+        wait_time = random.uniform(self.min_pace, max(self.min_pace, self.max_pace))
+        logging.info(f"{wait_time:.2f}秒待機します。")
+        time.sleep(wait_time)